@@ -0,0 +1,153 @@
+import json
+import os
+from heapq import nlargest
+
+from Library_Records import date_ordinal, date_text
+
+ANALYTICS_FILE = "library_analytics.json"
+DAILY_COLUMNS = ("Date", "Borrowed", "Returned", "Fines")
+
+
+class Analytics:
+    # Circulation totals kept up to date as loans are opened and closed, so
+    # reports never read the raw history. Each borrow or return adds to a few
+    # counters; rebuild() recounts everything from the full history when the
+    # saved totals may have drifted (another program wrote without them).
+    # Totals are saved with the newest Loan ID they counted, so matches() can
+    # tell whether storage still holds exactly the loans they cover.
+    def __init__(self, file_name=ANALYTICS_FILE):
+        self.file_name = file_name
+        self.clear()
+        self.dirty = False
+
+    def clear(self):
+        self.titles = {}
+        self.genres = {}
+        self.days = {}
+        self.borrows = 0
+        self.returns = 0
+        self.loan_days = 0
+        self.fines = 0
+        self.last_loan_id = 0
+        self.dirty = True
+
+    def _day(self, value):
+        ordinal = date_ordinal(value)
+        key = date_text(ordinal) if ordinal is not None else str(value)
+        day = self.days.get(key)
+        if day is None:
+            day = self.days[key] = [0, 0, 0]
+        return day
+
+    def borrowed(self, loan, book=None):
+        book_id = loan.get("Book ID", "")
+        title = self.titles.get(book_id)
+        if title is None:
+            name = loan.get("Book Title", "") or (book.get("Book Title", "") if book is not None else "")
+            title = self.titles[book_id] = [name, 0]
+        title[1] += 1
+        genre = (book.get("Genre", "") if book is not None else "") or "Unknown"
+        self.genres[genre] = self.genres.get(genre, 0) + 1
+        self._day(loan.get("Date Borrowed", ""))[0] += 1
+        loan_id = loan.get("Loan ID")
+        if type(loan_id) is int and loan_id > self.last_loan_id:
+            self.last_loan_id = loan_id
+        self.borrows += 1
+        self.dirty = True
+
+    def returned(self, loan):
+        fine = loan.get("Fine", 0) or 0
+        day = self._day(loan.get("Date Return", ""))
+        day[1] += 1
+        day[2] += fine
+        borrowed = date_ordinal(loan.get("Date Borrowed", ""))
+        returned = date_ordinal(loan.get("Date Return", ""))
+        if borrowed is not None and returned is not None:
+            self.loan_days += returned - borrowed
+        self.returns += 1
+        self.fines += fine
+        self.dirty = True
+
+    def rebuild(self, loans, books):
+        # books: Book ID -> book, for the books still in the catalog.
+        self.clear()
+        for loan in loans:
+            self.borrowed(loan, books.get(loan.get("Book ID", "")))
+            if loan.get("Status", "Borrowed") == "Returned":
+                self.returned(loan)
+        return self
+
+    def matches(self, last_loan_id, open_count):
+        # True when no stored loan is newer than the last one counted and as many
+        # are open as were counted borrowed and not returned.
+        return last_loan_id <= self.last_loan_id and open_count == self.borrows - self.returns
+
+    def average_loan_days(self):
+        return self.loan_days / self.returns if self.returns else 0.0
+
+    def top_titles(self, count=10):
+        top = nlargest(count, self.titles.items(), key=lambda item: (item[1][1], item[0]))
+        return [(book_id, title, borrows) for book_id, (title, borrows) in top]
+
+    def top_genres(self, count=10):
+        return nlargest(count, self.genres.items(), key=lambda item: (item[1], item[0]))
+
+    def daily(self, days=None):
+        rows = sorted(self.days.items())
+        if days is not None:
+            rows = rows[-days:]
+        return [dict(zip(DAILY_COLUMNS, [day] + counts)) for day, counts in rows]
+
+    def report(self, top=10, days=30):
+        return {
+            "borrows": self.borrows,
+            "returns": self.returns,
+            "average_loan_days": self.average_loan_days(),
+            "fines_collected": self.fines,
+            "top_titles": self.top_titles(top),
+            "top_genres": self.top_genres(top),
+            "daily": self.daily(days),
+        }
+
+    #Persistence
+    def snapshot(self):
+        return {
+            "titles": self.titles,
+            "genres": self.genres,
+            "days": self.days,
+            "borrows": self.borrows,
+            "returns": self.returns,
+            "loan_days": self.loan_days,
+            "fines": self.fines,
+            "last_loan_id": self.last_loan_id,
+        }
+
+    def load(self):
+        # False when there is nothing saved yet (or it is unreadable) and a rebuild is due.
+        try:
+            with open(self.file_name, encoding="utf-8") as file:
+                data = json.load(file)
+            self.titles = data["titles"]
+            self.genres = data["genres"]
+            self.days = data["days"]
+            self.borrows = data["borrows"]
+            self.returns = data["returns"]
+            self.loan_days = data["loan_days"]
+            self.fines = data["fines"]
+            self.last_loan_id = data["last_loan_id"]
+        except (OSError, ValueError, KeyError):
+            self.clear()
+            return False
+        self.dirty = False
+        return True
+
+    def write(self, text):
+        temp_file = self.file_name + ".tmp"
+        with open(temp_file, "w", encoding="utf-8") as file:
+            file.write(text)
+        os.replace(temp_file, self.file_name)
+
+    def save(self):
+        if self.dirty:
+            self.write(json.dumps(self.snapshot()))
+            self.dirty = False
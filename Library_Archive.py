@@ -0,0 +1,114 @@
+import os
+import pickle
+from datetime import date
+
+from Library_Records import Loan
+from Library_Snapshot import Snapshot, write_snapshot
+from Library_Storage import normalize_loan
+
+ARCHIVE_DIRECTORY = "history_archive"
+UNKNOWN_PERIOD = "0000-00"
+
+
+def period_of(loan):
+    value = str(loan.get("Date Borrowed", ""))
+    if len(value) >= 7 and value[4] == "-" and value[:4].isdigit() and value[5:7].isdigit():
+        return value[:7]
+    return UNKNOWN_PERIOD
+
+
+def shift_period(period, months):
+    year, month = int(period[:4]), int(period[5:7])
+    index = year * 12 + month - 1 + months
+    return f"{index // 12:04d}-{index % 12 + 1:02d}"
+
+
+class HistoryArchive:
+    # Closed loans grouped by the month they were borrowed, one file per month.
+    # Each file is a binary snapshot (see Library_Snapshot) holding only loans;
+    # older archives wrote pickled tuples to .pkl files, which are still read.
+    def __init__(self, directory=ARCHIVE_DIRECTORY):
+        self.directory = directory
+
+    def _file(self, period, extension=".snap"):
+        return os.path.join(self.directory, f"{period}{extension}")
+
+    def partitions(self):
+        if not os.path.isdir(self.directory):
+            return []
+        periods = {name[:7] for name in os.listdir(self.directory) if name.endswith((".snap", ".pkl"))}
+        return sorted(periods, reverse=True)
+
+    def open_partition(self, period):
+        # The partition mapped for lazy lookups and Loan ID range scans; None for
+        # a legacy or missing one. The caller closes it.
+        file_name = self._file(period)
+        return Snapshot(file_name) if os.path.exists(file_name) else None
+
+    def load_partition(self, period, first=None, last=None):
+        # The partition's loans with first <= Loan ID <= last (all by default),
+        # read from the mapped file as they are consumed.
+        snapshot = self.open_partition(period)
+        if snapshot is not None:
+            try:
+                yield from snapshot.loans(first, last)
+            finally:
+                snapshot.close()
+            return
+        file_name = self._file(period, ".pkl")
+        if not os.path.exists(file_name):
+            return
+        with open(file_name, "rb") as file:
+            rows = pickle.load(file)
+        for row in rows:
+            loan = Loan(*row)
+            if (first is None or loan.loan_id >= first) and (last is None or loan.loan_id <= last):
+                yield loan
+
+    def _write_partition(self, period, loans):
+        os.makedirs(self.directory, exist_ok=True)
+        file_name = self._file(period)
+        temp_file = file_name + ".tmp"
+        with open(temp_file, "wb") as file:
+            write_snapshot(file, (), loans)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, file_name)
+        legacy_file = self._file(period, ".pkl")
+        if os.path.exists(legacy_file):
+            os.remove(legacy_file)
+
+    def append(self, loans):
+        by_period = {}
+        for loan in loans:
+            by_period.setdefault(period_of(loan), []).append(normalize_loan(loan))
+
+        for period, new_loans in by_period.items():
+            # Keyed by Loan ID so re-running an interrupted archive does not duplicate.
+            merged = {loan["Loan ID"]: loan for loan in self.load_partition(period)}
+            for loan in new_loans:
+                merged[loan["Loan ID"]] = loan
+            self._write_partition(period, sorted(merged.values(), key=lambda loan: loan["Loan ID"]))
+        return sorted(by_period)
+
+
+def archive_closed_loans(storage, archive, keep_periods=1, today=None):
+    # Moves returned loans borrowed before the last keep_periods months out of the
+    # live history. The archive is written before anything is deleted.
+    cutoff = shift_period((today or date.today()).strftime("%Y-%m"), 1 - keep_periods)
+    history = storage.load_history()
+    if not history:
+        return 0
+
+    # The newest loan always stays live so new Loan IDs keep counting up from it.
+    newest_id = max(loan["Loan ID"] for loan in history)
+    closed = [
+        loan for loan in history
+        if loan.get("Status", "Borrowed") == "Returned" and period_of(loan) < cutoff and loan["Loan ID"] != newest_id
+    ]
+    if not closed:
+        return 0
+
+    archive.append(closed)
+    storage.delete_loans([loan["Loan ID"] for loan in closed])
+    return len(closed)
@@ -0,0 +1,288 @@
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import date, timedelta
+from itertools import islice
+
+from Library_Core import LibraryCore, calculate_fine, format_date
+from Library_Journal import JournalStorage
+from Library_Metrics import metrics
+from Library_Storage import PickleStorage, SQLiteStorage
+
+WORDS = (
+    "the of and a in love war night house river garden shadow secret king queen city dark light lost "
+    "last first song stone fire winter summer road sea star moon blood silver golden time world heart "
+    "dream journey island mountain forest letter daughter son brother sister story history science art"
+).split()
+AUTHORS = [f"{first} {last}" for first in ("Anna", "Ben", "Chai", "Dao", "Emil", "Fah", "Gita", "Hiro", "Ines", "Jon")
+           for last in ("Smith", "Wong", "Suzuki", "Garcia", "Kim", "Novak", "Silva", "Chen", "Singh", "Brown")]
+GENRES = ["Fiction", "Mystery", "Romance", "Science", "History", "Fantasy", "Biography", "Children", "Poetry", "Travel"]
+BATCH_SIZE = 10000
+# Data and date-dependent scenarios are pinned to this day, so runs on different
+# days (or versions) generate the same library and stay comparable.
+REFERENCE_DATE = date(2025, 1, 1)
+
+
+def generate_books(count, seed):
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "Book ID": f"B{i:07d}",
+            "Book Title": " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 6))).title(),
+            "Author Name": rng.choice(AUTHORS),
+            "Genre": rng.choice(GENRES),
+            "Available": True,
+        }
+
+
+def generate_history(count, book_count, seed, start=date(2015, 1, 1), open_loans=0, as_of=REFERENCE_DATE):
+    # Closed loans spread over the years from start to as_of; the last open_loans
+    # records stay open, each on a different book, so the data set is internally consistent.
+    rng = random.Random(seed + 1)
+    span = max((as_of - start).days - 30, 1)
+    for i in range(count):
+        borrowed = start + timedelta(days=span * i // max(count, 1))
+        due = borrowed + timedelta(days=15)
+        loan = {
+            "Loan ID": i + 1,
+            "Borrower Name": f"{rng.choice(AUTHORS)}",
+            "Book ID": f"B{i % book_count:07d}",
+            "Book Title": "",
+            "Date Borrowed": format_date(borrowed),
+            "Date Return": format_date(due),
+            "Status": "Borrowed",
+            "Fine": 0,
+        }
+        if i < count - open_loans:
+            returned = due + timedelta(days=rng.randint(-10, 10))
+            loan["Status"] = "Returned"
+            loan["Fine"] = calculate_fine(loan["Date Return"], format_date(returned))
+            loan["Date Return"] = format_date(returned)
+        yield loan
+
+
+def batches(items, size=BATCH_SIZE):
+    items = iter(items)
+    while True:
+        batch = list(islice(items, size))
+        if not batch:
+            return
+        yield batch
+
+
+def open_backend(kind, directory):
+    if kind == "pickle":
+        return PickleStorage(os.path.join(directory, "book_data.pkl"), os.path.join(directory, "history.pkl"))
+    if kind == "journal":
+        return JournalStorage(os.path.join(directory, "library.snapshot"), os.path.join(directory, "library.journal"))
+    return SQLiteStorage(os.path.join(directory, "library.db"))
+
+
+def summarize(samples):
+    samples = sorted(samples)
+    return {
+        "count": len(samples),
+        "min": samples[0],
+        "median": statistics.median(samples),
+        "mean": statistics.fmean(samples),
+        "p95": samples[min(len(samples) - 1, int(len(samples) * 0.95))],
+        "max": samples[-1],
+    }
+
+
+class Timer:
+    def __init__(self):
+        self.results = {}
+
+    def measure(self, name, fn, repeat=1):
+        samples = []
+        result = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            result = fn()
+            samples.append(time.perf_counter() - start)
+        self.results.setdefault(name, []).extend(samples)
+        return result
+
+    def report(self):
+        return {name: summarize(samples) for name, samples in self.results.items()}
+
+
+def seed_storage(storage, books, loans, seed, as_of=REFERENCE_DATE):
+    open_loans = min(books // 20, loans)
+    for batch in batches(generate_books(books, seed)):
+        storage.add_books(batch)
+    for batch in batches(generate_history(loans, books, seed, open_loans=open_loans, as_of=as_of)):
+        storage.add_loans(batch)
+    # Books on open loans must show as unavailable.
+    for i in range(loans - open_loans, loans):
+        storage.set_book_available(f"B{i % books:07d}", False)
+
+
+def run_headless(storage, timer, books, repeat, seed, as_of=REFERENCE_DATE):
+    rng = random.Random(seed + 2)
+    today = format_date(as_of)
+    core = LibraryCore(storage)
+    cache = core.data
+
+    timer.measure("load_catalog", lambda: (cache.invalidate(), cache.catalog()))
+    timer.measure("load_history", lambda: cache.loans())
+    timer.measure("build_title_index", lambda: cache.catalog().title_index())
+
+    # search_books: one query per keystroke, as typed into the search box.
+    for _ in range(repeat):
+        word = rng.choice(WORDS)
+        for end in range(1, len(word) + 1):
+            timer.measure("search_books", lambda: core.search(word[:end]))
+    timer.measure("build_fuzzy_index", lambda: cache.catalog().fuzzy_index())
+    for _ in range(repeat):
+        word = rng.choice(WORDS)
+        for end in range(1, len(word) + 1):
+            timer.measure("search_ranked", lambda: core.search_ranked(word[:end]))
+
+    # display_books / display_history without Tk: building every row's values.
+    timer.measure("display_books_rows", lambda: [tuple(book.values()) for book in cache.books()], repeat)
+    timer.measure("display_history_rows", lambda: [tuple(loan.values()) for loan in cache.history()], repeat)
+    timer.measure("overdue_report", lambda: core.overdue_report(today), repeat)
+
+    available = [book["Book ID"] for book in cache.books() if book.get("Available", True)]
+    rng.shuffle(available)
+    loans = []
+    for book_id in available[:repeat * 10]:
+        loans.append(timer.measure("add_data", lambda: core.borrow("Bench Reader", book_id, today)))
+    for loan in loans:
+        timer.measure("return_book", lambda: core.return_loan(loan, today))
+
+    new_books = [{"Book ID": f"N{seed}-{i}", "Book Title": f"Bench Title {i}", "Author Name": "", "Genre": ""}
+                 for i in range(repeat * 10)]
+    for book in new_books:
+        timer.measure("save_book_data", lambda: core.add_book(book))
+    for book in new_books:
+        timer.measure("delete_book", lambda: core.delete_book(book["Book ID"]))
+    return core
+
+
+def run_tk(core, timer, repeat):
+    # Treeview refreshes on a hidden root; needs customtkinter and a display.
+    try:
+        import tkinter
+        from tkinter import ttk
+        from Library_Management import BookDataScreen, HistoryScreen, TreeTable
+        root = tkinter.Tk()
+    except Exception as e:
+        return f"skipped: {e}"
+    root.withdraw()
+
+    def fill(table, rows):
+        table.sync(rows)
+        while table.pending:
+            root.update()
+
+    try:
+        for name, columns, rows in (
+            ("display_books", 5, lambda: ((book["Book ID"], BookDataScreen.book_values(book)) for book in core.data.books())),
+            ("display_history", 6, lambda: ((loan["Loan ID"], HistoryScreen.history_values(loan)) for loan in core.data.history())),
+        ):
+            for _ in range(repeat):
+                tree = ttk.Treeview(root, columns=[str(i) for i in range(columns)], show="headings")
+                table = TreeTable(tree)
+                timer.measure(f"{name}_tk", lambda: fill(table, rows()))
+                timer.measure(f"{name}_tk_refresh", lambda: fill(table, rows()))
+                tree.destroy()
+    finally:
+        root.destroy()
+    return "ok"
+
+
+def git_version():
+    try:
+        return subprocess.run(
+            ["git", "describe", "--always", "--dirty"], capture_output=True, text=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)), check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def compare(report, baseline):
+    old_runs = {(run["storage"], run["books"], run["loans"]): run for run in baseline.get("runs", [])}
+    for run in report["runs"]:
+        old = old_runs.get((run["storage"], run["books"], run["loans"]))
+        if old is None:
+            continue
+        print(f"\n{run['storage']} books={run['books']} loans={run['loans']} (median, new vs baseline)")
+        for name, stats in run["results"].items():
+            if name in old["results"]:
+                before = old["results"][name]["median"]
+                ratio = stats["median"] / before if before else float("inf")
+                print(f"  {name:24} {stats['median'] * 1000:10.3f} ms  {ratio:6.2f}x")
+
+
+def parse_sizes(value):
+    return [int(size) for size in value.split(",")]
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Time the library's core operations on synthetic data.")
+    parser.add_argument("--books", type=parse_sizes, default=[1000, 10000], help="comma separated catalog sizes")
+    parser.add_argument("--loans", type=parse_sizes, default=[10000], help="comma separated history sizes")
+    parser.add_argument("--storage", choices=["sqlite", "journal", "pickle"], default="sqlite")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--today", type=date.fromisoformat, default=REFERENCE_DATE,
+                        help="reference date (YYYY-MM-DD) for generated loans, overdue and fines")
+    parser.add_argument("--tk", action="store_true", help="also time Treeview refreshes on a hidden Tk root")
+    parser.add_argument("--output", default="bench_report.json")
+    parser.add_argument("--compare", help="earlier JSON report to compare against")
+    args = parser.parse_args(argv)
+
+    report = {
+        "version": git_version(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "seed": args.seed,
+        "today": format_date(args.today),
+        "runs": [],
+    }
+    for books in args.books:
+        for loans in args.loans:
+            directory = tempfile.mkdtemp(prefix="library-bench-")
+            timer = Timer()
+            metrics.reset()
+            try:
+                storage = open_backend(args.storage, directory)
+                timer.measure("seed_storage", lambda: seed_storage(storage, books, loans, args.seed, args.today))
+                core = run_headless(storage, timer, books, args.repeat, args.seed, args.today)
+                tk_status = run_tk(core, timer, args.repeat) if args.tk else "not requested"
+                core.close()
+            finally:
+                shutil.rmtree(directory, ignore_errors=True)
+            run = {
+                "storage": args.storage, "books": books, "loans": loans, "tk": tk_status,
+                "results": timer.report(), "instrumentation": metrics.report(),
+            }
+            report["runs"].append(run)
+            print(f"{args.storage} books={books} loans={loans} tk={tk_status}")
+            for name, stats in run["results"].items():
+                print(f"  {name:24} median {stats['median'] * 1000:10.3f} ms  p95 {stats['p95'] * 1000:10.3f} ms")
+
+    with open(args.output, "w", encoding="utf-8") as file:
+        json.dump(report, file, indent=2)
+    print(f"Report written to {args.output}")
+
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as file:
+            compare(report, json.load(file))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
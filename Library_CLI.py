@@ -0,0 +1,163 @@
+import argparse
+import sys
+
+from Library_Analytics import Analytics
+from Library_Archive import HistoryArchive
+from Library_Core import LibraryCore, LibraryError
+from Library_Import import IMPORT_ERRORS
+
+
+def borrow(core, args):
+    loan = core.borrow(args.name, args.book_id, args.date, args.due, args.member)
+    print(f"Loan {loan['Loan ID']}: '{loan['Book Title']}' to {loan['Borrower Name']}, due {loan['Date Return']}")
+
+
+def return_book(core, args):
+    loan = core.return_book(args.book_id, args.date, args.member)
+    fine = loan.get("Fine", 0)
+    print(f"Loan {loan['Loan ID']} returned on {loan['Date Return']}, " + (f"fine {fine} Bath" if fine > 0 else "no fine"))
+
+
+def member(core, args):
+    found = core.member(args.member_id)
+    if found is None:
+        raise LibraryError(f"No loans recorded for member '{args.member_id}'.")
+    fines = core.outstanding_fines(found, args.as_of)
+    print(f"{found.member_id}\t{found.name}\t{found.loan_count} loans\t{fines} Bath outstanding\t{found.fines_paid} Bath paid")
+    for loan in found.open_loans.values():
+        print(f"{loan['Book ID']}\t{loan['Book Title']}\tdue {loan['Date Return']}")
+
+
+def search(core, args):
+    if args.fuzzy:
+        for score, book in core.search_ranked(args.query, args.limit):
+            print(f"{score:.2f}\t{book['Book ID']}\t{book['Book Title']}\t{book['Author Name']}")
+        return
+    for title in core.search(args.query, args.prefix):
+        print(title)
+
+
+def overdue(core, args):
+    report = core.overdue_report(args.as_of, args.next)
+    for loan, fine in report["overdue"]:
+        print(f"{loan['Book ID']}\t{loan['Book Title']}\t{loan['Borrower Name']}\tdue {loan['Date Return']}\t{fine} Bath")
+    print(f"{len(report['overdue'])} overdue as of {report['as_of']}, {report['total_fines']} Bath in fines")
+    if args.next:
+        print(f"Next {len(report['upcoming'])} due:")
+        for loan in report["upcoming"]:
+            print(f"{loan['Book ID']}\t{loan['Book Title']}\t{loan['Borrower Name']}\tdue {loan['Date Return']}")
+
+
+def analytics(core, args):
+    if args.rebuild:
+        print(f"Rebuilt analytics from {core.rebuild_analytics()} loans")
+    report = core.analytics_report(args.top, args.days)
+    print(f"{report['borrows']} loans, {report['returns']} returned, "
+          f"average loan {report['average_loan_days']:.1f} days, {report['fines_collected']} Bath in fines")
+    print("Most borrowed:")
+    for book_id, title, borrows in report["top_titles"]:
+        print(f"{borrows:>8}\t{book_id}\t{title}")
+    print("Genres:")
+    for genre, borrows in report["top_genres"]:
+        print(f"{borrows:>8}\t{genre}")
+    print("Daily:")
+    for day in report["daily"]:
+        print(f"{day['Date']}\t{day['Borrowed']} borrowed\t{day['Returned']} returned\t{day['Fines']} Bath")
+
+
+def import_books(core, args):
+    importer = core.import_books(args.file, args.batch_size).run()
+    for line_number, reason in importer.rejected:
+        print(f"line {line_number}: {reason}", file=sys.stderr)
+    print(importer.summary())
+
+
+def export(core, args):
+    count = core.export(args.kind, args.file)
+    print(f"Exported {count} {args.kind} rows to {args.file}")
+
+
+def archive(core, args):
+    count = core.archive_history(args.keep_months)
+    print(f"Archived {count} returned loans")
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="Library_CLI.py", description="Library Management System without the GUI.")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    command = commands.add_parser("borrow", help="lend a book")
+    command.add_argument("book_id")
+    command.add_argument("--name", required=True, help="borrower name")
+    command.add_argument("--member", default="", help="member ID")
+    command.add_argument("--date", help="date borrowed (YYYY-MM-DD, default today)")
+    command.add_argument("--due", help="due date (YYYY-MM-DD, default 15 days later)")
+    command.set_defaults(run=borrow)
+
+    command = commands.add_parser("return", help="return a borrowed book")
+    command.add_argument("book_id")
+    command.add_argument("--member", default="", help="member returning the copy (default: the oldest loan)")
+    command.add_argument("--date", help="return date (YYYY-MM-DD, default today)")
+    command.set_defaults(run=return_book)
+
+    command = commands.add_parser("member", help="show a member's open loans, outstanding and paid fines")
+    command.add_argument("member_id")
+    command.add_argument("--as-of", help="date fines are counted to (YYYY-MM-DD, default today)")
+    command.set_defaults(run=member)
+
+    command = commands.add_parser("search", help="search book titles")
+    command.add_argument("query")
+    command.add_argument("--prefix", action="store_true", help="match the start of the title only")
+    command.add_argument("--fuzzy", action="store_true", help="rank title, author and genre matches, allowing typos")
+    command.add_argument("--limit", type=int, default=20, help="most results to show with --fuzzy")
+    command.set_defaults(run=search)
+
+    command = commands.add_parser("overdue", help="list overdue loans and their fines")
+    command.add_argument("--as-of", help="report date (YYYY-MM-DD, default today)")
+    command.add_argument("--next", type=int, default=0, help="also list the next N loans falling due")
+    command.set_defaults(run=overdue)
+
+    command = commands.add_parser("import", help="bulk import books from CSV or JSONL")
+    command.add_argument("file")
+    command.add_argument("--batch-size", type=int, default=5000)
+    command.set_defaults(run=import_books)
+
+    command = commands.add_parser("export", help="export books or history to CSV or JSONL")
+    command.add_argument("kind", choices=["books", "history", "daily"])
+    command.add_argument("file")
+    command.set_defaults(run=export)
+
+    command = commands.add_parser("analytics", help="circulation totals kept up to date on every loan")
+    command.add_argument("--top", type=int, default=10, help="titles and genres to list")
+    command.add_argument("--days", type=int, default=14, help="recent days to list")
+    command.add_argument("--rebuild", action="store_true", help="recount everything from the full history first")
+    command.set_defaults(run=analytics)
+
+    command = commands.add_parser("archive", help="move old returned loans into monthly archive files")
+    command.add_argument("--keep-months", type=int, default=1, help="recent months kept in the live history")
+    command.set_defaults(run=archive)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    try:
+        # Only commands that change loans or read the totals pay for loading them.
+        analytics = Analytics() if args.command in ("borrow", "return", "analytics", "export") else None
+        core = LibraryCore(cached=False, archive=HistoryArchive(), analytics=analytics)
+    except IMPORT_ERRORS as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    try:
+        args.run(core, args)
+    except (LibraryError,) + IMPORT_ERRORS as e:
+        print(f"Error: {e}", file=sys.stderr)
+        return 1
+    finally:
+        core.close()
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,338 @@
+import time
+from contextlib import contextmanager
+
+from Library_Catalog import Catalog
+from Library_Events import (BOOK_ADDED, BOOK_DELETED, BOOK_UPDATED, LOAN_CLOSED, LOAN_DELETED, LOAN_OPENED,
+                            LOAN_UPDATED, RELOADED)
+from Library_Loans import LoanHistory
+from Library_Metrics import increment, timer
+from Library_Records import Loan
+from Library_Storage import normalize_loan
+
+
+class LibraryCache:
+    # One in-memory copy of the catalog and history shared by every screen.
+    # The backing files are only re-read when their mtime/size signature changes,
+    # and the signature is checked at most once per check_interval seconds.
+    # Changes are applied in memory first; with an executor the storage write
+    # then happens in the background, otherwise it happens before returning.
+    # Every change, including ones picked up from storage, goes out on events.
+    def __init__(self, storage, check_interval=1.0, executor=None, events=None):
+        self.storage = storage
+        self.check_interval = check_interval
+        self.executor = executor
+        self.events = events
+        self.pending_writes = 0
+        self.failed_writes = 0
+        self.hits = 0
+        self.misses = 0
+        self._catalog = None
+        self._history = None
+        self._signature = None
+        self._last_check = 0.0
+        self._loaded_early = False
+        self._batched = None
+
+    def stats(self):
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "pending_writes": self.pending_writes,
+            "failed_writes": self.failed_writes,
+        }
+
+    def _publish(self, kind, key=None):
+        if self.events is not None:
+            self.events.publish(kind, key)
+
+    def _loan_event(self, loan):
+        if loan.get("Status", "Borrowed") == "Returned":
+            return LOAN_CLOSED
+        return LOAN_OPENED
+
+    def invalidate(self):
+        loaded = self._catalog is not None or self._history is not None
+        self._catalog = None
+        self._history = None
+        if loaded:
+            self._publish(RELOADED)
+
+    def _check(self, force=False):
+        # While our own writes are in flight the files are expected to change.
+        if self.pending_writes:
+            return
+        now = time.monotonic()
+        if not force and now - self._last_check < self.check_interval:
+            return
+        self._last_check = now
+        signature = self.storage.signature()
+        if signature is None or signature != self._signature:
+            changes = None
+            if self._signature is not None and (self._catalog is not None or self._history is not None):
+                changes = self.storage.changes(self._signature)
+            if changes is None:
+                increment("cache.invalidated")
+                self.invalidate()
+                self._signature = signature
+            else:
+                increment("cache.caught_up")
+                self.apply_changes(changes)
+
+    def apply_changes(self, changes):
+        # Changed records are sent whole (None for deleted ones), so applying the
+        # same change twice is harmless.
+        if self._catalog is not None:
+            for book_id, book in changes["books"]:
+                if book is None:
+                    self._catalog.remove(book_id)
+                    self._publish(BOOK_DELETED, book_id)
+                else:
+                    kind = BOOK_UPDATED if book_id in self._catalog else BOOK_ADDED
+                    self._catalog.add(book)
+                    self._publish(kind, book_id)
+        if self._history is not None:
+            for loan_id, loan in changes["loans"]:
+                if loan is None:
+                    self._history.remove(loan_id)
+                    self._publish(LOAN_DELETED, loan_id)
+                else:
+                    old = self._history.get(loan_id)
+                    self._history.update(loan)
+                    if old is None or self._loan_event(old) != self._loan_event(loan):
+                        self._publish(self._loan_event(loan), loan_id)
+                    else:
+                        self._publish(LOAN_UPDATED, loan_id)
+        self._signature = changes["signature"]
+
+    def signature(self):
+        return self._signature
+
+    def refresh(self):
+        self._check(force=True)
+
+    def _loading(self):
+        # A load while writes are still queued reads storage without them, so it
+        # must not be taken as current once they land.
+        if self.pending_writes:
+            self._loaded_early = True
+
+    def _written(self):
+        if self._loaded_early:
+            self._loaded_early = False
+            self._signature = None
+            self._last_check = 0.0
+            return
+        if self.storage.tracks_changes:
+            # Catch up on the next read so changes made elsewhere are not skipped.
+            self._last_check = 0.0
+            return
+        self._signature = self.storage.signature()
+        self._last_check = time.monotonic()
+
+    @contextmanager
+    def batch(self):
+        # Storage writes made inside the block go out as one job in one
+        # storage.batch(), so they are saved together or not at all; a failure
+        # drops the in-memory changes of the whole block.
+        if self._batched is not None:
+            yield
+            return
+        self._batched = []
+        try:
+            yield
+        except Exception:
+            self.invalidate()
+            raise
+        finally:
+            writes, self._batched = self._batched, None
+        if writes:
+            self._write(self._write_all, writes)
+
+    def _write_all(self, writes):
+        with self.storage.batch():
+            for fn, args in writes:
+                fn(*args)
+
+    def _write(self, fn, *args):
+        if self._batched is not None:
+            self._batched.append((fn, args))
+            return
+        if self.executor is None:
+            try:
+                with timer("cache.write"):
+                    fn(*args)
+            except Exception:
+                self.invalidate()
+                raise
+            self._written()
+            return
+        self.pending_writes += 1
+        self.executor.submit(fn, *args, on_done=self._write_done, on_error=self._write_failed)
+
+    def _write_done(self, result):
+        self.pending_writes -= 1
+        if not self.pending_writes:
+            self._written()
+
+    def _write_failed(self, error):
+        # Drop the optimistic state; the next read reloads what actually got saved.
+        increment("cache.failed_write")
+        self.pending_writes -= 1
+        self.failed_writes += 1
+        self.invalidate()
+        if not self.pending_writes:
+            self._written()
+
+    def catalog(self):
+        self._check()
+        if self._catalog is None:
+            self.misses += 1
+            increment("cache.catalog_miss")
+            self._loading()
+            with timer("cache.load_catalog"):
+                self._catalog = Catalog(self.storage.load_books())
+        else:
+            self.hits += 1
+            increment("cache.catalog_hit")
+        return self._catalog
+
+    def preload(self, on_done=None):
+        # Reads the catalog, its search indexes and the history on the executor so
+        # the window can be drawn and used meanwhile. Anything asked for sooner loads as usual, and the
+        # preloaded copy is dropped if storage changed while it was being read.
+        self._check(force=True)
+        if self.executor is None:
+            self.catalog()
+            self.loans()
+            if on_done is not None:
+                on_done()
+            return
+        signature = self._signature
+
+        def loaded(result):
+            catalog, history = result
+            if self._signature == signature and not self.pending_writes:
+                increment("cache.preloaded")
+                if self._catalog is None:
+                    self._catalog = catalog
+                if self._history is None:
+                    self._history = history
+            if on_done is not None:
+                on_done()
+
+        def failed(error):
+            # Screens load (and report the error) themselves.
+            if on_done is not None:
+                on_done()
+
+        self.executor.submit(self._read_all, on_done=loaded, on_error=failed, write=False)
+
+    def _read_all(self):
+        with timer("cache.preload"):
+            catalog = Catalog(self.storage.load_books())
+            # The search indexes too, so the first keystroke does not build them on the Tk thread.
+            catalog.title_index()
+            catalog.fuzzy_index()
+            return catalog, LoanHistory(self.storage.load_history())
+
+    def books(self):
+        return self.catalog().books.values()
+
+    def loans(self):
+        self._check()
+        if self._history is None:
+            self.misses += 1
+            increment("cache.history_miss")
+            self._loading()
+            with timer("cache.load_history"):
+                self._history = LoanHistory(self.storage.load_history())
+        else:
+            self.hits += 1
+            increment("cache.history_hit")
+        return self._history
+
+    def history(self):
+        return self.loans().loans.values()
+
+    def open_loan(self, book_id):
+        return self.loans().open_loan(book_id)
+
+    def open_loans(self):
+        return self.loans().open_loans()
+
+    def member(self, member_id):
+        return self.loans().member(member_id)
+
+    def overdue_loans(self, as_of):
+        return self.loans().due_queue().overdue(as_of)
+
+    def next_due(self, count, as_of=None):
+        return self.loans().due_queue().next_due(count, as_of)
+
+    def search_titles(self, query, prefix=False):
+        return self.catalog().search_titles(query, prefix)
+
+    def search_ids(self, query, prefix=False):
+        return self.catalog().search_ids(query, prefix)
+
+    def search_ranked(self, query, limit=20):
+        return self.catalog().search_ranked(query, limit)
+
+    def get_book(self, book_id):
+        return self.catalog().get(book_id)
+
+    def find_book(self, field, value):
+        return self.catalog().find(field, value)
+
+    def find_books(self, field, value):
+        return self.catalog().find_all(field, value)
+
+    def find_loan(self, field, value):
+        return self.loans().find(field, value)
+
+    def add_book(self, book):
+        self._check(force=True)
+        self.catalog().add(book)
+        self._write(self.storage.add_book, dict(book))
+        self._publish(BOOK_ADDED, book.get("Book ID", ""))
+
+    def add_books(self, books):
+        self._check(force=True)
+        self.catalog().add_many(books)
+        self._write(self.storage.add_books, [dict(book) for book in books])
+        for book in books:
+            self._publish(BOOK_ADDED, book.get("Book ID", ""))
+
+    def update_book(self, book):
+        self._check(force=True)
+        self.catalog().update(book)
+        self._write(self.storage.update_book, dict(book))
+        self._publish(BOOK_UPDATED, book.get("Book ID", ""))
+
+    def set_book_available(self, book_id, available):
+        self._check(force=True)
+        self.catalog().set_available(book_id, available)
+        self._write(self.storage.set_book_available, book_id, available)
+        self._publish(BOOK_UPDATED, book_id)
+
+    def delete_book(self, book_id):
+        self._check(force=True)
+        self.catalog().remove(book_id)
+        self._write(self.storage.delete_book, book_id)
+        self._publish(BOOK_DELETED, book_id)
+
+    def add_loan(self, loan):
+        self._check(force=True)
+        history = self.loans()
+        loan = Loan.from_mapping(normalize_loan(loan))
+        loan["Loan ID"] = history.next_id()
+        history.add(loan)
+        self._write(self.storage.add_loan, dict(loan))
+        self._publish(LOAN_OPENED, loan["Loan ID"])
+        return loan
+
+    def update_loan(self, loan):
+        self._check(force=True)
+        self.loans().update(loan)
+        self._write(self.storage.update_loan, dict(loan))
+        self._publish(LOAN_CLOSED if loan.get("Status") == "Returned" else LOAN_UPDATED, loan["Loan ID"])
@@ -0,0 +1,157 @@
+from Library_Metrics import timed, timer
+from Library_Records import Book
+from Library_Search import FuzzyIndex, TitleIndex
+
+INDEXED_FIELDS = ("Book Title", "Author Name", "Genre", "Available")
+
+
+class Catalog:
+    # Books keyed by Book ID with secondary indexes on title, author, genre and availability.
+    # Each index maps a field value to the Book IDs holding it, in catalog order;
+    # availability is indexed as True/False (any copy in or not), not the count.
+    def __init__(self, books=()):
+        self.books = {}
+        self.indexes = {field: {} for field in INDEXED_FIELDS}
+        self._title_index = None
+        self._fuzzy_index = None
+        for book in books:
+            if book.get("Book ID", "") not in self.books:
+                self._insert(book)
+
+    def __len__(self):
+        return len(self.books)
+
+    def __iter__(self):
+        return iter(self.books.values())
+
+    def __contains__(self, book_id):
+        return book_id in self.books
+
+    def _insert(self, book):
+        book = Book.from_mapping(book)
+        book_id = book.get("Book ID", "")
+        self.books[book_id] = book
+        self._index(book)
+
+    def _key(self, book, field):
+        value = book.get(field)
+        return value > 0 if field == "Available" else value
+
+    def _index(self, book):
+        book_id = book.get("Book ID", "")
+        for field, index in self.indexes.items():
+            index.setdefault(self._key(book, field), {})[book_id] = None
+
+    def _unindex(self, book):
+        book_id = book.get("Book ID", "")
+        for field, index in self.indexes.items():
+            value = self._key(book, field)
+            ids = index.get(value)
+            if ids is not None:
+                ids.pop(book_id, None)
+                if not ids:
+                    del index[value]
+
+    def get(self, book_id):
+        return self.books.get(book_id)
+
+    def find_all(self, field, value):
+        if field == "Book ID":
+            book = self.books.get(value)
+            return [book] if book is not None else []
+        if field in self.indexes:
+            return [self.books[book_id] for book_id in self.indexes[field].get(value, ())]
+        return [book for book in self.books.values() if book.get(field) == value]
+
+    def find(self, field, value):
+        if field == "Book ID":
+            return self.books.get(value)
+        if field in self.indexes:
+            for book_id in self.indexes[field].get(value, ()):
+                return self.books[book_id]
+            return None
+        for book in self.books.values():
+            if book.get(field) == value:
+                return book
+        return None
+
+    def ids(self, field, value):
+        # The Book IDs with field == value, straight from the index (do not modify).
+        return self.indexes[field].get(value, {})
+
+    def values(self, field):
+        return list(self.indexes[field])
+
+    def add(self, book):
+        self.remove(book.get("Book ID", ""))
+        self._insert(book)
+        if self._title_index is not None:
+            self._title_index.add(book.get("Book ID", ""), book.get("Book Title", "Unknown Title"))
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.add(book)
+
+    def add_many(self, books):
+        # Rebuilding the search indexes once is cheaper than many sorted inserts.
+        if len(books) > 100:
+            self._title_index = None
+            self._fuzzy_index = None
+        for book in books:
+            self.add(book)
+
+    def update(self, book):
+        book_id = book.get("Book ID", "")
+        old = self.books.get(book_id)
+        if old is None:
+            return
+        self._unindex(old)
+        book = Book.from_mapping(book)
+        self.books[book_id] = book
+        self._index(book)
+        if self._title_index is not None:
+            self._title_index.update(book_id, book.get("Book Title", "Unknown Title"))
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.update(book)
+
+    def set_available(self, book_id, available):
+        book = self.books.get(book_id)
+        if book is not None:
+            self._unindex(book)
+            book["Available"] = available
+            self._index(book)
+
+    def remove(self, book_id):
+        book = self.books.pop(book_id, None)
+        if book is None:
+            return
+        self._unindex(book)
+        if self._title_index is not None:
+            self._title_index.remove(book_id)
+        if self._fuzzy_index is not None:
+            self._fuzzy_index.remove(book_id)
+
+    def title_index(self):
+        if self._title_index is None:
+            with timer("index.build_titles"):
+                self._title_index = TitleIndex(self.books.values())
+        return self._title_index
+
+    @timed("index.search_titles")
+    def search_titles(self, query, prefix=False):
+        index = self.title_index()
+        return [index.title(book_id) for book_id in self.search_ids(query, prefix)]
+
+    def search_ids(self, query, prefix=False):
+        # The matching Book IDs in catalog order, possibly shared with the index (do not modify).
+        index = self.title_index()
+        return index.search_prefix(query) if prefix else index.search(query)
+
+    def fuzzy_index(self):
+        if self._fuzzy_index is None:
+            with timer("index.build_fuzzy"):
+                self._fuzzy_index = FuzzyIndex(self.books.values())
+        return self._fuzzy_index
+
+    @timed("index.search_ranked")
+    def search_ranked(self, query, limit=20):
+        # [(score, book)] over title, author and genre, tolerating typos.
+        return [(score, self.books[book_id]) for score, book_id in self.fuzzy_index().search(query, limit)]
@@ -0,0 +1,406 @@
+import csv
+import json
+import os
+from datetime import date, datetime, timedelta
+from itertools import chain
+
+from Library_Analytics import DAILY_COLUMNS, Analytics
+from Library_Archive import archive_closed_loans
+from Library_Cache import LibraryCache
+from Library_Import import BookImporter
+from Library_Records import DATE_FORMAT, copy_count, date_ordinal, date_text
+from Library_Storage import HISTORY_COLUMNS, normalize_book, open_storage
+
+LOAN_DAYS = 15
+FINE_PER_DAY = 5
+BORROW_LIMIT = 5
+
+
+class LibraryError(Exception):
+    pass
+
+
+def parse_date(value):
+    return datetime.strptime(value, DATE_FORMAT).date()
+
+
+def format_date(value):
+    return value.strftime(DATE_FORMAT)
+
+
+def today():
+    return format_date(date.today())
+
+
+def due_date_for(date_borrowed):
+    return format_date(parse_date(date_borrowed) + timedelta(days=LOAN_DAYS))
+
+
+def day_number(value):
+    # Date string or stored ordinal -> ordinal.
+    ordinal = date_ordinal(value)
+    if ordinal is None:
+        raise ValueError(f"time data {value!r} does not match format {DATE_FORMAT!r}")
+    return ordinal
+
+
+def parse_copies(value):
+    try:
+        copies = int(value)
+    except (TypeError, ValueError):
+        raise LibraryError("Copies must be a whole number.")
+    if copies < 0:
+        raise LibraryError("Copies cannot be negative.")
+    return copies
+
+
+def calculate_fine(due_date, return_date):
+    overdue_days = day_number(return_date) - day_number(due_date)
+    if overdue_days > 0:
+        return overdue_days * FINE_PER_DAY
+    return 0
+
+
+class LibraryCore:
+    # Book, loan and fine rules without any GUI. With cached=True (the GUI) reads
+    # are served from a shared LibraryCache; scripts talk to the storage directly
+    # so a single command only touches the records it needs. With defer_analytics
+    # the caller recounts stale analytics itself (the GUI does it on its worker).
+    def __init__(self, storage=None, cached=True, executor=None, archive=None, events=None, analytics=None,
+                 defer_analytics=False):
+        self.storage = storage if storage is not None else open_storage()
+        self.data = LibraryCache(self.storage, executor=executor, events=events) if cached else self.storage
+        self.executor = executor
+        self.archive = archive
+        self.analytics = analytics
+        self.analytics_stale = analytics is not None and not (
+            analytics.load() and analytics.matches(*self.storage.loan_watermark())
+        )
+        self.recounted = None
+        if self.analytics_stale and not defer_analytics:
+            self.rebuild_analytics()
+
+    def close(self):
+        try:
+            self.save_analytics()
+        finally:
+            self.storage.close()
+
+    #Books
+    def get_book(self, book_id):
+        return self.data.get_book(book_id)
+
+    def find_book(self, field, value):
+        return self.data.find_book(field, value)
+
+    def search(self, query, prefix=False):
+        return self.data.search_titles(query, prefix)
+
+    def search_ranked(self, query, limit=20):
+        return self.data.search_ranked(query, limit)
+
+    def is_book_available(self, book_id):
+        # "Available" counts the copies on the shelf; borrow and return keep it current.
+        book = self.data.get_book(book_id)
+        return book is not None and book.get("Available", 0) > 0
+
+    def add_book(self, book):
+        if not book.get("Book ID", ""):
+            raise LibraryError("Please fill in the 'Book ID' field.")
+        if self.data.get_book(book["Book ID"]) is not None:
+            raise LibraryError("Book ID already exists.")
+        book = dict(book)
+        book["Copies"] = parse_copies(book.get("Copies") or 1)
+        self.data.add_book(book)
+        return book
+
+    def update_book(self, book):
+        # Copies out on loan stay out: the shelf count follows the new total.
+        old = self.data.get_book(book.get("Book ID", ""))
+        if old is None:
+            raise LibraryError(f"Unknown Book ID '{book.get('Book ID', '')}'.")
+        book = dict(book)
+        copies = parse_copies(book.get("Copies", old.get("Copies", 1)))
+        out = old.get("Copies", 1) - old.get("Available", 0)
+        if copies < out:
+            raise LibraryError(f"Copies cannot go below the {out} out on loan.")
+        book["Copies"] = copies
+        book["Available"] = copies - out
+        self.data.update_book(book)
+        return book
+
+    def delete_book(self, book_id):
+        self.data.delete_book(book_id)
+
+    def set_book_available(self, book_id, available):
+        # A number sets the shelf count; True puts back every copy not out on
+        # loan and False takes them all off the shelf.
+        book = self.data.get_book(book_id)
+        if book is None:
+            return
+        if available is True:
+            on_loan = sum(1 for loan in self.data.open_loans() if loan.get("Book ID") == book_id)
+            available = book.get("Copies", 1) - on_loan
+        self.data.set_book_available(book_id, copy_count(available, book.get("Copies", 1)))
+
+    def import_books(self, file_name, batch_size=5000, progress=None):
+        if self.data is self.storage:
+            existing_ids = self.storage.book_ids()
+        else:
+            existing_ids = self.data.catalog().books.keys()
+        return BookImporter(file_name, self.data, existing_ids, batch_size, progress)
+
+    #Loans
+    def open_loan(self, book_id):
+        return self.data.open_loan(book_id)
+
+    def find_loan(self, loan_id):
+        return self.data.find_loan("Loan ID", loan_id)
+
+    def borrow(self, borrower_name, book_id, date_borrowed=None, date_return=None, member_id=""):
+        book = self.data.get_book(book_id)
+        if book is None:
+            raise LibraryError(f"Unknown Book ID '{book_id}'.")
+        if book.get("Available", 0) <= 0:
+            copies = book.get("Copies", 1)
+            raise LibraryError(f"All {copies} copies of this book are out." if copies > 1 else "This book is already borrowed.")
+        if member_id:
+            member = self.data.member(member_id)
+            if member is not None and len(member.open_loans) >= BORROW_LIMIT:
+                raise LibraryError(f"Member {member_id} already has {len(member.open_loans)} books out (limit {BORROW_LIMIT}).")
+
+        date_borrowed = date_borrowed or today()
+        try:
+            date_return = date_return or due_date_for(date_borrowed)
+            parse_date(date_return)
+        except ValueError:
+            raise LibraryError("Dates must be in YYYY-MM-DD format.")
+
+        loan = {
+            "Borrower Name": borrower_name,
+            "Book ID": book_id,
+            "Book Title": book.get("Book Title", ""),
+            "Date Borrowed": date_borrowed,
+            "Date Return": date_return,
+            "Member ID": member_id,
+        }
+        with self.data.batch():
+            loan = self.data.add_loan(loan)
+            self.data.set_book_available(book_id, book.get("Available", 1) - 1)
+        self._count("borrowed", loan, book)
+        return loan
+
+    def return_loan(self, loan, return_date=None):
+        if loan.get("Status", "Borrowed") == "Returned":
+            raise LibraryError("This book has already been returned.")
+
+        return_date = return_date or today()
+        try:
+            fine = calculate_fine(loan.get("Date Return", ""), return_date)
+        except ValueError:
+            raise LibraryError("Dates must be in YYYY-MM-DD format.")
+
+        loan["Fine"] = fine
+        loan["Status"] = "Returned"
+        loan["Date Return"] = return_date
+        book = self.data.get_book(loan.get("Book ID", ""))
+        with self.data.batch():
+            self.data.update_loan(loan)
+            if book is not None:
+                self.data.set_book_available(book["Book ID"], min(book.get("Copies", 1), book.get("Available", 0) + 1))
+        self._count("returned", loan)
+        return loan
+
+    def return_book(self, book_id, return_date=None, member_id=""):
+        # With several copies out, member_id says whose copy came back;
+        # otherwise the oldest open loan is closed.
+        if member_id:
+            member = self.data.member(member_id)
+            loans = member.open_loans.values() if member is not None else ()
+            loan = next((loan for loan in loans if loan.get("Book ID") == book_id), None)
+            if loan is None:
+                raise LibraryError(f"Member {member_id} has no open loan of book '{book_id}'.")
+        else:
+            loan = self.data.open_loan(book_id)
+            if loan is None:
+                raise LibraryError(f"Book '{book_id}' is not on loan.")
+        return self.return_loan(loan, return_date)
+
+    def overdue(self, as_of=None):
+        # Straight from the due date queue, already in (due, Loan ID) order.
+        as_of = day_number(as_of or today())
+        return [(loan, (as_of - due) * FINE_PER_DAY) for due, loan in self.data.overdue_loans(as_of)]
+
+    def next_due(self, count=10, as_of=None):
+        as_of = day_number(as_of or today())
+        return [loan for due, loan in self.data.next_due(count, as_of)]
+
+    def overdue_report(self, as_of=None, upcoming=10):
+        as_of = date_text(day_number(as_of or today()))
+        overdue = self.overdue(as_of)
+        return {
+            "as_of": as_of,
+            "overdue": overdue,
+            "total_fines": sum(fine for loan, fine in overdue),
+            "upcoming": self.next_due(upcoming, as_of),
+        }
+
+    #Members
+    def member(self, member_id):
+        return self.data.member(member_id)
+
+    def outstanding_fines(self, member, as_of=None):
+        # What the member's overdue loans would owe if returned on as_of. Fines on
+        # returned loans were paid at the desk (see Member.fines_paid).
+        as_of = day_number(as_of or today())
+        outstanding = 0
+        for loan in member.open_loans.values():
+            due = date_ordinal(loan.date_return)
+            if due is not None and due < as_of:
+                outstanding += calculate_fine(due, as_of)
+        return outstanding
+
+    #Archive
+    def archive_history(self, keep_periods=1):
+        return self._archived(self._archive(keep_periods))
+
+    def archive_history_later(self, keep_periods=1, on_done=None, on_error=None):
+        # archive_history with the slow part on the executor; the cache is reloaded
+        # back on this thread before on_done gets the count.
+        if self.executor is None:
+            count = self.archive_history(keep_periods)
+            if on_done is not None:
+                on_done(count)
+            return
+
+        def archived(count):
+            self._archived(count)
+            if on_done is not None:
+                on_done(count)
+
+        self.executor.submit(self._archive, keep_periods, on_done=archived, on_error=on_error, write=False)
+
+    def _archive(self, keep_periods):
+        # Touches only storage and the archive, so it may run on the executor.
+        if self.archive is None:
+            return 0
+        return archive_closed_loans(self.storage, self.archive, keep_periods)
+
+    def _archived(self, count):
+        if count and self.data is not self.storage:
+            self.data.invalidate()
+        return count
+
+    def archived_periods(self):
+        return self.archive.partitions() if self.archive is not None else []
+
+    def load_archived(self, period):
+        # Read in full here, so a damaged partition fails this call rather than its caller's loop.
+        return list(self.archive.load_partition(period))
+
+    def all_history(self):
+        for period in reversed(self.archived_periods()):
+            yield from self.archive.load_partition(period)
+        yield from self.storage.load_history()
+
+    #Analytics
+    def analytics_report(self, top=10, days=30):
+        if self.analytics is None:
+            raise LibraryError("Circulation analytics are not enabled.")
+        return self.analytics.report(top, days)
+
+    def rebuild_analytics(self):
+        # The only analytics path that reads the whole history, archive included.
+        if self.analytics is None:
+            raise LibraryError("Circulation analytics are not enabled.")
+        if self.data is self.storage:
+            books, live = self.storage.load_books(), self.storage.load_history()
+        else:
+            books, live = self.data.books(), self.data.history()
+        archived = (loan for period in reversed(self.archived_periods()) for loan in self.archive.load_partition(period))
+        books = {book.get("Book ID", ""): book for book in books}
+        self.analytics.rebuild(chain(archived, live), books)
+        self.analytics_stale = False
+        return self.analytics.borrows
+
+    def rebuild_analytics_later(self, on_done=None, on_error=None):
+        # rebuild_analytics on the executor, counted into fresh totals. Loans
+        # counted on this thread in the meantime are noted and added to the fresh
+        # totals when they replace the live ones.
+        if self.analytics is None:
+            raise LibraryError("Circulation analytics are not enabled.")
+        if self.executor is None:
+            borrows = self.rebuild_analytics()
+            if on_done is not None:
+                on_done(borrows)
+            return
+        self.recounted = []
+
+        def adopt(analytics):
+            for event, args in self.recounted:
+                getattr(analytics, event)(*args)
+            self.recounted = None
+            self.analytics = analytics
+            self.analytics_stale = False
+            if on_done is not None:
+                on_done(analytics.borrows)
+
+        def failed(error):
+            self.recounted = None
+            if on_error is not None:
+                on_error(error)
+
+        self.executor.submit(self._recount_analytics, on_done=adopt, on_error=failed, write=False)
+
+    def _recount_analytics(self):
+        # Reads storage rather than the cache, so it may run on the executor.
+        books = {book.get("Book ID", ""): book for book in self.storage.load_books()}
+        archived = (loan for period in reversed(self.archived_periods()) for loan in self.archive.load_partition(period))
+        return Analytics(self.analytics.file_name).rebuild(chain(archived, self.storage.load_history()), books)
+
+    def _count(self, event, *args):
+        # event is "borrowed" or "returned".
+        if self.analytics is not None:
+            getattr(self.analytics, event)(*args)
+            if self.recounted is not None:
+                self.recounted.append((event, args))
+
+    def save_analytics(self):
+        # Totals still waiting for their recount are not worth saving, and while
+        # loans they counted are still queued they cannot be checked yet. Totals
+        # that no longer match storage missed another program's loans; they are
+        # left unsaved, so the next start finds the old ones stale and recounts.
+        if self.analytics is None or self.analytics_stale or not self.analytics.dirty:
+            return
+        if self.data is not self.storage and self.data.pending_writes:
+            return
+        if not self.analytics.matches(*self.storage.loan_watermark()):
+            self.analytics_stale = True
+            return
+        self.analytics.save()
+
+    #Export
+    def export(self, kind, file_name):
+        if kind == "books":
+            rows = (normalize_book(book) for book in self.storage.load_books())
+            fields = ["Book ID", "Book Title", "Author Name", "Genre", "Available", "Copies"]
+        elif kind == "daily":
+            rows = self.analytics_report(days=None)["daily"]
+            fields = list(DAILY_COLUMNS)
+        else:
+            rows = self.all_history()
+            fields = list(HISTORY_COLUMNS)
+
+        count = 0
+        with open(file_name, "w", newline="", encoding="utf-8") as file:
+            if os.path.splitext(file_name)[1].lower() in (".jsonl", ".json", ".ndjson"):
+                for row in rows:
+                    file.write(json.dumps({field: row.get(field) for field in fields}) + "\n")
+                    count += 1
+            else:
+                writer = csv.DictWriter(file, fieldnames=fields, extrasaction="ignore")
+                writer.writeheader()
+                for row in rows:
+                    writer.writerow(row)
+                    count += 1
+        return count
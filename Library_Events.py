@@ -0,0 +1,76 @@
+BOOK_ADDED = "book_added"
+BOOK_UPDATED = "book_updated"
+BOOK_DELETED = "book_deleted"
+LOAN_OPENED = "loan_opened"
+LOAN_CLOSED = "loan_closed"
+LOAN_UPDATED = "loan_updated"
+LOAN_DELETED = "loan_deleted"
+RELOADED = "reloaded"
+
+BOOK_EVENTS = (BOOK_ADDED, BOOK_UPDATED, BOOK_DELETED)
+LOAN_EVENTS = (LOAN_OPENED, LOAN_CLOSED, LOAN_UPDATED, LOAN_DELETED)
+
+
+class EventBus:
+    # Change events are (kind, key) pairs. With a schedule function (the GUI
+    # passes root.after_idle) events are queued and handed to every subscriber
+    # as one list once the current callback is done; without one they are
+    # delivered straight away.
+    def __init__(self, schedule=None):
+        self.schedule = schedule
+        self.subscribers = []
+        self.pending = []
+        self.scheduled = False
+
+    def subscribe(self, handler):
+        self.subscribers.append(handler)
+
+    def unsubscribe(self, handler):
+        if handler in self.subscribers:
+            self.subscribers.remove(handler)
+
+    def publish(self, kind, key=None):
+        self.pending.append((kind, key))
+        if self.schedule is None:
+            self.flush()
+        elif not self.scheduled:
+            self.scheduled = True
+            self.schedule(self.flush)
+
+    def flush(self):
+        self.scheduled = False
+        events, self.pending = self.pending, []
+        if not events:
+            return
+        for handler in list(self.subscribers):
+            handler(events)
+
+
+class ChangeSet:
+    # What a screen still has to catch up on: the keys of changed books and
+    # loans, or a full reload once there are too many of them to patch one by one.
+    def __init__(self, limit=500):
+        self.limit = limit
+        self.clear()
+
+    def clear(self):
+        self.books = {}
+        self.loans = {}
+        self.reload = False
+
+    def __bool__(self):
+        return self.reload or bool(self.books) or bool(self.loans)
+
+    def add(self, events):
+        for kind, key in events:
+            if kind == RELOADED:
+                self.reload = True
+            elif kind in BOOK_EVENTS:
+                self.books[key] = kind
+            elif kind in LOAN_EVENTS:
+                self.loans[key] = kind
+        if len(self.books) + len(self.loans) > self.limit:
+            self.reload = True
+        if self.reload:
+            self.books = {}
+            self.loans = {}
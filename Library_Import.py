@@ -0,0 +1,184 @@
+import argparse
+import csv
+import json
+import os
+import sys
+from itertools import islice
+
+from Library_Records import copy_count
+from Library_Storage import STORAGE_ERRORS, open_storage
+
+FIELD_ALIASES = {
+    "book id": "Book ID",
+    "id": "Book ID",
+    "book title": "Book Title",
+    "title": "Book Title",
+    "author name": "Author Name",
+    "author": "Author Name",
+    "genre": "Genre",
+    "available": "Available",
+    "copies": "Copies",
+}
+
+TRUE_VALUES = {"1", "true", "yes", "y", "available"}
+FALSE_VALUES = {"0", "false", "no", "n", "not available"}
+
+
+class RowError(Exception):
+    pass
+
+
+IMPORT_ERRORS = STORAGE_ERRORS + (csv.Error, UnicodeDecodeError)
+
+
+def field_name(header):
+    return FIELD_ALIASES.get(" ".join(str(header).replace("_", " ").casefold().split()))
+
+
+def read_rows(file_name):
+    # Yields (line number, raw row or RowError) without holding the file in memory.
+    with open(file_name, newline="", encoding="utf-8-sig") as file:
+        if os.path.splitext(file_name)[1].lower() in (".jsonl", ".json", ".ndjson"):
+            for line_number, line in enumerate(file, 1):
+                if not line.strip():
+                    continue
+                try:
+                    row = json.loads(line)
+                except ValueError as e:
+                    yield line_number, RowError(f"invalid JSON: {e}")
+                    continue
+                if not isinstance(row, dict):
+                    yield line_number, RowError("expected a JSON object")
+                    continue
+                yield line_number, row
+        else:
+            reader = csv.DictReader(file)
+            for row in reader:
+                yield reader.line_num, row
+
+
+def clean_row(row):
+    book = {}
+    for header, value in row.items():
+        field = field_name(header)
+        if field is not None and value is not None:
+            book[field] = value.strip() if isinstance(value, str) else value
+
+    book_id = book.get("Book ID")
+    if book_id is None or str(book_id) == "":
+        raise RowError("missing Book ID")
+    if not book.get("Book Title"):
+        raise RowError("missing Book Title")
+    book["Book ID"] = str(book_id)
+
+    copies = book.get("Copies", 1)
+    try:
+        copies = int(copies) if copies != "" else 1
+    except (TypeError, ValueError):
+        raise RowError(f"invalid Copies value '{copies}'")
+    if copies < 0:
+        raise RowError(f"invalid Copies value '{copies}'")
+
+    # Yes/no (every copy or none) or the number of copies on the shelf.
+    available = book.get("Available", True)
+    if isinstance(available, str):
+        if available.casefold() in TRUE_VALUES or available == "":
+            available = True
+        elif available.casefold() in FALSE_VALUES:
+            available = False
+        elif available.isdigit():
+            available = int(available)
+        else:
+            raise RowError(f"invalid Available value '{available}'")
+    elif not isinstance(available, int):
+        available = bool(available)
+    if not isinstance(available, bool) and available > copies:
+        raise RowError(f"Available {available} is more than the {copies} copies")
+
+    return {
+        "Book ID": book["Book ID"],
+        "Book Title": str(book["Book Title"]),
+        "Author Name": str(book.get("Author Name", "")),
+        "Genre": str(book.get("Genre", "")),
+        "Available": copy_count(available, copies),
+        "Copies": copies,
+    }
+
+
+def valid_books(rows, seen_ids, rejected):
+    for line_number, row in rows:
+        try:
+            if isinstance(row, RowError):
+                raise row
+            book = clean_row(row)
+            if book["Book ID"] in seen_ids:
+                raise RowError(f"duplicate Book ID '{book['Book ID']}'")
+        except RowError as e:
+            rejected.append((line_number, str(e)))
+            continue
+        seen_ids.add(book["Book ID"])
+        yield book
+
+
+class BookImporter:
+    # Streams a CSV/JSONL file into a storage backend or cache one batch per step(),
+    # so the GUI can drive it from after() and the command line from a loop.
+    def __init__(self, file_name, target, existing_ids, batch_size=5000, progress=None):
+        self.file_name = file_name
+        self.target = target
+        self.batch_size = batch_size
+        self.progress = progress
+        self.imported = 0
+        self.rejected = []
+        self.done = False
+        self._rows = read_rows(file_name)
+        self._books = valid_books(self._rows, set(existing_ids), self.rejected)
+
+    def step(self):
+        batch = list(islice(self._books, self.batch_size))
+        if batch:
+            self.target.add_books(batch)
+            self.imported += len(batch)
+        else:
+            self.done = True
+            self._rows.close()
+        if self.progress is not None:
+            self.progress(self)
+        return not self.done
+
+    def run(self):
+        while self.step():
+            pass
+        return self
+
+    def summary(self):
+        return f"Imported {self.imported} books, rejected {len(self.rejected)} rows."
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bulk import books from a CSV or JSONL file.")
+    parser.add_argument("file")
+    parser.add_argument("--batch-size", type=int, default=5000)
+    args = parser.parse_args(argv)
+
+    def report(importer):
+        print(f"\r{importer.imported} imported, {len(importer.rejected)} rejected", end="", file=sys.stderr)
+
+    storage = open_storage()
+    try:
+        importer = BookImporter(args.file, storage, storage.book_ids(), args.batch_size, report).run()
+    except IMPORT_ERRORS as e:
+        print(f"\nError importing '{args.file}': {e}", file=sys.stderr)
+        return 1
+    finally:
+        storage.close()
+
+    print(file=sys.stderr)
+    for line_number, reason in importer.rejected:
+        print(f"line {line_number}: {reason}", file=sys.stderr)
+    print(importer.summary())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,441 @@
+import json
+import os
+import pickle
+import threading
+import time
+import zlib
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+    import msvcrt
+
+from Library_Members import MemberRegistry
+from Library_Metrics import timer
+from Library_Records import Book, Loan
+from Library_Snapshot import BookView, Layer, LoanView, Snapshot, is_snapshot, write_snapshot
+from Library_Storage import StorageBackend, normalize_book, normalize_loan
+
+SNAPSHOT_FILE = "library.snapshot"
+JOURNAL_FILE = "library.journal"
+
+
+class JournalLocked(OSError):
+    pass
+
+
+def lock_file(file):
+    # An exclusive lock on the whole open file without waiting; OSError if held.
+    if fcntl is not None:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    else:
+        file.seek(0)
+        msvcrt.locking(file.fileno(), msvcrt.LK_NBLCK, 1)
+
+
+def fsync_directory(path):
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def encode_event(event):
+    payload = json.dumps(event, separators=(",", ":"))
+    return f"{zlib.crc32(payload.encode('utf-8')):08x} {payload}\n".encode("utf-8")
+
+
+def read_events(file_name):
+    # Yields (event, line length) up to the first torn or corrupt line, then stops.
+    if not os.path.exists(file_name):
+        return
+    with open(file_name, "rb") as file:
+        for line in file:
+            if not line.endswith(b"\n"):
+                return
+            checksum, _, payload = line.rstrip(b"\n").partition(b" ")
+            try:
+                if int(checksum, 16) != zlib.crc32(payload):
+                    return
+                event = json.loads(payload)
+            except ValueError:
+                return
+            yield event, len(line)
+
+
+class JournalStorage(StorageBackend):
+    # Every change is appended to a journal file. A committer thread writes
+    # buffered events and fsyncs once per burst (group commit). Compaction folds
+    # the journal into a binary snapshot that is written to a temporary file and
+    # atomically renamed over the old one. The snapshot is memory-mapped rather
+    # than loaded: books and loans are layers of changes over it, and records
+    # are only decoded when they are read. Only one JournalStorage may have a
+    # journal open at a time, in any process: the signature is local to it and
+    # compaction rewrites the files, so a second one is refused (JournalLocked).
+    def __init__(self, snapshot_file=SNAPSHOT_FILE, journal_file=JOURNAL_FILE,
+                 commit_delay=0.005, compact_bytes=4 * 1024 * 1024, durable_writes=False):
+        self.snapshot_file = snapshot_file
+        self.journal_file = journal_file
+        self.rotated_file = journal_file + ".1"
+        self.commit_delay = commit_delay
+        self.compact_bytes = compact_bytes
+        self.durable_writes = durable_writes
+
+        self.snapshot = None
+        self.books = Layer({})
+        self.history = Layer({})
+        self.last_loan_id = 0
+        self.version = 0
+        self.fsyncs = 0
+
+        self.lock = threading.RLock()
+        self.io_lock = threading.Lock()
+        self.compact_lock = threading.Lock()
+        self.committed = threading.Condition(self.lock)
+        self.buffer = []
+        self.batched = None
+        self.appended_seq = 0
+        self.committed_seq = 0
+        self.journal_size = 0
+        self.closed = False
+        self.compacting = False
+
+        # A lock file rather than the journal itself, which compaction replaces.
+        self.lock_file = open(journal_file + ".lock", "a+b")
+        try:
+            lock_file(self.lock_file)
+        except OSError:
+            self.lock_file.close()
+            raise JournalLocked(f"'{journal_file}' is already open in another program or window.")
+        try:
+            self._recover()
+        except BaseException:
+            self.lock_file.close()
+            raise
+        self.journal = open(self.journal_file, "ab")
+        self.journal_size = self.journal.tell()
+        self._committer = threading.Thread(target=self._commit_loop, name="library-journal", daemon=True)
+        self._committer.start()
+
+    #Recovery
+    def _recover(self):
+        if os.path.exists(self.snapshot_file) and is_snapshot(self.snapshot_file):
+            with timer("storage.snapshot_open"):
+                self.snapshot = Snapshot(self.snapshot_file)
+            self.books = Layer(BookView(self.snapshot))
+            self.history = Layer(LoanView(self.snapshot))
+            self.last_loan_id = self.snapshot.last_loan_id()
+        elif os.path.exists(self.snapshot_file):
+            # Snapshots from before the binary format; the next compaction rewrites it.
+            with open(self.snapshot_file, "rb") as file:
+                snapshot = pickle.load(file)
+            books = (Book.from_mapping(book) for book in snapshot["books"])
+            loans = (Loan.from_mapping(loan) for loan in snapshot["history"])
+            self.books = Layer({book["Book ID"]: book for book in books})
+            self.history = Layer({loan["Loan ID"]: loan for loan in loans})
+            self.last_loan_id = max(self.history.keys(), default=0)
+
+        # A crash during compaction can leave the rotated journal behind. Events
+        # are idempotent, so replaying it over a newer snapshot is harmless.
+        for file_name in (self.rotated_file, self.journal_file):
+            valid_size = 0
+            for event, size in read_events(file_name):
+                self._apply(event)
+                valid_size += size
+            if os.path.exists(file_name) and os.path.getsize(file_name) > valid_size:
+                with open(file_name, "r+b") as file:
+                    file.truncate(valid_size)
+
+    def _apply(self, event):
+        kind = event[0]
+        if kind == "add_books":
+            for book in event[1]:
+                self.books[book["Book ID"]] = Book.from_mapping(book)
+        elif kind == "update_book":
+            if event[1]["Book ID"] in self.books:
+                self.books[event[1]["Book ID"]] = Book.from_mapping(event[1])
+        elif kind == "set_available":
+            # Copied first: the record may belong to a layer being written out.
+            book = self.books.get(event[1])
+            if book is not None:
+                book = book.copy()
+                book["Available"] = event[2]
+                self.books[event[1]] = book
+        elif kind == "delete_book":
+            self.books.pop(event[1], None)
+        elif kind == "add_loans":
+            for loan in event[1]:
+                self.history[loan["Loan ID"]] = Loan.from_mapping(loan)
+                self.last_loan_id = max(self.last_loan_id, loan["Loan ID"])
+        elif kind == "update_loan":
+            self.history[event[1]["Loan ID"]] = Loan.from_mapping(event[1])
+        elif kind == "delete_loans":
+            for loan_id in event[1]:
+                self.history.pop(loan_id, None)
+        elif kind == "batch":
+            # Counted per event, as when the batch was first made.
+            for batched in event[1]:
+                self._apply(batched)
+            return
+        self.version += 1
+
+    #Group commit
+    def _log(self, event):
+        with self.lock:
+            if self.closed:
+                raise OSError("journal storage is closed")
+            self._apply(event)
+            if self.batched is not None:
+                self.batched.append(event)
+                return
+            self._append(event)
+
+    def _append(self, event):
+        with self.lock:
+            self.buffer.append(encode_event(event))
+            self.appended_seq += 1
+            seq = self.appended_seq
+            self.committed.notify_all()
+            if self.durable_writes:
+                while self.committed_seq < seq and not self.closed:
+                    self.committed.wait()
+
+    def _commit_loop(self):
+        while True:
+            with self.lock:
+                while not self.buffer and not self.closed:
+                    self.committed.wait()
+                if not self.buffer and self.closed:
+                    return
+            # Give the rest of a burst a moment to join this commit.
+            if self.commit_delay:
+                time.sleep(self.commit_delay)
+            self.flush()
+
+    def flush(self):
+        # Appenders only need the state lock; the write and fsync happen under the
+        # I/O lock so new events can keep buffering while the disk catches up.
+        with self.io_lock:
+            with self.lock:
+                if not self.buffer:
+                    return
+                data = b"".join(self.buffer)
+                seq = self.appended_seq
+                self.buffer = []
+            with timer("storage.journal_commit"):
+                self.journal.write(data)
+                self.journal.flush()
+                os.fsync(self.journal.fileno())
+            with self.lock:
+                self.fsyncs += 1
+                self.journal_size += len(data)
+                self.committed_seq = seq
+                self.committed.notify_all()
+                compact = self.journal_size >= self.compact_bytes and not self.compacting
+                if compact:
+                    self.compacting = True
+        if compact:
+            threading.Thread(target=self.compact, name="library-compact", daemon=True).start()
+
+    #Compaction
+    def compact(self):
+        with self.compact_lock, timer("storage.journal_compact"):
+            self._compact()
+
+    def _compact(self):
+        self.flush()
+        with self.io_lock, self.lock:
+            # Events still buffered are already in memory, so they are part of the
+            # snapshot too; they land in the fresh journal and replay harmlessly.
+            # The current layers are frozen and written out while new changes
+            # go to fresh layers on top of them.
+            self.compacting = True
+            books, history = self.books, self.history
+            self.books = Layer(books)
+            self.history = Layer(history)
+            self.journal.close()
+            os.replace(self.journal_file, self.rotated_file)
+            self.journal = open(self.journal_file, "ab")
+            self.journal_size = 0
+            fsync_directory(self.journal_file)
+
+        try:
+            temp_file = self.snapshot_file + ".tmp"
+            with open(temp_file, "wb") as file:
+                write_snapshot(file, books.values(), history.values())
+                file.flush()
+                os.fsync(file.fileno())
+            with self.lock:
+                # The old file has to be unmapped before it can be replaced on Windows.
+                if self.snapshot is not None:
+                    self.snapshot.close()
+                try:
+                    os.replace(temp_file, self.snapshot_file)
+                except OSError:
+                    if self.snapshot is not None:
+                        self.snapshot.open()
+                    raise
+                self.snapshot = Snapshot(self.snapshot_file)
+                self.books.base = BookView(self.snapshot)
+                self.history.base = LoanView(self.snapshot)
+            fsync_directory(self.snapshot_file)
+            os.remove(self.rotated_file)
+        finally:
+            with self.lock:
+                self.compacting = False
+
+    #StorageBackend
+    @contextmanager
+    def batch(self):
+        # The block's events go to the journal as one line, so replay applies all
+        # of them or none, and the whole block is made durable with one fsync.
+        # Its changes are kept in layers of their own until then; if the block
+        # fails they are dropped. A nested batch joins the outer one.
+        with self.lock:
+            if self.batched is not None:
+                yield
+                return
+            state = self.books, self.history, self.last_loan_id, self.version
+            self.books, self.history = Layer(state[0]), Layer(state[1])
+            self.batched = []
+            try:
+                yield
+            except BaseException:
+                self.books, self.history, self.last_loan_id, self.version = state
+                raise
+            finally:
+                events, self.batched = self.batched, None
+            state[0].changes.update(self.books.changes)
+            state[1].changes.update(self.history.changes)
+            self.books, self.history = state[0], state[1]
+            if events:
+                self._append(["batch", events])
+        self.flush()
+
+    def signature(self):
+        return ("journal", self.version)
+
+    def load_books(self):
+        with self.lock, timer("storage.journal_load_books"):
+            return [book.copy() for book in self.books.values()]
+
+    def load_history(self):
+        with self.lock, timer("storage.journal_load_history"):
+            return [loan.copy() for loan in self.history.values()]
+
+    def book_ids(self):
+        with self.lock:
+            return list(self.books)
+
+    def get_book(self, book_id):
+        with self.lock:
+            book = self.books.get(book_id)
+            return book.copy() if book is not None else None
+
+    def find_book(self, field, value):
+        # Reads books one at a time and stops at the first match.
+        if field == "Book ID":
+            return self.get_book(value)
+        with self.lock:
+            for book in self.books.values():
+                if book.get(field) == value:
+                    return book.copy()
+        return None
+
+    def find_loan(self, field, value):
+        if field == "Loan ID":
+            with self.lock:
+                loan = self.history.get(value)
+                return loan.copy() if loan is not None else None
+        return super().find_loan(field, value)
+
+    def _loans(self, snapshot_ids, keep):
+        # The snapshot's indexes name the loans it holds; anything changed since
+        # can only be among the changed keys, so only those loans are read.
+        loan_ids = set(snapshot_ids) | self.history.changed_keys()
+        loans = (self.history.get(loan_id) for loan_id in sorted(loan_ids))
+        return [loan.copy() for loan in loans if loan is not None and keep(loan)]
+
+    def open_loans(self):
+        with self.lock:
+            if self.snapshot is None:
+                return [loan.copy() for loan in self.history.values() if loan.get("Status", "Borrowed") != "Returned"]
+            return self._loans(self.snapshot.open_loan_ids(), lambda loan: loan.get("Status", "Borrowed") != "Returned")
+
+    def loan_watermark(self):
+        with self.lock:
+            return self.last_loan_id, len(self.open_loans())
+
+    def open_loan(self, book_id):
+        for loan in self.open_loans():
+            if loan.get("Book ID") == book_id:
+                return loan
+        return None
+
+    def member(self, member_id):
+        with self.lock:
+            if self.snapshot is None:
+                loans = [loan.copy() for loan in self.history.values() if loan.get("Member ID") == member_id]
+            else:
+                loans = self._loans(self.snapshot.member_loan_ids(member_id), lambda loan: loan.get("Member ID") == member_id)
+        return MemberRegistry(loans).get(member_id)
+
+    def add_books(self, books):
+        with self.lock:
+            books = [normalize_book(book) for book in books if book.get("Book ID", "") not in self.books]
+            if books:
+                self._log(["add_books", books])
+
+    def update_book(self, book):
+        self._log(["update_book", normalize_book(book)])
+
+    def set_book_available(self, book_id, available):
+        self._log(["set_available", book_id, int(available)])
+
+    def delete_book(self, book_id):
+        self._log(["delete_book", book_id])
+
+    def add_loans(self, loans):
+        with self.lock:
+            loans = [normalize_loan(loan) for loan in loans]
+            next_id = self.last_loan_id + 1
+            for loan in loans:
+                if loan["Loan ID"] is None:
+                    loan["Loan ID"] = next_id
+                next_id = max(next_id, loan["Loan ID"]) + 1
+            self._log(["add_loans", loans])
+            return loans
+
+    def update_loan(self, loan):
+        self._log(["update_loan", normalize_loan(loan)])
+
+    def delete_loans(self, loan_ids):
+        self._log(["delete_loans", list(loan_ids)])
+
+    def close(self):
+        with self.lock:
+            if self.closed:
+                return
+        self.flush()
+        with self.compact_lock:
+            # Waits out a background compaction. Replay on open is cheap, so the
+            # journal is only folded in here once it has outgrown compact_bytes.
+            if self.journal_size >= self.compact_bytes:
+                with timer("storage.journal_compact"):
+                    self._compact()
+        with self.lock:
+            self.closed = True
+            self.committed.notify_all()
+        self._committer.join()
+        self.journal.close()
+        if self.snapshot is not None:
+            self.snapshot.close()
+        self.lock_file.close()
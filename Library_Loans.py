@@ -0,0 +1,132 @@
+from bisect import bisect_left, bisect_right, insort
+
+from Library_Members import MemberRegistry
+from Library_Overdue import DueQueue
+from Library_Records import Loan, date_ordinal
+
+
+class LoanHistory:
+    # Loans keyed by Loan ID, plus the open loans of each borrowed book (one per copy out).
+    # The (borrow date, Loan ID) order used for date range filters, the member
+    # registry and the due date queue are only built the first time they are
+    # asked for and are kept up to date after that.
+    def __init__(self, loans=()):
+        self.loans = {}
+        self.open_by_book = {}
+        self.last_id = 0
+        self._by_date = None
+        self._members = None
+        self._due = None
+        for loan in loans:
+            self._insert(loan)
+
+    def __len__(self):
+        return len(self.loans)
+
+    def __iter__(self):
+        return iter(self.loans.values())
+
+    def is_open(self, loan):
+        return loan.get("Status", "Borrowed") != "Returned"
+
+    def _insert(self, loan):
+        loan = Loan.from_mapping(loan)
+        self.loans[loan["Loan ID"]] = loan
+        self.last_id = max(self.last_id, loan["Loan ID"])
+        if self.is_open(loan):
+            self.open_by_book.setdefault(loan.get("Book ID", ""), {})[loan["Loan ID"]] = None
+        if self._members is not None:
+            self._members.add(loan)
+        if self._due is not None:
+            self._due.add(loan)
+        if self._by_date is not None:
+            entry = self._date_entry(loan)
+            if entry is not None:
+                insort(self._by_date, entry)
+
+    def _date_entry(self, loan):
+        ordinal = date_ordinal(loan.date_borrowed)
+        return (ordinal, loan.loan_id) if ordinal is not None else None
+
+    def _unlist(self, loan):
+        if self._by_date is None:
+            return
+        entry = self._date_entry(loan)
+        if entry is not None:
+            position = bisect_left(self._by_date, entry)
+            if position < len(self._by_date) and self._by_date[position] == entry:
+                del self._by_date[position]
+
+    def next_id(self):
+        return self.last_id + 1
+
+    def get(self, loan_id):
+        return self.loans.get(loan_id)
+
+    def _close(self, loan):
+        book_id = loan.get("Book ID", "")
+        loan_ids = self.open_by_book.get(book_id)
+        if loan_ids is not None:
+            loan_ids.pop(loan.get("Loan ID"), None)
+            if not loan_ids:
+                del self.open_by_book[book_id]
+
+    def open_loan(self, book_id):
+        # The oldest open loan of the book when several copies are out.
+        for loan_id in self.open_by_book.get(book_id, ()):
+            return self.loans[loan_id]
+        return None
+
+    def open_loans(self):
+        return [self.loans[loan_id] for loan_ids in self.open_by_book.values() for loan_id in loan_ids]
+
+    def borrowed_between(self, start=None, end=None):
+        # Loans borrowed on or between two ordinals; either end may be left open.
+        if self._by_date is None:
+            self._by_date = sorted(filter(None, map(self._date_entry, self.loans.values())))
+        low = bisect_left(self._by_date, (start,)) if start is not None else 0
+        high = bisect_right(self._by_date, (end + 1,)) if end is not None else len(self._by_date)
+        return [self.loans[loan_id] for _, loan_id in self._by_date[low:high]]
+
+    def members(self):
+        if self._members is None:
+            self._members = MemberRegistry(self.loans.values())
+        return self._members
+
+    def member(self, member_id):
+        return self.members().get(member_id)
+
+    def due_queue(self):
+        if self._due is None:
+            self._due = DueQueue(self.open_loans())
+        return self._due
+
+    def find(self, field, value):
+        if field == "Loan ID":
+            return self.loans.get(value)
+        for loan in self.loans.values():
+            if loan.get(field) == value:
+                return loan
+        return None
+
+    def add(self, loan):
+        self._insert(loan)
+
+    def remove(self, loan_id):
+        loan = self.loans.pop(loan_id, None)
+        if loan is None:
+            return
+        self._unlist(loan)
+        if self._members is not None:
+            self._members.remove(loan_id)
+        if self._due is not None:
+            self._due.remove(loan_id)
+        self._close(loan)
+
+    def update(self, loan):
+        loan_id = loan["Loan ID"]
+        old = self.loans.get(loan_id)
+        if old is not None:
+            self._unlist(old)
+            self._close(old)
+        self._insert(loan)
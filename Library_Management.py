@@ -1,27 +1,389 @@
 import customtkinter as ctk
-from tkinter import ttk
-from datetime import datetime, timedelta 
-import pickle
-import os
+from bisect import bisect_left
+from tkinter import filedialog, ttk
+from Library_Analytics import Analytics
+from Library_Archive import HistoryArchive
+from Library_Core import BORROW_LIMIT, LibraryCore, LibraryError, day_number, due_date_for, today
+from Library_Events import BOOK_UPDATED, ChangeSet, EventBus
+from Library_Import import IMPORT_ERRORS
+from Library_Metrics import METRICS_FILE, Profiler, metrics, timed
+from Library_Records import date_ordinal, date_text
+from Library_Search import normalize_text
+from Library_Service import connect
+from Library_Storage import STORAGE_ERRORS
+from Library_Worker import IOWorker
 
 ctk.set_appearance_mode("light")
 ctk.set_default_color_theme("blue")
 
+ALL_GENRES = "All Genres"
+ALL_BOOKS = "All Books"
+ALL_LOANS = "All Loans"
+LOAN_STATUSES = (ALL_LOANS, "Borrowed", "Returned", "Overdue")
+FUZZY_RESULTS = 50
+
 class Screen(ctk.CTkFrame):
-    def __init__(self, parent):
+    # Screens are built the first time they are shown. load() fills in their
+    # data once the library has been read and the empty screen drawn.
+    def __init__(self, parent, system):
         super().__init__(parent)
+        self.system = system
+        self.visible = False
+        self.loaded = False
+        self.load_scheduled = False
+        self.changes = ChangeSet()
 
     def show(self):
         self.pack(fill="both", expand=True)
+        self.visible = True
+        if not self.loaded:
+            if not self.load_scheduled:
+                self.load_scheduled = True
+                self.system.when_loaded(self.first_load)
+            return
+        self.catch_up()
 
     def hide(self):
         self.pack_forget()
+        self.visible = False
 
-class MainScreen(Screen):
-    def __init__(self, parent, system, history_data_screen):
+    def first_load(self):
+        # Whatever changed before now is already in what load() reads.
+        self.loaded = True
+        self.changes.clear()
+        self.load()
+
+    def load(self):
+        pass
+
+    def popup(self, title, message):
+        self.system.popup(title, message)
+
+    def on_events(self, events):
+        # Hidden screens only note what changed and catch up when next shown.
+        self.changes.add(events)
+        if self.visible and self.loaded:
+            self.catch_up()
+
+    def catch_up(self):
+        if self.changes:
+            self.apply_changes(self.changes)
+            self.changes.clear()
+
+    def apply_changes(self, changes):
+        pass
+
+class Dialog(ctk.CTkToplevel):
+    # The one message window. Closing it only hides it, and the next message
+    # shows it again with new text instead of opening another window.
+    def __init__(self, parent):
         super().__init__(parent)
-        self.system = system
-        self.history_data_screen = history_data_screen
+        self.geometry("300x150")
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+        self.label = ctk.CTkLabel(self, text="", font=ctk.CTkFont(size=14))
+        self.label.pack(pady=20)
+        ok_button = ctk.CTkButton(self, text="OK", command=self.withdraw)
+        ok_button.pack(pady=10)
+
+    def show_message(self, title, message):
+        self.title(title)
+        self.label.configure(text=message)
+        self.deiconify()
+        self.lift()
+        self.focus()
+
+class TextWindow(ctk.CTkToplevel):
+    # A reusable read-only text window, hidden rather than destroyed when closed.
+    def __init__(self, parent, title, geometry="700x450"):
+        super().__init__(parent)
+        self.geometry(geometry)
+        self.title(title)
+        self.protocol("WM_DELETE_WINDOW", self.withdraw)
+        self.textbox = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Courier", size=12))
+        self.textbox.pack(fill="both", expand=True, padx=10, pady=10)
+        close_button = ctk.CTkButton(self, text="Close", width=120, command=self.withdraw)
+        close_button.pack(pady=10)
+
+    def show_text(self, text):
+        self.textbox.configure(state="normal")
+        self.textbox.delete("1.0", "end")
+        self.textbox.insert("end", text)
+        self.textbox.configure(state="disabled")
+        self.deiconify()
+        self.lift()
+
+class VirtualRadioList(ctk.CTkFrame):
+    # Only the rows inside the viewport (plus a few overscan rows) exist as widgets;
+    # scrolling rebinds the same radio buttons to different items. label turns an
+    # item into the text shown, and is only called for the rows on screen.
+    def __init__(self, parent, variable, command, width=250, height=200, row_height=28, overscan=3, label=str):
+        super().__init__(parent, width=width, height=height)
+        self.variable = variable
+        self.command = command
+        self.label = label
+        self.row_height = row_height
+        self.overscan = overscan
+        self.view_height = height
+        self.items = []
+        self.offset = 0
+        self.rows = []
+        self.row_items = []
+
+        self.viewport = ctk.CTkFrame(self, width=width, height=height, fg_color="transparent")
+        self.viewport.grid(row=0, column=0, sticky="nsew")
+        self.scrollbar = ctk.CTkScrollbar(self, command=self.on_scroll)
+        self.scrollbar.grid(row=0, column=1, sticky="ns")
+        self.grid_rowconfigure(0, weight=1)
+        self.grid_columnconfigure(0, weight=1)
+
+        self.message_label = ctk.CTkLabel(self.viewport, text="", font=ctk.CTkFont(size=14))
+
+        self.viewport.bind("<Configure>", self.on_resize)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            self.viewport.bind(sequence, self.on_mousewheel)
+
+    def make_row(self):
+        row = ctk.CTkRadioButton(self.viewport, text="", value="", variable=self.variable, command=self.command)
+        for sequence in ("<MouseWheel>", "<Button-4>", "<Button-5>"):
+            row.bind(sequence, self.on_mousewheel)
+        self.rows.append(row)
+        self.row_items.append(None)
+
+    def set_items(self, items):
+        # The list is kept, not copied; callers hand over one they will not change.
+        self.items = items
+        self.offset = 0
+        self.message_label.place_forget()
+        self.refresh()
+
+    def refresh(self):
+        # Labels may have changed even where the items did not; False marks a
+        # placed row as stale without forgetting that it is placed.
+        self.row_items = [None if item is None else False for item in self.row_items]
+        self.render()
+
+    def show_message(self, message):
+        self.set_items([])
+        self.message_label.configure(text=message)
+        self.message_label.place(x=10, y=5)
+
+    def on_resize(self, event):
+        self.view_height = int(event.height / ctk.ScalingTracker.get_widget_scaling(self))
+        self.render()
+
+    def on_scroll(self, action, amount, unit=None):
+        total = len(self.items) * self.row_height
+        if action == "moveto":
+            self.offset = int(float(amount) * total)
+        elif unit == "pages":
+            self.offset += int(amount) * self.view_height
+        else:
+            self.offset += int(amount) * self.row_height
+        self.render()
+
+    def on_mousewheel(self, event):
+        if event.num == 4 or event.delta > 0:
+            self.on_scroll("scroll", -3, "units")
+        else:
+            self.on_scroll("scroll", 3, "units")
+
+    @timed("gui.radio_render")
+    def render(self):
+        total = len(self.items) * self.row_height
+        self.offset = max(0, min(self.offset, total - self.view_height))
+
+        needed = self.view_height // self.row_height + 1 + 2 * self.overscan
+        while len(self.rows) < needed:
+            self.make_row()
+
+        first = max(0, self.offset // self.row_height - self.overscan)
+        selected = self.variable.get()
+        for slot, row in enumerate(self.rows):
+            index = first + slot
+            if slot >= needed or index >= len(self.items):
+                if self.row_items[slot] is not None:
+                    row.place_forget()
+                    self.row_items[slot] = None
+                continue
+
+            item = self.items[index]
+            if self.row_items[slot] != item:
+                row.configure(text=self.label(item), value=item)
+                self.row_items[slot] = item
+            if item == selected:
+                row.select(from_variable_callback=True)
+            else:
+                row.deselect(from_variable_callback=True)
+            row.place(x=10, y=index * self.row_height - self.offset)
+
+        if total > self.view_height:
+            self.scrollbar.set(self.offset / total, (self.offset + self.view_height) / total)
+        else:
+            self.scrollbar.set(0, 1)
+
+def text_key(value):
+    return str(value).casefold()
+
+def availability_key(value):
+    # "3 of 5" -> (3, 5)
+    available, _, copies = str(value).partition(" of ")
+    return (int(available), int(copies)) if available.isdigit() and copies.isdigit() else (0, 0)
+
+def fine_key(value):
+    # "20 Bath" / "No Fine"
+    amount = str(value).split(" ", 1)[0]
+    return int(amount) if amount.isdigit() else 0
+
+class TreeTable:
+    # Keeps a Treeview in step with keyed rows: only changed rows are touched, and
+    # new rows are inserted a page at a time from after() so the window stays live.
+    # Clicking a heading sorts by that column. Sort keys are worked out once per
+    # row and column and dropped when the row changes; while sorted, rows are
+    # kept in a sorted list so a changed row is moved rather than everything re-sorted.
+    def __init__(self, tree, page_size=500, sort_keys=None):
+        self.tree = tree
+        self.page_size = page_size
+        self.rows = {}
+        self.iids = {}
+        self.pending = []
+        self.pending_values = {}
+        self.after_id = None
+        self.sort_keys = sort_keys or {}
+        self.key_cache = {}
+        self.sort_column = None
+        self.sort_reverse = False
+        self.ordered = None
+        self.columns = list(tree["columns"])
+        for index, column in enumerate(self.columns):
+            tree.heading(column, command=lambda index=index: self.sort_by(index))
+
+    def iid(self, key):
+        return f"k{key}"
+
+    def selected_keys(self):
+        return [self.iids[iid] for iid in self.tree.selection() if iid in self.iids]
+
+    def sort_entry(self, column, key):
+        cache = self.key_cache.get(column)
+        if cache is None:
+            cache = self.key_cache[column] = {}
+        entry = cache.get(key)
+        if entry is None:
+            entry = cache[key] = (self.sort_keys.get(column, text_key)(self.rows[key][column]), key)
+        return entry
+
+    def forget_keys(self, key):
+        for cache in self.key_cache.values():
+            cache.pop(key, None)
+
+    def place(self, key):
+        # Adds the row's entry to the sorted list and returns its index in the tree.
+        entry = self.sort_entry(self.sort_column, key)
+        position = bisect_left(self.ordered, entry)
+        self.ordered.insert(position, entry)
+        return len(self.ordered) - 1 - position if self.sort_reverse else position
+
+    def unplace(self, key):
+        entry = self.key_cache[self.sort_column].get(key)
+        if entry is None:
+            return
+        position = bisect_left(self.ordered, entry)
+        if position < len(self.ordered) and self.ordered[position] == entry:
+            del self.ordered[position]
+
+    @timed("gui.tree_sort")
+    def sort_by(self, column):
+        if column == self.sort_column:
+            self.sort_reverse = not self.sort_reverse
+        else:
+            self.sort_column = column
+            self.sort_reverse = False
+        self.ordered = sorted(self.sort_entry(column, key) for key in self.rows)
+        order = reversed(self.ordered) if self.sort_reverse else self.ordered
+        for index, (_, key) in enumerate(order):
+            self.tree.move(self.iid(key), "", index)
+
+        for index, name in enumerate(self.columns):
+            arrow = ""
+            if index == column:
+                arrow = " \u25bc" if self.sort_reverse else " \u25b2"
+            self.tree.heading(name, text=name + arrow)
+
+    def upsert(self, key, values):
+        if key in self.pending_values:
+            self.pending_values[key] = values
+            return
+        iid = self.iid(key)
+        if key in self.rows:
+            if self.rows[key] != values:
+                if self.ordered is not None:
+                    self.unplace(key)
+                self.forget_keys(key)
+                self.rows[key] = values
+                self.tree.item(iid, values=values)
+                if self.ordered is not None:
+                    self.tree.move(iid, "", self.place(key))
+            return
+        self.rows[key] = values
+        self.iids[iid] = key
+        index = self.place(key) if self.ordered is not None else "end"
+        self.tree.insert("", index, iid=iid, values=values)
+
+    def delete(self, key):
+        self.pending_values.pop(key, None)
+        if key in self.rows:
+            if self.ordered is not None:
+                self.unplace(key)
+            self.forget_keys(key)
+            del self.rows[key]
+            iid = self.iid(key)
+            del self.iids[iid]
+            self.tree.delete(iid)
+
+    @timed("gui.tree_sync")
+    def sync(self, rows):
+        self.cancel()
+        new_rows = dict(rows)
+
+        stale = [key for key in self.rows if key not in new_rows]
+        if stale:
+            self.tree.delete(*[self.iid(key) for key in stale])
+            for key in stale:
+                self.forget_keys(key)
+                del self.rows[key]
+                del self.iids[self.iid(key)]
+            if self.ordered is not None:
+                self.ordered = [entry for entry in self.ordered if entry[1] in self.rows]
+
+        for key, values in new_rows.items():
+            if key in self.rows:
+                self.upsert(key, values)
+            else:
+                self.pending.append(key)
+                self.pending_values[key] = values
+        self.insert_page()
+
+    @timed("gui.tree_page")
+    def insert_page(self):
+        self.after_id = None
+        page = self.pending[:self.page_size]
+        del self.pending[:self.page_size]
+        for key in page:
+            if key in self.pending_values:
+                self.upsert(key, self.pending_values.pop(key))
+        if self.pending:
+            self.after_id = self.tree.after(1, self.insert_page)
+
+    def cancel(self):
+        if self.after_id is not None:
+            self.tree.after_cancel(self.after_id)
+            self.after_id = None
+        self.pending = []
+        self.pending_values = {}
+
+class MainScreen(Screen):
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
         
         title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
         title_frame.pack(pady=20)
@@ -50,6 +412,11 @@ class MainScreen(Screen):
             entry.grid(row=i, column=1, pady=5, padx=5, sticky="w")
             self.entries[label] = entry
 
+        self.member_label = ctk.CTkLabel(input_frame, text="", font=ctk.CTkFont(size=12))
+        self.member_label.grid(row=len(labels), column=0, columnspan=2, pady=5, sticky="w")
+        self.entries["ID"].bind("<Return>", lambda event: self.lookup_member())
+        self.entries["ID"].bind("<FocusOut>", lambda event: self.lookup_member())
+
         #Right
         search_frame = ctk.CTkFrame(content_frame)
         search_frame.grid(row=0, column=1, padx=(10, 20), pady=10, sticky="n")
@@ -58,12 +425,18 @@ class MainScreen(Screen):
         self.search_entry.grid(row=0, column=0, padx=5, pady=5, sticky="w")
         self.search_entry.bind("<KeyRelease>", lambda event: self.search_books())
 
-        self.scrollable_list_frame = ctk.CTkScrollableFrame(search_frame, width=250, height=200)
-        self.scrollable_list_frame.grid(row=1, column=0, padx=5, pady=5, sticky="nsew")
+        self.fuzzy_var = ctk.BooleanVar(value=False)
+        fuzzy_check = ctk.CTkCheckBox(search_frame, text="Fuzzy", variable=self.fuzzy_var, command=self.search_books, width=60)
+        fuzzy_check.grid(row=0, column=1, padx=5, pady=5, sticky="e")
 
         self.selected_item_var = ctk.StringVar()
-        
-        self.update_radio_buttons(self.load_data_from_file("book_data.pkl", lambda book: book.get("Book Title", "Unknown Title")))
+        self.shown = None
+
+        self.scrollable_list_frame = VirtualRadioList(
+            search_frame, self.selected_item_var, self.update_entry, width=250, height=200, label=self.book_label
+        )
+        self.scrollable_list_frame.grid(row=1, column=0, columnspan=2, padx=5, pady=5, sticky="nsew")
+        self.update_label("Loading books...")
 
         #Button
         button_frame = ctk.CTkFrame(self)
@@ -78,27 +451,24 @@ class MainScreen(Screen):
         btn_book_data = ctk.CTkButton(button_frame, text="Book Data", width=100, height=40, font=ctk.CTkFont(size=14), command=self.system.show_book_data_screen)
         btn_book_data.grid(row=0, column=2, padx=10, pady=10)
 
+        btn_diagnostics = ctk.CTkButton(button_frame, text="Diagnostics", width=100, height=40, font=ctk.CTkFont(size=14), command=self.system.show_diagnostics_screen)
+        btn_diagnostics.grid(row=0, column=3, padx=10, pady=10)
+
+        btn_analytics = ctk.CTkButton(button_frame, text="Analytics", width=100, height=40, font=ctk.CTkFont(size=14), command=self.system.show_analytics_screen)
+        btn_analytics.grid(row=0, column=4, padx=10, pady=10)
+
         btn_exit = ctk.CTkButton(button_frame, text="Exit", width=100, height=40, font=ctk.CTkFont(size=14), command=self.system.root.quit)
-        btn_exit.grid(row=0, column=3, padx=10, pady=10)
+        btn_exit.grid(row=0, column=5, padx=10, pady=10)
 
         content_frame.grid_columnconfigure(0, weight=1)
         content_frame.grid_columnconfigure(1, weight=1)
 
-    def load_data_from_file(self, file_name, extract):
-        try:
-            if os.path.exists(file_name):
-                with open(file_name, "rb") as file:
-                    data = pickle.load(file)
-                    return [extract(item) for item in data]
-            return []
-        except (OSError, pickle.UnpicklingError) as e:
-            self.popup("Error", f"Error loading file '{file_name}': {str(e)}")
-            return []
+    def load(self):
+        self.search_books()
 
     def update_entry(self):
         try:
-            selected_title = self.selected_item_var.get()
-            book_info = self.get_data("book_data.pkl", "Book Title", selected_title)
+            book_info = self.get_data("Book ID", self.selected_item_var.get())
 
             if book_info:
                 self.entries["Book ID"].delete(0, "end")
@@ -106,54 +476,97 @@ class MainScreen(Screen):
                 self.entries["Book ID"].insert(0, book_info.get("Book ID", ""))
                 self.entries["Book Title"].insert(0, book_info.get("Book Title", ""))
 
-                today = datetime.today().strftime("%Y-%m-%d")
+                date_borrowed = today()
                 self.entries["Date Borrowed"].delete(0, "end")
-                self.entries["Date Borrowed"].insert(0, today)
-
-                date_borrowed_obj = datetime.strptime(today, "%Y-%m-%d")
-                date_return_obj = date_borrowed_obj + timedelta(days=15)
+                self.entries["Date Borrowed"].insert(0, date_borrowed)
 
                 self.entries["Date Return"].delete(0, "end")
-                self.entries["Date Return"].insert(0, date_return_obj.strftime("%Y-%m-%d"))
+                self.entries["Date Return"].insert(0, due_date_for(date_borrowed))
         except Exception as e:
             self.popup("Error", f"Error updating entry fields: {str(e)}")
 
+    @timed("gui.search_books")
     def search_books(self):
-        search = self.search_entry.get().lower()
-        matching_titles = [title for title in self.load_data_from_file("book_data.pkl", lambda book: book.get("Book Title", "Unknown Title")) if search in title.lower()]
-        self.update_radio_buttons(matching_titles)
+        query = self.search_entry.get()
+        try:
+            if self.fuzzy_var.get() and query.strip():
+                ranked = self.system.cache.search_ranked(query, FUZZY_RESULTS)
+                book_ids = [book.get("Book ID", "") for score, book in ranked]
+            else:
+                book_ids = self.system.cache.search_ids(query)
+        except STORAGE_ERRORS as e:
+            self.popup("Error", f"Error loading book data: {str(e)}")
+            book_ids = []
+        self.shown = None
+        self.update_radio_buttons(book_ids)
+
+    def apply_changes(self, changes):
+        # Updates (a borrow or return changes the shelf count) keep every row in
+        # place, so only the labels on screen are redrawn; the search is only run
+        # again for added or deleted books, or a title edit that changes whether a
+        # book matches the query.
+        if changes.reload or any(kind != BOOK_UPDATED for kind in changes.books.values()):
+            self.search_books()
+            return
+        query = self.search_entry.get()
+        if query.strip() and self.fuzzy_var.get():
+            self.search_books()
+            return
+        needle = normalize_text(query)
+        if needle:
+            if self.shown is None:
+                self.shown = set(self.scrollable_list_frame.items)
+            for book_id in changes.books:
+                book = self.system.cache.get_book(book_id)
+                matches = book is not None and needle in normalize_text(book.get("Book Title", "Unknown Title"))
+                if matches != (book_id in self.shown):
+                    self.search_books()
+                    return
+        self.scrollable_list_frame.refresh()
 
     def update_radio_buttons(self, items):
-        for widget in self.scrollable_list_frame.winfo_children():
-            widget.destroy()  
-
         if items:
-            for item in items:
-                radiobutton = ctk.CTkRadioButton(
-                    self.scrollable_list_frame,
-                    text=item,
-                    value=item,
-                    variable=self.selected_item_var,
-                    command=self.update_entry
-                )
-                radiobutton.pack(anchor="w", padx=10, pady=2)
+            self.scrollable_list_frame.set_items(items)
         else:
             self.update_label("No books found")
 
     def update_label(self, message):
-        for widget in self.scrollable_list_frame.winfo_children():
-            widget.destroy()
+        self.scrollable_list_frame.show_message(message)
 
-        label = ctk.CTkLabel(self.scrollable_list_frame, text=message, font=ctk.CTkFont(size=14))
-        label.pack(anchor="w", padx=10, pady=5)
+    def book_label(self, book_id):
+        # "Title (3 of 5)": copies on the shelf, read from the book record.
+        try:
+            book = self.system.cache.get_book(book_id)
+        except STORAGE_ERRORS:
+            book = None
+        if book is None:
+            return book_id
+        return f"{book.get('Book Title', 'Unknown Title')} ({book.availability()})"
 
 
-    def get_data(self, file_name, field, value):
-        data = self.load_data_from_file(file_name, lambda item: item)
-        for item in data:
-            if item.get(field) == value:
-                return item
-        return None
+    def get_data(self, field, value):
+        try:
+            return self.system.cache.find_book(field, value)
+        except STORAGE_ERRORS as e:
+            self.popup("Error", f"Error loading book data: {str(e)}")
+            return None
+
+    def lookup_member(self):
+        member_id = self.entries["ID"].get().strip()
+        member = self.system.core.member(member_id) if member_id else None
+        if member is None:
+            self.member_label.configure(text="New member" if member_id else "")
+            return
+
+        first, _, last = member.name.partition(" ")
+        if not self.entries["First Name"].get().strip() and not self.entries["Last Name"].get().strip():
+            self.entries["First Name"].insert(0, first)
+            self.entries["Last Name"].insert(0, last)
+        fines = self.system.core.outstanding_fines(member)
+        self.member_label.configure(
+            text=f"{member.name}: {len(member.open_loans)} of {BORROW_LIMIT} books out, "
+            + (f"{fines} Bath in fines due" if fines > 0 else "no fines due")
+        )
 
     def add_data(self):
         for field in ["First Name", "Last Name", "Book ID", "Book Title", "Date Borrowed", "Date Return"]:
@@ -162,70 +575,25 @@ class MainScreen(Screen):
                 return  
 
         book_id = self.entries["Book ID"].get()
-        if not self.is_book_available(book_id):
-            self.popup("Error", "This book is already borrowed.")
-            return
-
         name = self.entries["First Name"].get() + " " + self.entries["Last Name"].get()
-        history_data = {
-            "Borrower Name": name,
-            "Book ID": book_id,
-            "Book Title": self.entries["Book Title"].get(),
-            "Date Borrowed": self.entries["Date Borrowed"].get(),
-            "Date Return": self.entries["Date Return"].get(),
-        }
-
-        self.save_to_file("history.pkl", history_data)
-        self.update_book_status(book_id, available=False)
+        member_id = self.entries["ID"].get().strip()
+        try:
+            self.system.core.borrow(
+                name, book_id, self.entries["Date Borrowed"].get(), self.entries["Date Return"].get(), member_id
+            )
+        except LibraryError as e:
+            self.popup("Error", str(e))
+            return
         
         self.popup("Confirmation", "Book borrowed successfully!")
 
         for entry in self.entries.values():
             entry.delete(0, "end")
-
-        self.history_data_screen.display_history()
-
-    def popup(self, title, message):
-        popup = ctk.CTkToplevel(self)
-        popup.geometry("300x150")
-        popup.title(title)
-        label = ctk.CTkLabel(popup, text=message, font=ctk.CTkFont(size=14))
-        label.pack(pady=20)
-        ok_button = ctk.CTkButton(popup, text="OK", command=popup.destroy)
-        ok_button.pack(pady=10)
-
-    def is_book_available(self, book_id):
-        return self.get_data("book_data.pkl", "Book ID", book_id).get("Available", True)
-
-    def update_book_status(self, book_id, available):
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-
-            for book in all_books:
-                if book.get("Book ID") == book_id:
-                    book["Available"] = available
-
-            with open(data_file, "wb") as file:
-                pickle.dump(all_books, file)
-
-    def save_to_file(self, file_name, data):
-        if os.path.exists(file_name):
-            with open(file_name, "rb") as file:
-                all_data = pickle.load(file)
-        else:
-            all_data = []
-
-        all_data.append(data)
-        with open(file_name, "wb") as file:
-            pickle.dump(all_data, file)
+        self.member_label.configure(text="")
 
 class BookDataScreen(Screen):
-    def __init__(self, parent, system, main):
-        super().__init__(parent)
-        self.system = system
-        self.main_screen = main
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
         
         title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
         title_frame.pack(fill="x")
@@ -237,6 +605,21 @@ class BookDataScreen(Screen):
         )
         title_label.pack(pady=5)
 
+        #Filter
+        filter_frame = ctk.CTkFrame(self)
+        filter_frame.pack(fill="x", padx=20, pady=(10, 0))
+
+        self.genre_filter = ctk.CTkOptionMenu(filter_frame, values=[ALL_GENRES], width=180, command=self.filter_changed)
+        self.genre_filter.pack(side="left", padx=10, pady=5)
+
+        self.availability_filter = ctk.CTkOptionMenu(
+            filter_frame, values=[ALL_BOOKS, "Available", "Not Available"], width=160, command=self.filter_changed
+        )
+        self.availability_filter.pack(side="left", padx=10, pady=5)
+
+        self.count_label = ctk.CTkLabel(filter_frame, text="Loading books...")
+        self.count_label.pack(side="right", padx=10)
+
         self.display_frame = ctk.CTkFrame(self)
         self.display_frame.pack(fill="both", expand=True, padx=20, pady=10)
 
@@ -258,6 +641,8 @@ class BookDataScreen(Screen):
         self.book_tree.configure(xscrollcommand=h_scrollbar.set)
         h_scrollbar.pack(side="bottom", fill="x")
 
+        self.table = TreeTable(self.book_tree, sort_keys={4: availability_key})
+
         #Button
         button_frame = ctk.CTkFrame(self)
         button_frame.pack(fill="x", padx=20, pady = 10)
@@ -271,79 +656,167 @@ class BookDataScreen(Screen):
         delete_button = ctk.CTkButton(button_frame, text="Delete Book", width=120, command=self.delete_book)
         delete_button.pack(side="left", padx=20)
 
+        import_button = ctk.CTkButton(button_frame, text="Import", width=120, command=self.import_books)
+        import_button.pack(side="left", padx=20)
+
+        self.import_label = ctk.CTkLabel(button_frame, text="")
+        self.import_label.pack(side="left", padx=10)
+
         back_button = ctk.CTkButton(button_frame, text="Back", width=120, command=self.system.show_main_screen)
         back_button.pack(side="right", padx=20)
 
+    def load(self):
         self.display_books()
 
-    def display_books(self):
-        for item in self.book_tree.get_children():
-            self.book_tree.delete(item)
+    @staticmethod
+    def book_values(book):
+        return (
+            book.book_id,
+            book.title,
+            book.author,
+            book.genre,
+            book.availability()
+        )
+
+    def filter_changed(self, value=None):
+        self.display_books()
 
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
+    def filtered_books(self):
+        # Each active filter is one index lookup; the smallest set is walked and
+        # checked against the others.
+        catalog = self.system.cache.catalog()
+        sets = []
+        genre = self.genre_filter.get()
+        if genre != ALL_GENRES:
+            sets.append(catalog.ids("Genre", genre))
+        availability = self.availability_filter.get()
+        if availability != ALL_BOOKS:
+            sets.append(catalog.ids("Available", availability == "Available"))
+        if not sets:
+            return catalog.books.values()
+        sets.sort(key=len)
+        return [catalog.books[book_id] for book_id in sets[0] if all(book_id in ids for ids in sets[1:])]
+
+    def book_matches(self, book):
+        genre = self.genre_filter.get()
+        if genre != ALL_GENRES and book.genre != genre:
+            return False
+        availability = self.availability_filter.get()
+        return availability == ALL_BOOKS or (book.available > 0) == (availability == "Available")
+
+    def update_genres(self):
+        genres = sorted((genre for genre in self.system.cache.catalog().values("Genre") if genre), key=str.casefold)
+        self.genre_filter.configure(values=[ALL_GENRES] + genres)
+
+    def update_count(self):
+        self.count_label.configure(text=f"{len(self.table.rows) + len(self.table.pending_values)} of {len(self.system.cache.catalog())} books")
+
+    @timed("gui.display_books")
+    def display_books(self):
+        books = self.filtered_books()
+        self.table.sync((book.book_id, self.book_values(book)) for book in books)
+        self.update_genres()
+        self.update_count()
+
+    def apply_changes(self, changes):
+        if changes.reload:
+            self.display_books()
+            return
+        for book_id in changes.books:
+            self.refresh_book(book_id)
+        self.update_genres()
+        self.update_count()
+
+    @timed("gui.refresh_book")
+    def refresh_book(self, book_id):
+        book = self.system.cache.get_book(book_id)
+        if book is None or not self.book_matches(book):
+            self.table.delete(book_id)
         else:
-            all_books = []
-
-        for book in all_books:
-            availability = "Available" if book.get("Available", True) else "Not Available"
-            book_values = (
-                book.get("Book ID", ""),
-                book.get("Book Title", ""),
-                book.get("Author Name", ""),
-                book.get("Genre", ""),
-                availability  
-            )
-            self.book_tree.insert("", "end", values=book_values)
+            self.table.upsert(book_id, self.book_values(book))
             
     def delete_book(self):
-        selected_item = self.book_tree.selection()
-        if selected_item:
-            book_id = self.book_tree.item(selected_item, "values")[0] 
-            self.book_tree.delete(selected_item)  
-            data_file = "book_data.pkl"
-            if os.path.exists(data_file):
-                with open(data_file, "rb") as file:
-                    all_books = pickle.load(file)
-
-                updated_books = [book for book in all_books if book.get("Book ID", "") != book_id]
-                with open(data_file, "wb") as file:
-                    pickle.dump(updated_books, file)
-
-            self.main_screen.update_radio_buttons(
-                self.main_screen.load_data_from_file(
-                    "book_data.pkl", lambda book: book.get("Book Title", "Unknown Title")
-                )
-            )
+        selected_keys = self.table.selected_keys()
+        if selected_keys:
+            book_id = selected_keys[0]
+            self.system.core.delete_book(book_id)
         else:
             return
 
-    def edit_book(self):
-        selected_item = self.book_tree.selection()
-        if selected_item:
-            book_id = self.book_tree.item(selected_item, "values")[0]
+    def import_books(self):
+        file_name = filedialog.askopenfilename(
+            title="Import Books",
+            filetypes=[("CSV or JSON Lines", "*.csv *.jsonl *.json"), ("All files", "*.*")]
+        )
+        if not file_name:
+            return
+
+        try:
+            importer = self.system.core.import_books(file_name, batch_size=2000, progress=self.show_import_progress)
+        except IMPORT_ERRORS as e:
+            self.popup("Error", f"Error importing '{file_name}': {str(e)}")
+            return
+        self.after(1, self.import_step, importer)
+
+    def import_step(self, importer):
+        try:
+            more = importer.step()
+        except IMPORT_ERRORS as e:
+            self.import_label.configure(text="")
+            self.popup("Error", f"Import stopped after {importer.imported} books: {str(e)}")
+            more = False
+        if more:
+            self.after(1, self.import_step, importer)
+            return
 
-            data_file = "book_data.pkl"
-            if os.path.exists(data_file):
-                with open(data_file, "rb") as file:
-                    all_books = pickle.load(file)
+        self.import_label.configure(text="")
+        if importer.done:
+            lines = [importer.summary()] + [f"Line {line}: {reason}" for line, reason in importer.rejected[:5]]
+            self.popup("Import", "\n".join(lines))
 
-                book_to_edit = next((book for book in all_books if book.get("Book ID", "") == book_id), None)
-                if book_to_edit:
-                    self.system.show_edit_screen(book_to_edit)
+    def show_import_progress(self, importer):
+        self.import_label.configure(text=f"Importing... {importer.imported} added, {len(importer.rejected)} rejected")
+
+    def edit_book(self):
+        selected_keys = self.table.selected_keys()
+        if selected_keys:
+            book_id = selected_keys[0]
+
+            book_to_edit = self.system.cache.get_book(book_id)
+            if book_to_edit:
+                self.system.show_edit_screen(book_to_edit)
 
 class HistoryScreen(Screen):
     def __init__(self, parent, system):
-        super().__init__(parent)
-        self.system = system
+        super().__init__(parent, system)
         
         title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
         title_frame.pack(fill="x")
         title_label = ctk.CTkLabel(title_frame, text="History", font=ctk.CTkFont(size=18, weight="bold"), text_color="white")
         title_label.pack(pady=5)
 
+        #Filter
+        filter_frame = ctk.CTkFrame(self)
+        filter_frame.pack(fill="x", padx=20, pady=(10, 0))
+
+        self.status_filter = ctk.CTkOptionMenu(filter_frame, values=list(LOAN_STATUSES), width=140, command=self.filter_changed)
+        self.status_filter.pack(side="left", padx=10, pady=5)
+
+        self.from_entry = ctk.CTkEntry(filter_frame, placeholder_text="Borrowed from YYYY-MM-DD", width=200)
+        self.from_entry.pack(side="left", padx=10, pady=5)
+        self.from_entry.bind("<Return>", self.filter_changed)
+
+        self.to_entry = ctk.CTkEntry(filter_frame, placeholder_text="Borrowed to YYYY-MM-DD", width=200)
+        self.to_entry.pack(side="left", padx=10, pady=5)
+        self.to_entry.bind("<Return>", self.filter_changed)
+
+        filter_button = ctk.CTkButton(filter_frame, text="Filter", width=80, command=self.filter_changed)
+        filter_button.pack(side="left", padx=10, pady=5)
+
+        self.count_label = ctk.CTkLabel(filter_frame, text="")
+        self.count_label.pack(side="right", padx=10)
+        self.date_range = (None, None)
+
         #####Table#####
         self.display_frame = ctk.CTkFrame(self)
         self.display_frame.pack(fill="both", expand=True, padx=20, pady=10)
@@ -365,6 +838,8 @@ class HistoryScreen(Screen):
         self.book_tree.configure(xscrollcommand=h_scrollbar.set)
         h_scrollbar.pack(side="bottom", fill="x")
 
+        self.table = TreeTable(self.book_tree, sort_keys={5: fine_key})
+
         #Button
         button_frame = ctk.CTkFrame(self)
         button_frame.pack(fill="x", pady=10)
@@ -372,123 +847,187 @@ class HistoryScreen(Screen):
         return_button = ctk.CTkButton(button_frame, text="Return Book", width=120, command=self.return_book)
         return_button.pack(side="left", padx=10)
 
+        self.archived_loans = {}
+        self.loaded_periods = []
+        self.older_button = ctk.CTkButton(button_frame, text="Load Older", width=160, command=self.load_older)
+        self.older_button.pack(side="left", padx=10)
+
+        overdue_button = ctk.CTkButton(button_frame, text="Overdue Report", width=140, command=self.show_overdue_report)
+        overdue_button.pack(side="left", padx=10)
+
         back_button = ctk.CTkButton(button_frame, text="Back", width=120, command=self.system.show_main_screen)
         back_button.pack(side="right", padx=10)
 
+        self.report_window = None
+
+    def load(self):
+        self.display_history()
+
+    @staticmethod
+    def history_values(history):
+        return_status = history.status
+        fine = history.fine
+
+        return (
+            history.borrower,
+            history.title,
+            date_text(history.date_borrowed),
+            date_text(history.date_return),
+            return_status,
+            f"{fine} Bath" if fine > 0 else "No Fine"
+        )
+
+    def read_date(self, entry):
+        text = entry.get().strip()
+        if not text:
+            return None
+        ordinal = date_ordinal(text)
+        if ordinal is None:
+            raise ValueError(f"'{text}' is not a date (YYYY-MM-DD)")
+        return ordinal
+
+    def filter_changed(self, event=None):
+        try:
+            self.date_range = (self.read_date(self.from_entry), self.read_date(self.to_entry))
+        except ValueError as e:
+            self.popup("Error", str(e))
+            return
         self.display_history()
 
+    def filtered_history(self):
+        # Start from the narrowest index: the borrow date order for a date range,
+        # the open loans for Borrowed/Overdue; the other filters are checked per loan.
+        history = self.system.cache.loans()
+        start, end = self.date_range
+        status = self.status_filter.get()
+        if start is not None or end is not None:
+            loans = history.borrowed_between(start, end)
+        elif status == "Overdue":
+            loans = [loan for due, loan in history.due_queue().overdue(day_number(today()))]
+        elif status == "Borrowed":
+            loans = history.open_loans()
+        elif status == ALL_LOANS:
+            return list(history) + list(self.archived_loans.values())
+        else:
+            loans = history
+        as_of = day_number(today())
+        loans = [loan for loan in loans if self.loan_matches(loan, as_of)]
+        return loans + [loan for loan in self.archived_loans.values() if self.loan_matches(loan, as_of)]
+
+    def loan_matches(self, loan, as_of=None):
+        start, end = self.date_range
+        if start is not None or end is not None:
+            borrowed = date_ordinal(loan.date_borrowed)
+            if borrowed is None or (start is not None and borrowed < start) or (end is not None and borrowed > end):
+                return False
+        status = self.status_filter.get()
+        if status == ALL_LOANS:
+            return True
+        if status == "Returned":
+            return loan.status == "Returned"
+        if loan.status == "Returned":
+            return False
+        if status == "Overdue":
+            due = date_ordinal(loan.date_return)
+            return due is not None and due < (as_of if as_of is not None else day_number(today()))
+        return True
+
+    def update_count(self):
+        total = len(self.system.cache.loans()) + len(self.archived_loans)
+        self.count_label.configure(text=f"{len(self.table.rows) + len(self.table.pending_values)} of {total} loans")
+
+    @timed("gui.display_history")
     def display_history(self):
-        for item in self.book_tree.get_children():
-            self.book_tree.delete(item)
+        loans = self.filtered_history()
+        self.table.sync((history.loan_id, self.history_values(history)) for history in loans)
+        self.update_older_button()
+        self.update_count()
+
+    def older_periods(self):
+        return [period for period in self.system.core.archived_periods() if period not in self.loaded_periods]
+
+    def update_older_button(self):
+        periods = self.older_periods()
+        if periods:
+            self.older_button.configure(text=f"Load Older ({periods[0]})", state="normal")
+        else:
+            self.older_button.configure(text="No Older History", state="disabled")
+
+    def load_older(self):
+        periods = self.older_periods()
+        if not periods:
+            return
+        try:
+            loans = self.system.core.load_archived(periods[0])
+        except STORAGE_ERRORS as e:
+            self.popup("Error", f"Error loading archived history: {str(e)}")
+            return
 
-        history_file = "history.pkl"
-        if os.path.exists(history_file):
-            with open(history_file, "rb") as file:
-                all_history = pickle.load(file)
+        self.loaded_periods.append(periods[0])
+        as_of = day_number(today())
+        for history in loans:
+            self.archived_loans[history["Loan ID"]] = history
+            if self.loan_matches(history, as_of):
+                self.table.upsert(history["Loan ID"], self.history_values(history))
+        self.update_older_button()
+        self.update_count()
+
+    def apply_changes(self, changes):
+        if changes.reload:
+            self.display_history()
+            return
+        loans = self.system.cache.loans()
+        for loan_id in changes.loans:
+            history = loans.get(loan_id) or self.archived_loans.get(loan_id)
+            if history is None:
+                self.table.delete(loan_id)
+            else:
+                self.refresh_loan(history)
+        self.update_count()
+
+    @timed("gui.refresh_loan")
+    def refresh_loan(self, history):
+        if self.loan_matches(history):
+            self.table.upsert(history["Loan ID"], self.history_values(history))
         else:
-            all_history = []
-
-        for history in all_history:
-            return_status = history.get("Status", "Borrowed")
-            fine = history.get("Fine", 0)
-
-            history_values = (
-                history.get("Borrower Name", ""),
-                history.get("Book Title", ""),
-                history.get("Date Borrowed", ""),
-                history.get("Date Return", ""),
-                return_status,
-                f"{fine} Bath" if fine > 0 else "No Fine"
-            )
-            self.book_tree.insert("", "end", values=history_values)
+            self.table.delete(history["Loan ID"])
+
 
+    def overdue_report_lines(self, report):
+        lines = [f"Overdue as of {report['as_of']}: {len(report['overdue'])} loans, {report['total_fines']} Bath in fines", ""]
+        for loan, fine in report["overdue"]:
+            lines.append(f"due {loan['Date Return']}  {fine:>6} Bath  {loan['Book ID']}  {loan['Book Title']}  ({loan['Borrower Name']})")
+        lines += ["", f"Next {len(report['upcoming'])} due"]
+        for loan in report["upcoming"]:
+            lines.append(f"due {loan['Date Return']}  {loan['Book ID']}  {loan['Book Title']}  ({loan['Borrower Name']})")
+        return lines
 
-    def is_book_returned(self, book_id):
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-                for book in all_books:
-                    if book.get("Book ID") == book_id:
-                        return book.get("Available", False)
-        return False
+    def show_overdue_report(self):
+        report = self.system.core.overdue_report()
+        if self.report_window is None or not self.report_window.winfo_exists():
+            self.report_window = TextWindow(self, "Overdue Report")
+        self.report_window.show_text("\n".join(self.overdue_report_lines(report)))
 
     def return_book(self):    
-        selected_item = self.book_tree.selection()
-        if not selected_item:
+        selected_keys = self.table.selected_keys()
+        if not selected_keys:
             return  
         
-        item_values = self.book_tree.item(selected_item)["values"]
-        book_title = item_values[1]
-        due_date = item_values[3] 
-        book_id = self.get_book_id_by_title(book_title)
-
-        if book_id:
-            self.mark_book_as_available(book_id)
-            return_date = datetime.now().strftime("%Y-%m-%d")
-
-            fine = self.calculate_fine(due_date, return_date)
-            self.returned(book_id, return_date, fine)
-
-            self.display_history()
+        loan = self.system.core.find_loan(selected_keys[0])
+        if loan is None:
+            return
 
-    def calculate_fine(self, due_date, return_date):
-        due_date = datetime.strptime(due_date, "%Y-%m-%d")
-        return_date = datetime.strptime(return_date, "%Y-%m-%d")
-        
-        overdue_days = (return_date - due_date).days
-        if overdue_days > 0:
-            return overdue_days * 5 
-        return 0
-
-    def get_book_id_by_title(self, title):
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-                for book in all_books:
-                    if book.get("Book Title") == title:
-                        return book.get("Book ID")
-        return None
-
-    def make_available(self, book_id):
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-
-            for book in all_books:
-                if book.get("Book ID") == book_id:
-                    book["Available"] = True
-
-            with open(data_file, "wb") as file:
-                pickle.dump(all_books, file)
-
-    def returned(self, book_id, return_date, fine):
-        history_file = "history.pkl"
-        if os.path.exists(history_file):
-            with open(history_file, "rb") as file:
-                all_history = pickle.load(file)
-
-            for history in all_history:
-                if history.get("Book ID") == book_id:
-                    history["Status"] = "Returned"
-                    history["Date Return"] = return_date
-                    history["Fine"] = fine 
-                    break
-
-            with open(history_file, "wb") as file:
-                pickle.dump(all_history, file)
-
-        self.make_available(book_id)
+        try:
+            self.system.core.return_loan(loan)
+        except LibraryError as e:
+            self.popup("Error", str(e))
+            return
 
 class EditBookScreen(Screen):
-    def __init__(self, parent, system, book_data, main_screen, book_data_screen):
-        super().__init__(parent)
-        self.system = system
-        self.book_data = book_data  
-        self.book_data_screen = book_data_screen
-        self.main_screen = main_screen
+    # Built once; edit() rebinds the form to the book being edited.
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
+        self.book_data = {}
         
         title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
         title_frame.pack(fill="x")
@@ -508,34 +1047,31 @@ class EditBookScreen(Screen):
 
         book_id_label = ctk.CTkLabel(form_frame, text="Book ID")
         book_id_label.grid(row=0, column=0, sticky="w", padx=10, pady=5)
-        book_id_entry = ctk.CTkEntry(form_frame, width=400)
-        book_id_entry.insert(0, self.book_data.get("Book ID", ""))
-        book_id_entry.configure(state="disabled")
-        book_id_entry.grid(row=0, column=1, padx=10, pady=5)
+        self.book_id_entry = ctk.CTkEntry(form_frame, width=400, state="disabled")
+        self.book_id_entry.grid(row=0, column=1, padx=10, pady=5)
 
         title_label = ctk.CTkLabel(form_frame, text="Book Title")
         title_label.grid(row=1, column=0, sticky="w", padx=10, pady=5)
         self.title_entry = ctk.CTkEntry(form_frame, width=400)
-        self.title_entry.insert(0, self.book_data.get("Book Title", ""))
         self.title_entry.grid(row=1, column=1, padx=10, pady=5)
 
         author_label = ctk.CTkLabel(form_frame, text="Author Name")
         author_label.grid(row=2, column=0, sticky="w", padx=10, pady=5)
         self.author_entry = ctk.CTkEntry(form_frame, width=400)
-        self.author_entry.insert(0, self.book_data.get("Author Name", ""))
         self.author_entry.grid(row=2, column=1, padx=10, pady=5)
 
         genre_label = ctk.CTkLabel(form_frame, text="Genre")
         genre_label.grid(row=3, column=0, sticky="w", padx=10, pady=5)
         self.genre_entry = ctk.CTkEntry(form_frame, width=400)
-        self.genre_entry.insert(0, self.book_data.get("Genre", ""))
         self.genre_entry.grid(row=3, column=1, padx=10, pady=5)
 
-        self.availability_var = ctk.BooleanVar(value=self.book_data.get("Available", True))
-        availability_checkbox = ctk.CTkCheckBox(
-            form_frame, text="Available", variable=self.availability_var
-        )
-        availability_checkbox.grid(row=4, columnspan=2, pady=10)
+        copies_label = ctk.CTkLabel(form_frame, text="Copies")
+        copies_label.grid(row=4, column=0, sticky="w", padx=10, pady=5)
+        self.copies_entry = ctk.CTkEntry(form_frame, width=400)
+        self.copies_entry.grid(row=4, column=1, padx=10, pady=5)
+
+        self.loans_label = ctk.CTkLabel(form_frame, text="")
+        self.loans_label.grid(row=5, columnspan=2, pady=10)
         
         #Button
         button_frame = ctk.CTkFrame(self)
@@ -547,38 +1083,43 @@ class EditBookScreen(Screen):
         cancel_button = ctk.CTkButton(button_frame, text="Cancel", width=120, command=self.system.show_book_data_screen)
         cancel_button.pack(side="right", padx=10)
 
+    def edit(self, book_data):
+        self.book_data = book_data
+        self.book_id_entry.configure(state="normal")
+        self.book_id_entry.delete(0, "end")
+        self.book_id_entry.insert(0, book_data.get("Book ID", ""))
+        self.book_id_entry.configure(state="disabled")
+        for entry, value in (
+            (self.title_entry, book_data.get("Book Title", "")),
+            (self.author_entry, book_data.get("Author Name", "")),
+            (self.genre_entry, book_data.get("Genre", "")),
+            (self.copies_entry, str(book_data.get("Copies", 1))),
+        ):
+            entry.delete(0, "end")
+            entry.insert(0, value)
+        out = book_data.get("Copies", 1) - book_data.get("Available", 0)
+        self.loans_label.configure(text=f"{book_data.get('Available', 0)} on the shelf, {out} out on loan")
+
     def save_changes(self):
         updated_book = {
             "Book ID": self.book_data.get("Book ID", ""),
             "Book Title": self.title_entry.get(),
             "Author Name": self.author_entry.get(),
             "Genre": self.genre_entry.get(),
-            "Available": self.availability_var.get()
+            "Copies": self.copies_entry.get()
         }
 
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-            
-            for i, book in enumerate(all_books):
-                if book.get("Book ID", "") == updated_book["Book ID"]:
-                    all_books[i] = updated_book
-                    break
-
-            with open(data_file, "wb") as file:
-                pickle.dump(all_books, file)
+        try:
+            self.system.core.update_book(updated_book)
+        except LibraryError as e:
+            self.popup("Error", str(e))
+            return
 
-            self.main_screen.update_radio_buttons(self.main_screen.load_data_from_file("book_data.pkl", lambda book: book.get("Book Title", "Unknown Title")))
-            self.book_data_screen.display_books()
-            self.system.show_book_data_screen()
+        self.system.show_book_data_screen()
 
 class AddBookScreen(Screen):
-    def __init__(self, parent, system, book_data_screen, main):
-        super().__init__(parent)
-        self.system = system
-        self.book_data_screen = book_data_screen
-        self.main_screen = main
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
         
         title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
         title_frame.pack(fill="x")  
@@ -592,7 +1133,7 @@ class AddBookScreen(Screen):
         input_frame = ctk.CTkFrame(content_frame)
         input_frame.place(relx=0.5, rely=0.5, anchor="center")  
 
-        labels = ["Book ID", "Book Title", "Author Name", "Genre"]
+        labels = ["Book ID", "Book Title", "Author Name", "Genre", "Copies"]
         self.entries = {}
         for i, label in enumerate(labels):
             lbl = ctk.CTkLabel(input_frame, text=label + ":", font=ctk.CTkFont(size=14))
@@ -612,95 +1153,330 @@ class AddBookScreen(Screen):
         back_button.pack(side="right", padx=10) 
 
     def save_book_data(self):
-        book_id = self.entries["Book ID"].get()
-
-        data_file = "book_data.pkl"
-        if os.path.exists(data_file):
-            with open(data_file, "rb") as file:
-                all_books = pickle.load(file)
-        else:
-            all_books = []
-
-        for book in all_books:
-            if book["Book ID"] == book_id:
-                error_popup = ctk.CTkToplevel(self)
-                error_popup.geometry("300x150")
-                error_popup.title("Error")
-                error_label = ctk.CTkLabel(error_popup, text="Book ID already exists.", font=ctk.CTkFont(size=14))
-                error_label.pack(pady=20)
-                ok_button = ctk.CTkButton(error_popup, text="OK", command=error_popup.destroy)
-                ok_button.pack(pady=10)
-                return
-
         book_data = {label: entry.get() for label, entry in self.entries.items()}
-        all_books.append(book_data)
 
-        with open(data_file, "wb") as file:
-            pickle.dump(all_books, file)
+        try:
+            self.system.core.add_book(book_data)
+        except LibraryError as e:
+            self.popup("Error", str(e))
+            return
 
-        confirmation_popup = ctk.CTkToplevel(self)
-        confirmation_popup.geometry("300x150")
-        confirmation_popup.title("Confirmation")
-        confirmation_label = ctk.CTkLabel(confirmation_popup, text="Book data saved successfully!", font=ctk.CTkFont(size=14))
-        confirmation_label.pack(pady=20)
-        ok_button = ctk.CTkButton(confirmation_popup, text="OK", command=confirmation_popup.destroy)
-        ok_button.pack(pady=10)
+        self.popup("Confirmation", "Book data saved successfully!")
 
         for entry in self.entries.values():
             entry.delete(0, "end")
 
-        self.main_screen.update_radio_buttons(self.main_screen.load_data_from_file("book_data.pkl", lambda book: book.get("Book Title", "Unknown Title")))
-        self.book_data_screen.display_books()
+class DiagnosticsScreen(Screen):
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
+
+        title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
+        title_frame.pack(fill="x")
+        title_label = ctk.CTkLabel(title_frame, text="Diagnostics", font=ctk.CTkFont(size=18, weight="bold"), text_color="white")
+        title_label.pack(pady=5)
+
+        self.report_text = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Courier", size=12), wrap="none")
+        self.report_text.pack(fill="both", expand=True, padx=20, pady=10)
+
+        #Button
+        button_frame = ctk.CTkFrame(self)
+        button_frame.pack(fill="x", pady=10)
+
+        refresh_button = ctk.CTkButton(button_frame, text="Refresh", width=120, command=self.display_report)
+        refresh_button.pack(side="left", padx=10)
+
+        save_button = ctk.CTkButton(button_frame, text="Save JSON", width=120, command=self.save_report)
+        save_button.pack(side="left", padx=10)
+
+        reset_button = ctk.CTkButton(button_frame, text="Reset", width=120, command=self.reset)
+        reset_button.pack(side="left", padx=10)
+
+        back_button = ctk.CTkButton(button_frame, text="Back", width=120, command=self.system.show_main_screen)
+        back_button.pack(side="right", padx=10)
+
+    def report_lines(self):
+        report = metrics.report()
+        lines = [f"{'Operation':28}{'Count':>8}{'p50 ms':>10}{'p95 ms':>10}{'Max ms':>10}"]
+        for name, stats in report["operations"].items():
+            lines.append(f"{name:28}{stats['count']:>8}{stats['p50_ms']:>10.2f}{stats['p95_ms']:>10.2f}{stats['max_ms']:>10.2f}")
+
+        lines.append("")
+        counters = dict(report["counters"])
+        counters.update((f"cache.{name}", value) for name, value in self.system.cache.stats().items())
+        counters["io.pending"] = self.system.worker.pending
+        counters["io.failed"] = self.system.worker.failed
+        for name, value in counters.items():
+            lines.append(f"{name:28}{value:>8}")
+
+        if self.system.profiler.running:
+            lines += ["", self.system.profiler.summary()]
+        return lines
+
+    def display_report(self):
+        self.report_text.configure(state="normal")
+        self.report_text.delete("1.0", "end")
+        self.report_text.insert("1.0", "\n".join(self.report_lines()))
+        self.report_text.configure(state="disabled")
+
+    def save_report(self):
+        file_name = filedialog.asksaveasfilename(
+            title="Save Diagnostics", initialfile=METRICS_FILE, defaultextension=".json",
+            filetypes=[("JSON", "*.json"), ("All files", "*.*")]
+        )
+        if not file_name:
+            return
+        try:
+            metrics.dump(file_name)
+        except OSError as e:
+            self.popup("Error", f"Error saving diagnostics: {str(e)}")
+
+    def reset(self):
+        metrics.reset()
+        self.display_report()
+
+class AnalyticsScreen(Screen):
+    def __init__(self, parent, system):
+        super().__init__(parent, system)
+
+        title_frame = ctk.CTkFrame(self, fg_color="#3B8ED0", corner_radius=0)
+        title_frame.pack(fill="x")
+        title_label = ctk.CTkLabel(title_frame, text="Analytics", font=ctk.CTkFont(size=18, weight="bold"), text_color="white")
+        title_label.pack(pady=5)
+
+        self.report_text = ctk.CTkTextbox(self, font=ctk.CTkFont(family="Courier", size=12), wrap="none")
+        self.report_text.pack(fill="both", expand=True, padx=20, pady=10)
+
+        #Button
+        button_frame = ctk.CTkFrame(self)
+        button_frame.pack(fill="x", pady=10)
+
+        refresh_button = ctk.CTkButton(button_frame, text="Refresh", width=120, command=self.display_report)
+        refresh_button.pack(side="left", padx=10)
+
+        rebuild_button = ctk.CTkButton(button_frame, text="Rebuild", width=120, command=self.rebuild)
+        rebuild_button.pack(side="left", padx=10)
+
+        export_button = ctk.CTkButton(button_frame, text="Export Daily", width=120, command=self.export_daily)
+        export_button.pack(side="left", padx=10)
+
+        back_button = ctk.CTkButton(button_frame, text="Back", width=120, command=self.system.show_main_screen)
+        back_button.pack(side="right", padx=10)
+
+    def report_lines(self, report):
+        lines = [
+            f"Loans: {report['borrows']}   Returned: {report['returns']}   "
+            f"Average loan: {report['average_loan_days']:.1f} days   Fines collected: {report['fines_collected']} Bath",
+            "", "Most borrowed titles",
+        ]
+        for book_id, title, borrows in report["top_titles"]:
+            lines.append(f"{borrows:>8}  {book_id:12}{title}")
+        lines += ["", "Genre circulation"]
+        for genre, borrows in report["top_genres"]:
+            lines.append(f"{borrows:>8}  {genre}")
+        lines += ["", f"{'Date':12}{'Borrowed':>10}{'Returned':>10}{'Fines':>10}"]
+        for day in reversed(report["daily"]):
+            lines.append(f"{day['Date']:12}{day['Borrowed']:>10}{day['Returned']:>10}{day['Fines']:>10}")
+        return lines
+
+    def display_report(self):
+        try:
+            lines = self.report_lines(self.system.core.analytics_report())
+        except (LibraryError,) + STORAGE_ERRORS as e:
+            lines = [str(e)]
+        self.report_text.configure(state="normal")
+        self.report_text.delete("1.0", "end")
+        self.report_text.insert("1.0", "\n".join(lines))
+        self.report_text.configure(state="disabled")
+
+    def rebuild(self):
+        try:
+            self.system.core.rebuild_analytics()
+        except (LibraryError,) + STORAGE_ERRORS as e:
+            self.popup("Error", f"Error rebuilding analytics: {str(e)}")
+            return
+        self.display_report()
+
+    def export_daily(self):
+        file_name = filedialog.asksaveasfilename(
+            title="Export Daily Totals", initialfile="library_daily.csv", defaultextension=".csv",
+            filetypes=[("CSV", "*.csv"), ("JSON Lines", "*.jsonl"), ("All files", "*.*")]
+        )
+        if not file_name:
+            return
+        try:
+            self.system.core.export("daily", file_name)
+        except (LibraryError,) + STORAGE_ERRORS as e:
+            self.popup("Error", f"Error exporting analytics: {str(e)}")
 
 class LibraryManagementSystem:
     def __init__(self):
         self.root = ctk.CTk()
         self.root.title("Library Management System")
-        self.root.geometry("700x500")
+        self.root.geometry("820x500")
+
+        self.profiler = Profiler()
+        self.profiler.start()
+
+        self.worker = IOWorker(self.root)
+        self.events = EventBus(schedule=self.root.after_idle)
+        # With LIBRARY_SERVICE=host:port set, this desk shares a library service.
+        self.core = connect(executor=self.worker, archive=HistoryArchive(), events=self.events)
+        if self.core is None:
+            self.core = LibraryCore(
+                executor=self.worker, archive=HistoryArchive(), events=self.events, analytics=Analytics(),
+                defer_analytics=True,
+            )
+        self.cache = self.core.data
 
-        self.main_screen = MainScreen(self.root, self, None)
-        self.book_data_screen = BookDataScreen(self.root, self, None)
-        self.history_screen = HistoryScreen(self.root, self)
-        self.addbook_screen = AddBookScreen(self.root, self, self.book_data_screen, None)
+        self.status_label = ctk.CTkLabel(self.root, text="", anchor="w", font=ctk.CTkFont(size=12))
+        self.status_label.pack(side="bottom", fill="x", padx=10)
+        self.status_label.bind("<Button-1>", lambda event: self.worker.clear_failures())
+        self.worker.listeners.append(self.show_io_status)
+        self.worker.listeners.append(self.save_analytics)
 
-        self.edit_book_screen = None  
+        self.screens = {}
+        self.current_screen = None
+        self.dialog = None
+        self.data_ready = False
+        self.waiting = []
 
-        self.main_screen.history_data_screen = self.history_screen
-        self.book_data_screen.main_screen = self.main_screen
-        self.addbook_screen.main_screen = self.main_screen
+        self.watch_changes()
 
+        # Draw the main screen first; archiving and reading the library come after.
         self.show_main_screen()
-        self.root.mainloop()
+        self.root.after_idle(self.root.after, 1, self.start)
+        try:
+            self.root.mainloop()
+        finally:
+            # The window is gone, so the last writes must drain without status updates.
+            self.worker.listeners.clear()
+            try:
+                self.worker.close()
+            finally:
+                self.core.close()
+                if self.profiler.stop() is not None:
+                    metrics.dump()
+
+    def start(self):
+        # Archiving, recounting stale analytics and reading the library each run on
+        # the worker, one after the other, reporting on the status line as they go.
+        self.status_label.configure(text="Archiving old loans...", text_color="gray")
+        self.core.archive_history_later(on_done=self.history_archived, on_error=self.archiving_failed)
+
+    def history_archived(self, count):
+        self.recount_analytics()
+
+    def archiving_failed(self, error):
+        self.status_label.configure(text=f"History archiving failed: {error}", text_color="red")
+        self.recount_analytics(keep_status=True)
+
+    def recount_analytics(self, keep_status=False):
+        if not self.core.analytics_stale:
+            self.load_library(keep_status)
+            return
+        if not keep_status:
+            self.status_label.configure(text="Counting loans for analytics...", text_color="gray")
+        self.core.rebuild_analytics_later(
+            on_done=lambda borrows: self.load_library(keep_status),
+            on_error=self.analytics_failed,
+        )
+
+    def analytics_failed(self, error):
+        self.status_label.configure(text=f"Counting analytics failed: {error}", text_color="red")
+        self.load_library(keep_status=True)
+
+    def load_library(self, keep_status=False):
+        if not keep_status:
+            self.status_label.configure(text="Loading library...", text_color="gray")
+        self.cache.preload(on_done=self.data_loaded)
+
+    def data_loaded(self):
+        self.data_ready = True
+        if self.status_label.cget("text") == "Loading library...":
+            self.show_io_status(self.worker)
+        waiting, self.waiting = self.waiting, []
+        for callback in waiting:
+            callback()
+
+    def when_loaded(self, callback):
+        # Runs callback once the library has been read and pending redraws are done.
+        if self.data_ready:
+            self.root.after_idle(self.root.after, 1, callback)
+        else:
+            self.waiting.append(callback)
+
+    def screen(self, screen_class):
+        screen = self.screens.get(screen_class)
+        if screen is None:
+            screen = self.screens[screen_class] = screen_class(self.root, self)
+            self.events.subscribe(screen.on_events)
+        return screen
+
+    def show_screen(self, screen):
+        if self.current_screen is not None and self.current_screen is not screen:
+            self.current_screen.hide()
+        self.current_screen = screen
+        screen.show()
 
     def show_main_screen(self):
-        self.hide_all_screens()
-        self.main_screen.show()
+        self.show_screen(self.screen(MainScreen))
 
     def show_book_data_screen(self):
-        self.hide_all_screens()
-        self.book_data_screen.show()
+        self.show_screen(self.screen(BookDataScreen))
 
     def show_history_screen(self):
-        self.hide_all_screens()
-        self.history_screen.show()
+        self.show_screen(self.screen(HistoryScreen))
+
+    def show_diagnostics_screen(self):
+        screen = self.screen(DiagnosticsScreen)
+        screen.display_report()
+        self.show_screen(screen)
+
+    def show_analytics_screen(self):
+        screen = self.screen(AnalyticsScreen)
+        screen.display_report()
+        self.show_screen(screen)
 
     def show_add_screen(self):
-        self.hide_all_screens()
-        self.addbook_screen.show()
-        
+        self.show_screen(self.screen(AddBookScreen))
+
     def show_edit_screen(self, book_data):
-        self.hide_all_screens()
-        if self.edit_book_screen is not None:
-            self.edit_book_screen.destroy()  
-        self.edit_book_screen = EditBookScreen(self.root, self, book_data, self.main_screen, self.book_data_screen)
-        self.edit_book_screen.show()
-
-    def hide_all_screens(self):
-        self.main_screen.hide()
-        self.book_data_screen.hide()
-        self.history_screen.hide()
-        self.addbook_screen.hide()
-        if self.edit_book_screen is not None:
-            self.edit_book_screen.hide()
-
-LibraryManagementSystem()
+        screen = self.screen(EditBookScreen)
+        screen.edit(book_data)
+        self.show_screen(screen)
+
+    def popup(self, title, message):
+        if self.dialog is None or not self.dialog.winfo_exists():
+            self.dialog = Dialog(self.root)
+        self.dialog.show_message(title, message)
+
+    def show_io_status(self, worker):
+        if worker.failed:
+            self.status_label.configure(
+                text=f"{worker.failed} change(s) could not be saved: {worker.last_error} (click to dismiss)",
+                text_color="red"
+            )
+        elif worker.pending:
+            self.status_label.configure(text=f"Saving {worker.pending} change(s)...", text_color="gray")
+        else:
+            self.status_label.configure(text="")
+
+    def watch_changes(self):
+        # Picks up changes made by other programs or desks; the cache turns them into events.
+        try:
+            self.cache.refresh()
+        except STORAGE_ERRORS:
+            pass
+        self.root.after(int(self.cache.check_interval * 2000), self.watch_changes)
+
+    def save_analytics(self, worker):
+        # Once the loans counted have been written, so the totals on disk keep up.
+        if worker.pending:
+            return
+        try:
+            self.core.save_analytics()
+        except OSError as e:
+            self.status_label.configure(text=f"Could not save analytics: {e}", text_color="red")
+
+if __name__ == "__main__":
+    LibraryManagementSystem()
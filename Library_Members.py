@@ -0,0 +1,66 @@
+class Member:
+    __slots__ = ("member_id", "name", "open_loans", "loan_count", "fines_paid")
+
+    def __init__(self, member_id, name=""):
+        self.member_id = member_id
+        self.name = name
+        self.open_loans = {}
+        self.loan_count = 0
+        self.fines_paid = 0
+
+    def __repr__(self):
+        return f"Member({self.member_id!r}, {self.name!r}, open={len(self.open_loans)}, paid={self.fines_paid})"
+
+
+class MemberRegistry:
+    # Borrowers keyed by member ID: the name on their latest loan, their open
+    # loans (Loan ID -> loan) and the fines they paid. A fine is settled when the
+    # book comes back, so only the fines on returned loans count as paid.
+    # What each loan added is remembered, so a loan changed in place can still
+    # be taken back out exactly.
+    def __init__(self, loans=()):
+        self.members = {}
+        self.counted = {}
+        for loan in loans:
+            self.add(loan)
+
+    def __len__(self):
+        return len(self.members)
+
+    def __contains__(self, member_id):
+        return member_id in self.members
+
+    def __iter__(self):
+        return iter(self.members.values())
+
+    def get(self, member_id):
+        return self.members.get(member_id)
+
+    def add(self, loan):
+        member_id = loan.member_id
+        if not member_id:
+            return
+        self.remove(loan.loan_id)
+        member = self.members.get(member_id)
+        if member is None:
+            member = self.members[member_id] = Member(member_id)
+        if loan.borrower:
+            member.name = loan.borrower
+        member.loan_count += 1
+        fine = loan.fine if isinstance(loan.fine, int) and loan.status == "Returned" else 0
+        member.fines_paid += fine
+        if loan.status != "Returned":
+            member.open_loans[loan.loan_id] = loan
+        self.counted[loan.loan_id] = (member_id, fine)
+
+    def remove(self, loan_id):
+        counted = self.counted.pop(loan_id, None)
+        if counted is None:
+            return
+        member_id, fine = counted
+        member = self.members[member_id]
+        member.loan_count -= 1
+        member.fines_paid -= fine
+        member.open_loans.pop(loan_id, None)
+        if not member.loan_count:
+            del self.members[member_id]
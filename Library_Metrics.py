@@ -0,0 +1,165 @@
+import io
+import json
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from functools import wraps
+
+PROFILE_ENV = "LIBRARY_PROFILE"
+PROFILE_FILE = "library_profile.txt"
+METRICS_FILE = "library_metrics.json"
+SAMPLE_WINDOW = 1000
+
+
+def percentile(samples, fraction):
+    if not samples:
+        return 0.0
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+class Metrics:
+    # Latency samples and counters per operation name. Only the most recent
+    # SAMPLE_WINDOW samples of each operation are kept for the percentiles.
+    def __init__(self, window=SAMPLE_WINDOW):
+        self.window = window
+        self.lock = threading.Lock()
+        self.samples = {}
+        self.totals = {}
+        self.counters = {}
+
+    def record(self, name, seconds):
+        with self.lock:
+            samples = self.samples.get(name)
+            if samples is None:
+                samples = self.samples[name] = deque(maxlen=self.window)
+            samples.append(seconds)
+            count, total = self.totals.get(name, (0, 0.0))
+            self.totals[name] = (count + 1, total + seconds)
+
+    @contextmanager
+    def timer(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start)
+
+    def timed(self, name):
+        def decorator(fn):
+            @wraps(fn)
+            def wrapper(*args, **kwargs):
+                start = time.perf_counter()
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    self.record(name, time.perf_counter() - start)
+            return wrapper
+        return decorator
+
+    def increment(self, name, amount=1):
+        with self.lock:
+            self.counters[name] = self.counters.get(name, 0) + amount
+
+    def report(self):
+        # Latencies in milliseconds.
+        with self.lock:
+            samples = {name: list(values) for name, values in self.samples.items()}
+            totals = dict(self.totals)
+            counters = dict(self.counters)
+        operations = {}
+        for name in sorted(samples):
+            count, total = totals[name]
+            operations[name] = {
+                "count": count,
+                "total_ms": total * 1000,
+                "p50_ms": percentile(samples[name], 0.5) * 1000,
+                "p95_ms": percentile(samples[name], 0.95) * 1000,
+                "max_ms": max(samples[name]) * 1000,
+            }
+        return {"operations": operations, "counters": dict(sorted(counters.items()))}
+
+    def reset(self):
+        with self.lock:
+            self.samples = {}
+            self.totals = {}
+            self.counters = {}
+
+    def dump(self, file_name=METRICS_FILE):
+        report = self.report()
+        report["time"] = time.strftime("%Y-%m-%d %H:%M:%S")
+        with open(file_name, "w", encoding="utf-8") as file:
+            json.dump(report, file, indent=2)
+        return file_name
+
+
+class Profiler:
+    # cProfile and/or tracemalloc capture, switched on with LIBRARY_PROFILE set to
+    # "cprofile", "tracemalloc" or "all". Results are written to PROFILE_FILE on stop.
+    def __init__(self, mode=None, file_name=PROFILE_FILE):
+        mode = (mode if mode is not None else os.environ.get(PROFILE_ENV, "")).strip().lower()
+        self.cprofile = mode in ("cprofile", "all", "1")
+        self.tracemalloc = mode in ("tracemalloc", "all", "1")
+        self.file_name = file_name
+        self.profile = None
+        self.running = False
+
+    @property
+    def enabled(self):
+        return self.cprofile or self.tracemalloc
+
+    def start(self):
+        if not self.enabled:
+            return
+        # Imported only when profiling, to keep them off every start.
+        import cProfile
+        import tracemalloc
+
+        if self.tracemalloc and not tracemalloc.is_tracing():
+            tracemalloc.start()
+        if self.cprofile:
+            self.profile = cProfile.Profile()
+            self.profile.enable()
+        self.running = True
+
+    def summary(self, limit=15):
+        import tracemalloc
+
+        lines = []
+        if self.profile is not None:
+            import pstats
+
+            out = io.StringIO()
+            # Building the stats disables the profiler, so switch it back on.
+            pstats.Stats(self.profile, stream=out).sort_stats("cumulative").print_stats(limit)
+            if self.running:
+                self.profile.enable()
+            lines.append(out.getvalue())
+        if self.tracemalloc and tracemalloc.is_tracing():
+            current, peak = tracemalloc.get_traced_memory()
+            lines.append(f"Memory: {current / 1024:.0f} KiB now, {peak / 1024:.0f} KiB peak")
+            for stat in tracemalloc.take_snapshot().statistics("lineno")[:limit]:
+                lines.append(str(stat))
+        return "\n".join(lines)
+
+    def stop(self):
+        if not self.running:
+            return None
+        self.running = False
+        if self.profile is not None:
+            self.profile.disable()
+        with open(self.file_name, "w", encoding="utf-8") as file:
+            file.write(self.summary(limit=40))
+        if self.tracemalloc:
+            import tracemalloc
+
+            tracemalloc.stop()
+        return self.file_name
+
+
+metrics = Metrics()
+timer = metrics.timer
+timed = metrics.timed
+increment = metrics.increment
@@ -0,0 +1,85 @@
+from heapq import heapify, heappop, heappush
+
+from Library_Records import date_ordinal
+
+
+class DueQueue:
+    # Open loans in a min-heap of (due ordinal, Loan ID). Closing or changing a
+    # loan only forgets its current entry; the stale heap entry is skipped when
+    # met and the heap is rebuilt once stale entries outnumber live ones.
+    # Reading in due order walks the heap from the root with a small frontier
+    # heap, so the first k loans cost O(k log k) and nothing is popped.
+    def __init__(self, loans=()):
+        self.loans = {}
+        self.due = {}
+        self.heap = []
+        self.entries = set()
+        for loan in loans:
+            self._track(loan)
+        self.heap = list(self.entries)
+        heapify(self.heap)
+
+    def __len__(self):
+        return len(self.due)
+
+    def _track(self, loan):
+        due = date_ordinal(loan.date_return)
+        if due is None or loan.status == "Returned":
+            return None
+        self.loans[loan.loan_id] = loan
+        self.due[loan.loan_id] = due
+        entry = (due, loan.loan_id)
+        if entry in self.entries:
+            return None
+        self.entries.add(entry)
+        return entry
+
+    def add(self, loan):
+        self.remove(loan.loan_id)
+        entry = self._track(loan)
+        if entry is not None:
+            heappush(self.heap, entry)
+
+    def remove(self, loan_id):
+        if self.due.pop(loan_id, None) is not None:
+            del self.loans[loan_id]
+            if len(self.heap) > 2 * len(self.due) + 64:
+                self.compact()
+
+    def compact(self):
+        self.heap = [(due, loan_id) for loan_id, due in self.due.items()]
+        heapify(self.heap)
+        self.entries = set(self.heap)
+
+    def ordered(self):
+        # (due, loan) for every open loan, earliest due (then lowest Loan ID) first.
+        heap = self.heap
+        if not heap:
+            return
+        frontier = [(heap[0], 0)]
+        while frontier:
+            (due, loan_id), index = heappop(frontier)
+            if self.due.get(loan_id) == due:
+                yield due, self.loans[loan_id]
+            for child in (2 * index + 1, 2 * index + 2):
+                if child < len(heap):
+                    heappush(frontier, (heap[child], child))
+
+    def overdue(self, as_of):
+        # Open loans due before the as_of ordinal.
+        report = []
+        for due, loan in self.ordered():
+            if due >= as_of:
+                break
+            report.append((due, loan))
+        return report
+
+    def next_due(self, count, as_of=None):
+        # The next count open loans due on or after as_of (any due date without one).
+        report = []
+        for due, loan in self.ordered():
+            if len(report) >= count:
+                break
+            if as_of is None or due >= as_of:
+                report.append((due, loan))
+        return report
@@ -0,0 +1,197 @@
+import sys
+from collections.abc import Mapping
+from datetime import date, datetime
+
+DATE_FORMAT = "%Y-%m-%d"
+
+_date_texts = {}
+_ordinals = {}
+
+
+def date_ordinal(value):
+    # "YYYY-MM-DD" (or an ordinal already) -> date.toordinal(); None if it is not a date.
+    if type(value) is int:
+        return value
+    if not isinstance(value, str):
+        return None
+    if len(value) == 10 and value[4] == "-" and value[7] == "-" and value[:4].isdigit() and value[5:7].isdigit() and value[8:].isdigit():
+        try:
+            return date(int(value[:4]), int(value[5:7]), int(value[8:])).toordinal()
+        except ValueError:
+            return None
+    try:
+        return datetime.strptime(value, DATE_FORMAT).toordinal()
+    except ValueError:
+        return None
+
+
+def date_text(value):
+    if type(value) is not int:
+        return value
+    text = _date_texts.get(value)
+    if text is None:
+        text = _date_texts[value] = date.fromordinal(value).strftime(DATE_FORMAT)
+    return text
+
+
+def stored_date(value):
+    # Dates are kept as ordinals; anything that does not parse is kept as written.
+    ordinal = date_ordinal(value)
+    if ordinal is not None:
+        # Many loans share a date, so they share one int object too.
+        return _ordinals.setdefault(ordinal, ordinal)
+    return shared(value) if value is not None else ""
+
+
+def shared(value):
+    return sys.intern(value) if type(value) is str else value
+
+
+class Record(Mapping):
+    # A fixed set of fields stored in __slots__ but read and written with the
+    # same display keys as the old dicts, so record["Book Title"], .get() and
+    # dict(record) keep working everywhere.
+    __slots__ = ()
+    FIELDS = {}
+    DEFAULTS = ()
+
+    @classmethod
+    def from_mapping(cls, mapping):
+        if type(mapping) is cls:
+            return mapping
+        return cls(*[mapping.get(key, default) for key, default in cls.DEFAULTS])
+
+    def __getitem__(self, key):
+        return getattr(self, self.FIELDS[key])
+
+    def __setitem__(self, key, value):
+        name = self.FIELDS[key]
+        setattr(self, name, self._convert(name, value))
+
+    def _convert(self, name, value):
+        return shared(value)
+
+    def get(self, key, default=None):
+        if key in self.FIELDS:
+            return self[key]
+        return default
+
+    def __contains__(self, key):
+        return key in self.FIELDS
+
+    def __iter__(self):
+        return iter(self.FIELDS)
+
+    def __len__(self):
+        return len(self.FIELDS)
+
+    def keys(self):
+        return self.FIELDS.keys()
+
+    def values(self):
+        return [getattr(self, name) for name in self.__slots__]
+
+    def items(self):
+        return list(zip(self.FIELDS, self.values()))
+
+    def __reduce__(self):
+        # Pickles as the class plus a plain tuple of the stored values (dates as ordinals).
+        return (type(self), tuple(getattr(self, name) for name in self.__slots__))
+
+    def copy(self):
+        return type(self)(*[getattr(self, name) for name in self.__slots__])
+
+    def __repr__(self):
+        return f"{type(self).__name__}({dict(self)!r})"
+
+
+def copy_count(available, copies):
+    # Copies on the shelf. Books saved before there could be several copies
+    # store yes/no, which means all of them or none.
+    if isinstance(available, bool):
+        return copies if available else 0
+    return max(0, min(int(available), copies))
+
+
+class Book(Record):
+    __slots__ = ("book_id", "title", "author", "genre", "available", "copies")
+    FIELDS = {
+        "Book ID": "book_id",
+        "Book Title": "title",
+        "Author Name": "author",
+        "Genre": "genre",
+        "Available": "available",
+        "Copies": "copies",
+    }
+    DEFAULTS = (("Book ID", ""), ("Book Title", ""), ("Author Name", ""), ("Genre", ""), ("Available", True), ("Copies", 1))
+
+    def __init__(self, book_id="", title="", author="", genre="", available=True, copies=1):
+        self.book_id = shared(book_id)
+        self.title = shared(title)
+        self.author = shared(author)
+        self.genre = shared(genre)
+        self.copies = max(0, int(copies))
+        self.available = copy_count(available, self.copies)
+
+    def _convert(self, name, value):
+        if name == "available":
+            return copy_count(value, self.copies)
+        if name == "copies":
+            return max(0, int(value))
+        return shared(value)
+
+    def availability(self):
+        return f"{self.available} of {self.copies}"
+
+
+class Loan(Record):
+    __slots__ = ("loan_id", "borrower", "book_id", "title", "date_borrowed", "date_return", "status", "fine", "member_id")
+    FIELDS = {
+        "Loan ID": "loan_id",
+        "Borrower Name": "borrower",
+        "Book ID": "book_id",
+        "Book Title": "title",
+        "Date Borrowed": "date_borrowed",
+        "Date Return": "date_return",
+        "Status": "status",
+        "Fine": "fine",
+        "Member ID": "member_id",
+    }
+    DEFAULTS = (
+        ("Loan ID", None), ("Borrower Name", ""), ("Book ID", ""), ("Book Title", ""),
+        ("Date Borrowed", ""), ("Date Return", ""), ("Status", "Borrowed"), ("Fine", 0), ("Member ID", ""),
+    )
+    DATE_FIELDS = ("date_borrowed", "date_return")
+
+    def __init__(self, loan_id=None, borrower="", book_id="", title="", date_borrowed="", date_return="",
+                 status="Borrowed", fine=0, member_id=""):
+        self.loan_id = loan_id
+        self.borrower = shared(borrower)
+        self.book_id = shared(book_id)
+        self.title = shared(title)
+        self.date_borrowed = stored_date(date_borrowed)
+        self.date_return = stored_date(date_return)
+        self.status = shared(status)
+        self.fine = fine
+        # Loans saved before member IDs were recorded have none.
+        self.member_id = shared(member_id or "")
+
+    def __getitem__(self, key):
+        name = self.FIELDS[key]
+        value = getattr(self, name)
+        if name in self.DATE_FIELDS:
+            return date_text(value)
+        return value
+
+    def values(self):
+        return [
+            self.loan_id, self.borrower, self.book_id, self.title, date_text(self.date_borrowed),
+            date_text(self.date_return), self.status, self.fine, self.member_id,
+        ]
+
+    def _convert(self, name, value):
+        if name in self.DATE_FIELDS:
+            return stored_date(value)
+        if name in ("loan_id", "fine"):
+            return value
+        return shared(value)
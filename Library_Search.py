@@ -0,0 +1,374 @@
+import unicodedata
+from bisect import bisect_left, insort
+from collections import OrderedDict
+from heapq import nlargest
+
+
+def normalize_text(text):
+    return " ".join(unicodedata.normalize("NFKC", str(text)).casefold().split())
+
+
+def text_grams(text, size):
+    return {text[i:i + size] for i in range(len(text) - size + 1)}
+
+
+class TitleIndex:
+    # Trigram postings over the normalized titles. Longer queries intersect the
+    # postings of their trigrams and verify the few candidates left; postings for
+    # one- and two-character queries are materialized the first time they are asked.
+    # The full list (the empty query) is sorted once and kept until a title changes.
+    GRAM_SIZE = 3
+
+    def __init__(self, books=()):
+        self.titles = {}
+        self.normalized = {}
+        self.order = {}
+        self.postings = {}
+        self.short_postings = {}
+        self.sorted_titles = []
+        self._next_order = 0
+        self._last_query = None
+        self._last_result = None
+        self._all = None
+        for book in books:
+            self.sorted_titles.append(self._insert(book.get("Book ID", ""), book.get("Book Title", "Unknown Title")))
+        self.sorted_titles.sort()
+
+    def __len__(self):
+        return len(self.titles)
+
+    def _short_grams(self, text):
+        grams = set()
+        for size in range(1, self.GRAM_SIZE):
+            grams |= text_grams(text, size)
+        return grams
+
+    def _insert(self, book_id, title, order=None):
+        if book_id in self.titles:
+            self.remove(book_id)
+        text = normalize_text(title)
+        self.titles[book_id] = title
+        self.normalized[book_id] = text
+        if order is None:
+            order = self._next_order
+            self._next_order += 1
+        self.order[book_id] = order
+        postings = self.postings
+        for gram in text_grams(text, self.GRAM_SIZE):
+            posting = postings.get(gram)
+            if posting is None:
+                postings[gram] = {book_id}
+            else:
+                posting.add(book_id)
+        if self.short_postings:
+            for gram in self._short_grams(text):
+                if gram in self.short_postings:
+                    self.short_postings[gram].add(book_id)
+        return (text, self.order[book_id], book_id)
+
+    def add(self, book_id, title, order=None):
+        insort(self.sorted_titles, self._insert(book_id, title, order))
+        self._last_query = None
+        self._all = None
+
+    def remove(self, book_id):
+        if book_id not in self.titles:
+            return
+        text = self.normalized.pop(book_id)
+        order = self.order.pop(book_id)
+        del self.titles[book_id]
+        for gram in text_grams(text, self.GRAM_SIZE):
+            posting = self.postings.get(gram)
+            if posting is not None:
+                posting.discard(book_id)
+                if not posting:
+                    del self.postings[gram]
+        if self.short_postings:
+            for gram in self._short_grams(text):
+                if gram in self.short_postings:
+                    self.short_postings[gram].discard(book_id)
+        position = bisect_left(self.sorted_titles, (text, order, book_id))
+        if position < len(self.sorted_titles) and self.sorted_titles[position][2] == book_id:
+            del self.sorted_titles[position]
+        self._last_query = None
+        self._all = None
+
+    def update(self, book_id, title):
+        # Keeps its place in catalog order, as the catalog does.
+        self.add(book_id, title, self.order.get(book_id))
+
+    def title(self, book_id):
+        return self.titles.get(book_id, "Unknown Title")
+
+    def _sorted(self, book_ids):
+        return sorted(book_ids, key=self.order.__getitem__)
+
+    def search(self, query):
+        # Book IDs in catalog order; the list is shared, so do not modify it.
+        query = normalize_text(query)
+        if not query:
+            if self._all is None:
+                self._all = self._sorted(self.titles)
+            return self._all
+
+        # Extending the previous query can only narrow its result.
+        if self._last_query and self._last_query in query:
+            result = [book_id for book_id in self._last_result if query in self.normalized[book_id]]
+        elif len(query) < self.GRAM_SIZE:
+            if query not in self.short_postings:
+                self.short_postings[query] = {book_id for book_id, text in self.normalized.items() if query in text}
+            result = self._sorted(self.short_postings[query])
+        elif len(query) == self.GRAM_SIZE:
+            result = self._sorted(self.postings.get(query, ()))
+        else:
+            postings = sorted((self.postings.get(gram, set()) for gram in text_grams(query, self.GRAM_SIZE)), key=len)
+            candidates = postings[0].intersection(*postings[1:])
+            result = self._sorted(book_id for book_id in candidates if query in self.normalized[book_id])
+
+        self._last_query = query
+        self._last_result = result
+        return result
+
+    def search_prefix(self, query):
+        query = normalize_text(query)
+        result = []
+        position = bisect_left(self.sorted_titles, (query,))
+        while position < len(self.sorted_titles) and self.sorted_titles[position][0].startswith(query):
+            result.append(self.sorted_titles[position][2])
+            position += 1
+        return result
+
+
+def edit_distance(a, b, limit, prefix=False):
+    # Edit distance from a to b counting a swap of neighbours as one edit (to the
+    # closest prefix of b with prefix=True), or limit + 1 as soon as it is certain
+    # to be over limit.
+    if not prefix and abs(len(a) - len(b)) > limit:
+        return limit + 1
+    before = None
+    previous = list(range(len(b) + 1))
+    for i, char in enumerate(a, 1):
+        current = [i]
+        for j, other in enumerate(b, 1):
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (char != other))
+            if i > 1 and j > 1 and char == b[j - 2] and a[i - 2] == other and before[j - 2] + 1 < value:
+                value = before[j - 2] + 1
+            current.append(value)
+        if min(current) > limit:
+            return limit + 1
+        before, previous = previous, current
+    return min(previous) if prefix else previous[-1]
+
+
+class FuzzyIndex:
+    # Typo-tolerant ranked search over the words of title, author and genre.
+    # Each query word is matched against the vocabulary (not the books): bigram
+    # overlap picks candidate words, a bounded edit distance keeps the close ones,
+    # and the last word counts as a prefix while it is still being typed. A book
+    # must match every query word; its score is the sum over query words of the
+    # best similarity times the weight of the field the word was found in.
+    # Work per query is bounded by SCAN_LIMIT books, and results are cached
+    # per normalized query so retyping or backspacing is free.
+    GRAM_SIZE = 2
+    FIELD_WEIGHTS = (("Book Title", 1.0), ("Author Name", 0.6), ("Genre", 0.3))
+    CANDIDATE_LIMIT = 400
+    SCAN_LIMIT = 10000
+    SET_LIMIT = 40000
+    SHORT_PREFIX_WORDS = 200
+    CACHE_SIZE = 512
+
+    def __init__(self, books=()):
+        self.postings = {}
+        self.book_words = {}
+        self.order = {}
+        self.grams = {}
+        self.vocabulary = []
+        self._next_order = 0
+        self.cache = OrderedDict()
+        self.word_cache = {}
+        for book in books:
+            self._insert(book)
+        self.vocabulary = sorted(self.postings)
+
+    def __len__(self):
+        return len(self.book_words)
+
+    def _word_grams(self, word):
+        return text_grams("^" + word, self.GRAM_SIZE)
+
+    def _insert(self, book):
+        book_id = book.get("Book ID", "")
+        weights = {}
+        for field, weight in self.FIELD_WEIGHTS:
+            for word in normalize_text(book.get(field, "")).split():
+                if weight > weights.get(word, 0):
+                    weights[word] = weight
+        self.book_words[book_id] = tuple(weights)
+        self.order[book_id] = self._next_order
+        self._next_order += 1
+        new_words = []
+        for word, weight in weights.items():
+            posting = self.postings.get(word)
+            if posting is None:
+                posting = self.postings[word] = {}
+                new_words.append(word)
+                for gram in self._word_grams(word):
+                    self.grams.setdefault(gram, set()).add(word)
+            posting[book_id] = weight
+        return new_words
+
+    def add(self, book):
+        self.remove(book.get("Book ID", ""))
+        for word in self._insert(book):
+            insort(self.vocabulary, word)
+        self._changed()
+
+    def remove(self, book_id):
+        words = self.book_words.pop(book_id, None)
+        if words is None:
+            return
+        del self.order[book_id]
+        for word in words:
+            posting = self.postings[word]
+            del posting[book_id]
+            if not posting:
+                del self.postings[word]
+                for gram in self._word_grams(word):
+                    gram_words = self.grams[gram]
+                    gram_words.discard(word)
+                    if not gram_words:
+                        del self.grams[gram]
+                position = bisect_left(self.vocabulary, word)
+                if position < len(self.vocabulary) and self.vocabulary[position] == word:
+                    del self.vocabulary[position]
+        self._changed()
+
+    def update(self, book):
+        self.add(book)
+
+    def _changed(self):
+        self.cache.clear()
+        self.word_cache.clear()
+
+    def max_distance(self, word):
+        if len(word) < 3:
+            return 0
+        return 1 if len(word) < 8 else 2
+
+    def matches(self, term, prefix=False):
+        # [(word, similarity)] for the vocabulary words close to term, best first.
+        key = (term, prefix)
+        found = self.word_cache.get(key)
+        if found is not None:
+            return found
+        limit = self.max_distance(term)
+        if limit == 0:
+            if prefix:
+                position = bisect_left(self.vocabulary, term)
+                words = []
+                while position < len(self.vocabulary) and self.vocabulary[position].startswith(term):
+                    words.append(self.vocabulary[position])
+                    position += 1
+                if len(words) > self.SHORT_PREFIX_WORDS:
+                    words = nlargest(self.SHORT_PREFIX_WORDS, words, key=lambda word: len(self.postings[word]))
+                found = [(word, 1.0 if word == term else 0.9) for word in words]
+            else:
+                found = [(term, 1.0)] if term in self.postings else []
+        else:
+            grams = self._word_grams(term)
+            counts = {}
+            for gram in grams:
+                for word in self.grams.get(gram, ()):
+                    counts[word] = counts.get(word, 0) + 1
+            # One edit breaks up to GRAM_SIZE grams, a swap of neighbours one more.
+            needed = max(1, len(grams) - (self.GRAM_SIZE + 1) * limit)
+            found = []
+            for word, count in counts.items():
+                if count < needed:
+                    continue
+                distance = edit_distance(term, word, limit, prefix)
+                if distance <= limit:
+                    similarity = 1.0 - distance / (len(term) + 1)
+                    if len(word) != len(term):
+                        similarity *= 0.9
+                    found.append((word, similarity))
+            found.sort(key=lambda item: -item[1])
+        self.word_cache[key] = found
+        return found
+
+    def _score(self, terms, prefix):
+        matches = [self.matches(term, prefix and i == len(terms) - 1) for i, term in enumerate(terms)]
+        if not all(matches):
+            return {}
+        similarities = [dict(found) for found in matches]
+        sizes = [sum(len(self.postings[word]) for word, _ in found) for found in matches]
+        order = sorted(range(len(terms)), key=sizes.__getitem__)
+
+        # Books matching every term. Terms with at most SET_LIMIT postings are
+        # intersected exactly with set operations; larger ones are checked per book
+        # against its own words while streaming the candidates (or the rarest
+        # term's books, closest words first) until CANDIDATE_LIMIT match or
+        # SCAN_LIMIT have been looked at.
+        rarest = order[0]
+        candidates = None
+        deferred = []
+        for index in order:
+            if sizes[index] > self.SET_LIMIT:
+                deferred.append(similarities[index].keys())
+                continue
+            found = set().union(*[self.postings[word].keys() for word, _ in matches[index]])
+            candidates = found if candidates is None else candidates & found
+            if not candidates:
+                return {}
+        if candidates is not None and len(candidates) <= self.CANDIDATE_LIMIT:
+            source = candidates
+        else:
+            source = (book_id for word, _ in matches[rarest] for book_id in self.postings[word]
+                      if candidates is None or book_id in candidates)
+        chosen = set()
+        seen = 0
+        for book_id in source:
+            seen += 1
+            if book_id not in chosen and all(not wanted.isdisjoint(self.book_words[book_id]) for wanted in deferred):
+                chosen.add(book_id)
+                if len(chosen) >= self.CANDIDATE_LIMIT:
+                    break
+            if seen >= self.SCAN_LIMIT:
+                break
+
+        scores = {}
+        postings = self.postings
+        for book_id in chosen:
+            words = self.book_words[book_id]
+            total = 0.0
+            for wanted in similarities:
+                best = 0.0
+                for word in words:
+                    similarity = wanted.get(word)
+                    if similarity is not None:
+                        score = similarity * postings[word][book_id]
+                        if score > best:
+                            best = score
+                total += best
+            scores[book_id] = total
+        return scores
+
+    def search(self, query, limit=20):
+        # [(score, Book ID)], best first; ties go to the book added first.
+        text = normalize_text(query)
+        # A trailing space means the last word is finished.
+        prefix = not str(query).endswith(" ")
+        key = (text, prefix, limit)
+        result = self.cache.get(key)
+        if result is not None:
+            self.cache.move_to_end(key)
+            return result
+        terms = text.split()
+        scores = self._score(terms, prefix) if terms else {}
+        order = self.order
+        top = nlargest(limit, scores.items(), key=lambda item: (item[1], -order[item[0]]))
+        result = [(score, book_id) for book_id, score in top]
+        self.cache[key] = result
+        if len(self.cache) > self.CACHE_SIZE:
+            self.cache.popitem(last=False)
+        return result
@@ -0,0 +1,541 @@
+import argparse
+import json
+import os
+import queue
+import socket
+import socketserver
+import threading
+import time
+from collections import deque
+
+from Library_Analytics import Analytics
+from Library_Archive import HistoryArchive
+from Library_Core import LibraryCore, LibraryError
+from Library_Metrics import increment, timer
+from Library_Records import Book, Loan
+from Library_Storage import STORAGE_ERRORS, StorageBackend, open_storage
+
+SERVICE_ENV = "LIBRARY_SERVICE"
+DEFAULT_ADDRESS = ("127.0.0.1", 8765)
+READ_OPS = {"load_books", "load_history", "signature", "changes", "analytics_report"}
+LOAN_WRITES_REFUSED = "Loans on a shared library can only be changed by borrowing or returning books."
+
+
+class ServiceError(LibraryError, OSError):
+    pass
+
+
+def parse_address(value):
+    host, _, port = value.rpartition(":")
+    return (host or DEFAULT_ADDRESS[0], int(port))
+
+
+def encode(message):
+    return (json.dumps(message, separators=(",", ":"), default=dict) + "\n").encode("utf-8")
+
+
+class TrackedStorage:
+    # Wraps the service's storage and logs which book or loan each write touched,
+    # so clients can fetch just the records that changed since their last look.
+    def __init__(self, storage, limit=50000):
+        self.storage = storage
+        self.version = 0
+        self.log = deque(maxlen=limit)
+        self.lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self.storage, name)
+
+    def _touch(self, kind, keys):
+        with self.lock:
+            for key in keys:
+                self.version += 1
+                self.log.append((self.version, kind, key))
+
+    def changed_since(self, version):
+        # None when the log no longer reaches back that far.
+        with self.lock:
+            if version > self.version:
+                return None
+            if self.log and version < self.log[0][0] - 1:
+                return None
+            if not self.log and version != self.version:
+                return None
+            books = {}
+            loans = {}
+            for entry_version, kind, key in self.log:
+                if entry_version > version:
+                    (books if kind == "book" else loans)[key] = None
+            return self.version, list(books), list(loans)
+
+    def add_book(self, book):
+        self.storage.add_book(book)
+        self._touch("book", [book.get("Book ID", "")])
+
+    def add_books(self, books):
+        self.storage.add_books(books)
+        self._touch("book", [book.get("Book ID", "") for book in books])
+
+    def update_book(self, book):
+        self.storage.update_book(book)
+        self._touch("book", [book.get("Book ID", "")])
+
+    def set_book_available(self, book_id, available):
+        self.storage.set_book_available(book_id, available)
+        self._touch("book", [book_id])
+
+    def delete_book(self, book_id):
+        self.storage.delete_book(book_id)
+        self._touch("book", [book_id])
+
+    def add_loan(self, loan):
+        loan = self.storage.add_loan(loan)
+        self._touch("loan", [loan["Loan ID"]])
+        return loan
+
+    def add_loans(self, loans):
+        loans = self.storage.add_loans(loans)
+        self._touch("loan", [loan["Loan ID"] for loan in loans])
+        return loans
+
+    def update_loan(self, loan):
+        self.storage.update_loan(loan)
+        self._touch("loan", [loan["Loan ID"]])
+
+    def delete_loans(self, loan_ids):
+        loan_ids = list(loan_ids)
+        self.storage.delete_loans(loan_ids)
+        self._touch("loan", loan_ids)
+
+
+class LibraryService:
+    # Owns the data for every desk. Connection threads only parse and queue
+    # requests; one dispatcher thread runs them in batches against a single
+    # LibraryCore, so two desks borrowing at once are simply serialized. The
+    # storage writes of a whole batch go out in one storage.batch() (one commit),
+    # and no reply is sent before its batch has been written.
+    def __init__(self, storage=None, archive=None, batch_size=64, analytics=None, analytics_interval=1.0):
+        self.storage = TrackedStorage(storage if storage is not None else open_storage())
+        self.core = LibraryCore(self.storage, executor=self, archive=archive, analytics=analytics)
+        self.batch_size = batch_size
+        self.requests = queue.Queue()
+        self.writes = []
+        self.write_error = None
+        self.batches = 0
+        self.analytics_interval = analytics_interval
+        self.analytics_saved = 0.0
+        self.closed = False
+        self.ops = {
+            "load_books": lambda: list(self.core.data.books()),
+            "load_history": lambda: list(self.core.data.history()),
+            "signature": lambda: self.storage.version,
+            "changes": self.changes,
+            "add_book": self.core.add_book,
+            "add_books": self.add_books,
+            "update_book": self.core.update_book,
+            "set_book_available": self.core.set_book_available,
+            "delete_book": self.core.delete_book,
+            "borrow": self.core.borrow,
+            "return_loan": self.return_loan,
+            "return_book": self.core.return_book,
+            "archive_history": self.archive_history,
+            "analytics_report": self.core.analytics_report,
+            "rebuild_analytics": self.core.rebuild_analytics,
+        }
+        self._dispatcher = threading.Thread(target=self._dispatch, name="library-service", daemon=True)
+        self._dispatcher.start()
+
+    #Executor for the core's cache
+    def submit(self, fn, *args, on_done=None, on_error=None):
+        self.writes.append((fn, args, on_done, on_error))
+
+    def _flush(self):
+        writes, self.writes = self.writes, []
+        if not writes:
+            return
+        try:
+            with self.storage.batch():
+                for fn, args, on_done, on_error in writes:
+                    fn(*args)
+        except Exception as e:
+            # The whole batch is rolled back; the cache reloads what is on disk.
+            self.write_error = e
+            for fn, args, on_done, on_error in writes:
+                on_error(e)
+        else:
+            for fn, args, on_done, on_error in writes:
+                on_done(None)
+
+    #Operations
+    def changes(self, since):
+        changed = self.storage.changed_since(since)
+        if changed is None:
+            return None
+        version, book_ids, loan_ids = changed
+        history = self.core.data.loans()
+        return {
+            "signature": version,
+            "books": [(book_id, self.core.data.get_book(book_id)) for book_id in book_ids],
+            "loans": [(loan_id, history.get(loan_id)) for loan_id in loan_ids],
+        }
+
+    def add_books(self, books):
+        books = [book for book in books if self.core.data.get_book(book.get("Book ID", "")) is None]
+        if books:
+            self.core.data.add_books(books)
+        return len(books)
+
+    def return_loan(self, loan_id, return_date=None):
+        loan = self.core.find_loan(loan_id)
+        if loan is None:
+            raise LibraryError(f"Unknown loan {loan_id}.")
+        return self.core.return_loan(loan, return_date)
+
+    def archive_history(self, keep_periods=1):
+        # Archiving reads the storage directly, so queued writes go first.
+        self._flush()
+        return self.core.archive_history(keep_periods)
+
+    #Dispatch
+    def call(self, op, args, since=None):
+        # With since, the reply also carries every change after that version,
+        # including this request's own, so the desk needs no second round trip.
+        if self.closed:
+            return {"ok": False, "kind": "storage", "error": "The library service is shutting down."}
+        if since is not None and type(since) is not int:
+            return {"ok": False, "kind": "protocol", "error": f"Bad request for '{op}': since must be a version number"}
+        done = threading.Event()
+        reply = {}
+        self.requests.put((op, args, since, reply, done))
+        done.wait()
+        return reply
+
+    def _dispatch(self):
+        while True:
+            batch = [self.requests.get()]
+            if batch[0] is None:
+                return
+            while len(batch) < self.batch_size:
+                try:
+                    request = self.requests.get_nowait()
+                except queue.Empty:
+                    break
+                if request is None:
+                    self.requests.put(None)
+                    break
+                batch.append(request)
+            with timer("service.batch"):
+                self._run_batch(batch)
+
+    def _run_batch(self, batch):
+        self.batches += 1
+        increment("service.requests", len(batch))
+        self.write_error = None
+        wrote = []
+        try:
+            for op, args, since, reply, done in batch:
+                writes = len(self.writes)
+                reply.update(self._execute(op, args))
+                wrote.append(len(self.writes) > writes)
+            self._flush()
+            for (op, args, since, reply, done), has_writes in zip(batch, wrote):
+                if has_writes and self.write_error is not None:
+                    reply.clear()
+                    reply.update(ok=False, kind="storage", error=f"Could not save: {self.write_error}")
+                if since is not None:
+                    try:
+                        reply["changes"] = self.changes(since)
+                    except Exception as e:
+                        reply.clear()
+                        reply.update(ok=False, kind="service", error=f"Could not list changes: {e}")
+        finally:
+            # Nobody may be left waiting in call(), whatever went wrong above.
+            for op, args, since, reply, done in batch:
+                if not reply:
+                    reply.update(ok=False, kind="service", error="The library service could not run this request.")
+                done.set()
+        if any(wrote):
+            self._save_analytics()
+
+    def _save_analytics(self):
+        # After the replies: the totals follow the writes, at most once per interval.
+        now = time.monotonic()
+        if now - self.analytics_saved < self.analytics_interval:
+            return
+        self.analytics_saved = now
+        try:
+            self.core.save_analytics()
+        except OSError:
+            pass
+
+    def _execute(self, op, args):
+        fn = self.ops.get(op)
+        if fn is None:
+            return {"ok": False, "kind": "protocol", "error": f"Unknown operation '{op}'."}
+        try:
+            return {"ok": True, "result": fn(*args)}
+        except LibraryError as e:
+            return {"ok": False, "kind": "library", "error": str(e)}
+        except STORAGE_ERRORS as e:
+            return {"ok": False, "kind": "storage", "error": str(e)}
+        except (TypeError, ValueError, KeyError) as e:
+            return {"ok": False, "kind": "protocol", "error": f"Bad request for '{op}': {e}"}
+        except Exception as e:
+            # A bug in one operation fails that request, not the dispatcher.
+            return {"ok": False, "kind": "service", "error": f"'{op}' failed: {e!r}"}
+
+    def close(self):
+        self.closed = True
+        self.requests.put(None)
+        self._dispatcher.join()
+        while True:
+            try:
+                request = self.requests.get_nowait()
+            except queue.Empty:
+                break
+            if request is not None:
+                request[3].update(ok=False, kind="storage", error="The library service is shutting down.")
+                request[4].set()
+        self.core.close()
+
+
+class RequestHandler(socketserver.StreamRequestHandler):
+    # One JSON request per line, answered with one JSON line.
+    def handle(self):
+        for line in self.rfile:
+            try:
+                request = json.loads(line)
+                if not isinstance(request, dict):
+                    raise TypeError("expected a JSON object")
+                reply = self.server.service.call(request["op"], request.get("args", []), request.get("since"))
+            except (ValueError, KeyError, TypeError) as e:
+                reply = {"ok": False, "kind": "protocol", "error": f"Malformed request: {e}"}
+            try:
+                self.wfile.write(encode(reply))
+            except OSError:
+                return
+
+
+class LibraryServer(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, service, address=DEFAULT_ADDRESS):
+        super().__init__(address, RequestHandler)
+        self.service = service
+
+
+class ServiceClient:
+    # Keeps up to pool_size idle connections open and reuses them, so a request
+    # costs one round trip instead of a new TCP connection.
+    def __init__(self, address=DEFAULT_ADDRESS, pool_size=4, timeout=30):
+        self.address = address
+        self.pool_size = pool_size
+        self.timeout = timeout
+        self.idle = queue.LifoQueue()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock, sock.makefile("rb")
+
+    def _acquire(self):
+        try:
+            return self.idle.get_nowait(), True
+        except queue.Empty:
+            return self._connect(), False
+
+    def _release(self, connection):
+        if self.idle.qsize() < self.pool_size:
+            self.idle.put(connection)
+        else:
+            self._discard(connection)
+
+    def _discard(self, connection):
+        sock, file = connection
+        file.close()
+        sock.close()
+
+    def call(self, op, *args):
+        return self.request(op, args)["result"]
+
+    def request(self, op, args, since=None):
+        request = encode({"op": op, "args": args, "since": since})
+        while True:
+            try:
+                connection, reused = self._acquire()
+            except OSError as e:
+                raise ServiceError(f"Library service unavailable: {e}")
+            try:
+                connection[0].sendall(request)
+                line = connection[1].readline()
+                if not line:
+                    raise ConnectionError("connection closed by the service")
+            except OSError as e:
+                self._discard(connection)
+                # An idle connection may have gone stale; only reads are safe to resend.
+                if reused and op in READ_OPS:
+                    continue
+                raise ServiceError(f"Library service unavailable: {e}")
+            self._release(connection)
+            reply = json.loads(line)
+            if not reply["ok"]:
+                if reply.get("kind") == "library":
+                    raise LibraryError(reply["error"])
+                raise ServiceError(reply["error"])
+            return reply
+
+    def close(self):
+        while True:
+            try:
+                self._discard(self.idle.get_nowait())
+            except queue.Empty:
+                return
+
+
+class ServiceStorage(StorageBackend):
+    # Read side of a desk: the local LibraryCache loads from the service once and
+    # then catches up through changes() instead of reloading everything. Book
+    # writes are passed on to the service's operations of the same name; loans
+    # only change through RemoteCore's borrow and return, so loan writes are
+    # refused with a LibraryError.
+    tracks_changes = True
+
+    def __init__(self, client):
+        self.client = client
+
+    def signature(self):
+        return ("service", self.client.call("signature"))
+
+    def changes(self, since):
+        changes = self.client.call("changes", since[1])
+        if changes is None:
+            return None
+        changes["signature"] = ("service", changes["signature"])
+        return changes
+
+    def load_books(self):
+        return [Book.from_mapping(book) for book in self.client.call("load_books")]
+
+    def load_history(self):
+        return [Loan.from_mapping(loan) for loan in self.client.call("load_history")]
+
+    def add_books(self, books):
+        self.client.call("add_books", [dict(book) for book in books])
+
+    def update_book(self, book):
+        self.client.call("update_book", dict(book))
+
+    def set_book_available(self, book_id, available):
+        self.client.call("set_book_available", book_id, available)
+
+    def delete_book(self, book_id):
+        self.client.call("delete_book", book_id)
+
+    def add_loans(self, loans):
+        raise LibraryError(LOAN_WRITES_REFUSED)
+
+    def update_loan(self, loan):
+        raise LibraryError(LOAN_WRITES_REFUSED)
+
+    def delete_loans(self, loan_ids):
+        raise LibraryError(LOAN_WRITES_REFUSED)
+
+    def close(self):
+        self.client.close()
+
+
+class RemoteCore(LibraryCore):
+    # LibraryCore for a desk: reads come from the local cache, every change is
+    # made by the service and then pulled back into the cache.
+    def __init__(self, client, executor=None, archive=None, events=None):
+        super().__init__(ServiceStorage(client), executor=executor, archive=archive, events=events)
+        self.client = client
+
+    def _call(self, op, *args):
+        signature = self.data.signature()
+        reply = self.client.request(op, args, since=signature[1] if signature else None)
+        changes = reply.get("changes")
+        if changes is not None and self.data.signature() == signature:
+            changes["signature"] = ("service", changes["signature"])
+            self.data.apply_changes(changes)
+        else:
+            self.data.refresh()
+        return reply["result"]
+
+    def add_book(self, book):
+        self._call("add_book", dict(book))
+        return book
+
+    def update_book(self, book):
+        self._call("update_book", dict(book))
+        return book
+
+    def delete_book(self, book_id):
+        self._call("delete_book", book_id)
+
+    def set_book_available(self, book_id, available):
+        self._call("set_book_available", book_id, available)
+
+    def borrow(self, borrower_name, book_id, date_borrowed=None, date_return=None, member_id=""):
+        loan = self._call("borrow", borrower_name, book_id, date_borrowed, date_return, member_id)
+        return self.data.find_loan("Loan ID", loan["Loan ID"])
+
+    def return_loan(self, loan, return_date=None):
+        loan = self._call("return_loan", loan["Loan ID"], return_date)
+        return self.data.find_loan("Loan ID", loan["Loan ID"])
+
+    def return_book(self, book_id, return_date=None, member_id=""):
+        loan = self._call("return_book", book_id, return_date, member_id)
+        return self.data.find_loan("Loan ID", loan["Loan ID"])
+
+    def _archive(self, keep_periods):
+        return self.client.call("archive_history", keep_periods)
+
+    def _archived(self, count):
+        self.data.refresh()
+        return count
+
+    def analytics_report(self, top=10, days=30):
+        return self.client.call("analytics_report", top, days)
+
+    def rebuild_analytics(self):
+        return self.client.call("rebuild_analytics")
+
+    def save_analytics(self):
+        # The service keeps the totals and saves them itself.
+        pass
+
+
+def connect(address=None, executor=None, archive=None, events=None):
+    # A RemoteCore when LIBRARY_SERVICE (host:port) is set, else None.
+    address = address or os.environ.get(SERVICE_ENV)
+    if not address:
+        return None
+    return RemoteCore(ServiceClient(parse_address(address)), executor=executor, archive=archive, events=events)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Serve one library to several desks on this machine.")
+    parser.add_argument("--address", default=f"{DEFAULT_ADDRESS[0]}:{DEFAULT_ADDRESS[1]}", help="host:port to listen on")
+    parser.add_argument("--storage", choices=["sqlite", "journal", "pickle"], help="storage backend")
+    parser.add_argument("--batch-size", type=int, default=64)
+    args = parser.parse_args(argv)
+
+    service = LibraryService(
+        open_storage(args.storage), archive=HistoryArchive(), batch_size=args.batch_size, analytics=Analytics()
+    )
+    server = LibraryServer(service, parse_address(args.address))
+    print(f"Library service listening on {args.address}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+    return 0
+
+
+if __name__ == "__main__":
+    raise SystemExit(main())
@@ -0,0 +1,351 @@
+import mmap
+import struct
+from bisect import bisect_left, bisect_right
+
+from Library_Records import Book, Loan
+
+MAGIC = b"LIBSNAP2"
+
+# magic, book count, loan count, open loan count, string count, then the offsets
+# of the book table, the Book ID index, the loan table, the open loan index, the
+# Member ID index, the string offsets and the heap.
+HEADER = struct.Struct("<8sIIII7Q")
+# Book ID, title, author, genre (string numbers), copies on the shelf, copies.
+BOOK_RECORD = struct.Struct("<IIIIii")
+# Loan ID, borrower, Book ID, title, borrowed, due/returned, status, fine, member ID.
+# Dates are ordinals; a negative date is -(string number + 1) for text kept as written.
+LOAN_RECORD = struct.Struct("<qIIIqqIqI")
+LOAN_MEMBER = struct.Struct("<48xI")
+OFFSET = struct.Struct("<I")
+
+
+class SnapshotError(Exception):
+    # The file is not a snapshot this version can read (wrong format, version or size).
+    pass
+
+
+def is_snapshot(file_name):
+    # Any version of the binary format, as opposed to an older pickled snapshot.
+    with open(file_name, "rb") as file:
+        return file.read(len(MAGIC))[:7] == MAGIC[:7]
+
+
+def write_snapshot(file, books, loans):
+    # Books in the order given, loans sorted by Loan ID; each distinct string is
+    # stored once in the heap.
+    strings = {}
+
+    def ref(value):
+        return strings.setdefault(value if type(value) is str else str(value or ""), len(strings))
+
+    def date_ref(value):
+        return value if type(value) is int else -(ref(value) + 1)
+
+    book_table = bytearray()
+    book_ids = []
+    for book in books:
+        book = Book.from_mapping(book)
+        book_ids.append(book.book_id)
+        book_table += BOOK_RECORD.pack(
+            ref(book.book_id), ref(book.title), ref(book.author), ref(book.genre), book.available, book.copies
+        )
+    order = sorted(range(len(book_ids)), key=book_ids.__getitem__)
+    book_index = struct.pack(f"<{len(order)}I", *order)
+
+    loans = sorted((Loan.from_mapping(loan) for loan in loans), key=lambda loan: loan.loan_id)
+    loan_table = bytearray()
+    for loan in loans:
+        loan_table += LOAN_RECORD.pack(
+            loan.loan_id, ref(loan.borrower), ref(loan.book_id), ref(loan.title), date_ref(loan.date_borrowed),
+            date_ref(loan.date_return), ref(loan.status), loan.fine if type(loan.fine) is int else 0, ref(loan.member_id),
+        )
+    # Record numbers of the open loans, and of every loan by (Member ID, Loan ID).
+    open_loans = [index for index, loan in enumerate(loans) if loan.status != "Returned"]
+    open_index = struct.pack(f"<{len(open_loans)}I", *open_loans)
+    order = sorted(range(len(loans)), key=lambda index: loans[index].member_id)
+    member_index = struct.pack(f"<{len(order)}I", *order)
+
+    heap = bytearray()
+    offsets = bytearray()
+    for value in strings:
+        offsets += OFFSET.pack(len(heap))
+        heap += value.encode("utf-8")
+    offsets += OFFSET.pack(len(heap))
+
+    sections = (book_table, book_index, loan_table, open_index, member_index, offsets, heap)
+    positions = [HEADER.size]
+    for section in sections[:-1]:
+        positions.append(positions[-1] + len(section))
+    file.write(HEADER.pack(MAGIC, len(book_ids), len(loans), len(open_loans), len(strings), *positions))
+    for section in sections:
+        file.write(section)
+
+
+class _Column:
+    # A read-only sequence over one field of the mapped records, for bisect.
+    def __init__(self, length, item):
+        self.length = length
+        self.item = item
+
+    def __len__(self):
+        return self.length
+
+    def __getitem__(self, index):
+        return self.item(index)
+
+
+class Snapshot:
+    # A snapshot file mapped into memory. Nothing is decoded up front: records
+    # are unpacked when asked for, so opening even a very large file costs one
+    # header read and the pages that lookups actually touch.
+    def __init__(self, file_name):
+        self.file_name = file_name
+        self.open()
+
+    def open(self):
+        file_name = self.file_name
+        with open(file_name, "rb") as file:
+            try:
+                self.map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                raise SnapshotError(f"'{file_name}' is empty, not a library snapshot")
+        try:
+            (magic, self.book_count, self.loan_count, self.open_count, self.string_count, self.book_table_at,
+             self.book_index_at, self.loan_table_at, self.open_index_at, self.member_index_at, self.offsets_at,
+             self.heap_at) = HEADER.unpack_from(self.map, 0)
+            if magic != MAGIC:
+                raise SnapshotError(f"'{file_name}' was written by another version of the snapshot format")
+            if not self._complete():
+                raise SnapshotError(f"'{file_name}' is truncated or damaged")
+        except struct.error:
+            self.map.close()
+            raise SnapshotError(f"'{file_name}' is not a library snapshot")
+        except SnapshotError:
+            self.map.close()
+            raise
+        self.strings = {}
+        self.sorted_book_ids = _Column(self.book_count, lambda index: self.book_id_at(self._book_index(index)))
+        self.loan_ids = _Column(self.loan_count, self.loan_id_at)
+        self.sorted_member_ids = _Column(self.loan_count, lambda index: self.member_id_at(self._member_index(index)))
+
+    def _complete(self):
+        # Every section where the header says, and the heap running to the end.
+        sections = (
+            (self.book_table_at, self.book_count * BOOK_RECORD.size),
+            (self.book_index_at, self.book_count * OFFSET.size),
+            (self.loan_table_at, self.loan_count * LOAN_RECORD.size),
+            (self.open_index_at, self.open_count * OFFSET.size),
+            (self.member_index_at, self.loan_count * OFFSET.size),
+            (self.offsets_at, (self.string_count + 1) * OFFSET.size),
+        )
+        position = HEADER.size
+        for start, size in sections:
+            if start != position:
+                return False
+            position += size
+        if self.heap_at != position or position > len(self.map):
+            return False
+        heap_size = OFFSET.unpack_from(self.map, self.offsets_at + self.string_count * OFFSET.size)[0]
+        return self.heap_at + heap_size == len(self.map)
+
+    def close(self):
+        self.map.close()
+
+    def string(self, number):
+        value = self.strings.get(number)
+        if value is None:
+            start, end = struct.unpack_from("<II", self.map, self.offsets_at + number * OFFSET.size)
+            value = self.strings[number] = self.map[self.heap_at + start:self.heap_at + end].decode("utf-8")
+        return value
+
+    def _date(self, value):
+        return value if value >= 0 else self.string(-value - 1)
+
+    #Books
+    def _book_index(self, index):
+        return OFFSET.unpack_from(self.map, self.book_index_at + index * OFFSET.size)[0]
+
+    def book_id_at(self, index):
+        return self.string(OFFSET.unpack_from(self.map, self.book_table_at + index * BOOK_RECORD.size)[0])
+
+    def book_at(self, index):
+        book_id, title, author, genre, available, copies = BOOK_RECORD.unpack_from(
+            self.map, self.book_table_at + index * BOOK_RECORD.size
+        )
+        return Book(self.string(book_id), self.string(title), self.string(author), self.string(genre), available, copies)
+
+    def find_book(self, book_id):
+        # Record number of the book, by binary search over the Book ID index.
+        position = bisect_left(self.sorted_book_ids, book_id)
+        if position < self.book_count and self.sorted_book_ids[position] == book_id:
+            return self._book_index(position)
+        return None
+
+    def get_book(self, book_id):
+        index = self.find_book(book_id)
+        return self.book_at(index) if index is not None else None
+
+    def books(self):
+        for index in range(self.book_count):
+            yield self.book_at(index)
+
+    def books_between(self, first=None, last=None):
+        # Books with first <= Book ID <= last in Book ID order; either end may be left open.
+        start = bisect_left(self.sorted_book_ids, first) if first is not None else 0
+        end = bisect_right(self.sorted_book_ids, last, start) if last is not None else self.book_count
+        for position in range(start, end):
+            yield self.book_at(self._book_index(position))
+
+    def book_ids(self):
+        for index in range(self.book_count):
+            yield self.book_id_at(index)
+
+    #Loans
+    def loan_id_at(self, index):
+        return struct.unpack_from("<q", self.map, self.loan_table_at + index * LOAN_RECORD.size)[0]
+
+    def loan_at(self, index):
+        loan_id, borrower, book_id, title, borrowed, returned, status, fine, member_id = LOAN_RECORD.unpack_from(
+            self.map, self.loan_table_at + index * LOAN_RECORD.size
+        )
+        return Loan(
+            loan_id, self.string(borrower), self.string(book_id), self.string(title), self._date(borrowed),
+            self._date(returned), self.string(status), fine, self.string(member_id),
+        )
+
+    def find_loan(self, loan_id):
+        position = bisect_left(self.loan_ids, loan_id)
+        if position < self.loan_count and self.loan_ids[position] == loan_id:
+            return position
+        return None
+
+    def get_loan(self, loan_id):
+        index = self.find_loan(loan_id)
+        return self.loan_at(index) if index is not None else None
+
+    def loans(self, first=None, last=None):
+        # Loans with first <= Loan ID <= last, in Loan ID order; either end may be
+        # left open. Only the records in the range are read.
+        start = bisect_left(self.loan_ids, first) if first is not None else 0
+        end = bisect_right(self.loan_ids, last, start) if last is not None else self.loan_count
+        for index in range(start, end):
+            yield self.loan_at(index)
+
+    def open_loan_ids(self):
+        return [
+            self.loan_id_at(OFFSET.unpack_from(self.map, self.open_index_at + position * OFFSET.size)[0])
+            for position in range(self.open_count)
+        ]
+
+    def _member_index(self, position):
+        return OFFSET.unpack_from(self.map, self.member_index_at + position * OFFSET.size)[0]
+
+    def member_id_at(self, index):
+        return self.string(LOAN_MEMBER.unpack_from(self.map, self.loan_table_at + index * LOAN_RECORD.size)[0])
+
+    def member_loan_ids(self, member_id):
+        # Loan IDs of the member's loans, by binary search over the Member ID index.
+        start = bisect_left(self.sorted_member_ids, member_id)
+        end = bisect_right(self.sorted_member_ids, member_id, start)
+        return [self.loan_id_at(self._member_index(position)) for position in range(start, end)]
+
+    def last_loan_id(self):
+        return self.loan_id_at(self.loan_count - 1) if self.loan_count else 0
+
+
+class BookView:
+    # The books of a snapshot as a read-only mapping keyed by Book ID.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self, book_id, default=None):
+        book = self.snapshot.get_book(book_id)
+        return book if book is not None else default
+
+    def keys(self):
+        return self.snapshot.book_ids()
+
+    def items(self):
+        for book in self.snapshot.books():
+            yield book.book_id, book
+
+
+class LoanView:
+    # The loans of a snapshot as a read-only mapping keyed by Loan ID.
+    def __init__(self, snapshot):
+        self.snapshot = snapshot
+
+    def get(self, loan_id, default=None):
+        loan = self.snapshot.get_loan(loan_id) if type(loan_id) is int else None
+        return loan if loan is not None else default
+
+    def keys(self):
+        for index in range(self.snapshot.loan_count):
+            yield self.snapshot.loan_id_at(index)
+
+    def items(self):
+        for loan in self.snapshot.loans():
+            yield loan.loan_id, loan
+
+
+class Layer:
+    # Changes kept in a dict on top of a read-only base mapping (a snapshot view,
+    # a plain dict or another Layer); None marks a deleted key. Iteration follows
+    # the base order with changed records in place and new keys at the end.
+    def __init__(self, base):
+        self.base = base
+        self.changes = {}
+
+    def get(self, key, default=None):
+        if key in self.changes:
+            value = self.changes[key]
+            return value if value is not None else default
+        return self.base.get(key, default)
+
+    def __contains__(self, key):
+        return self.get(key) is not None
+
+    def __setitem__(self, key, value):
+        self.changes[key] = value
+
+    def pop(self, key, default=None):
+        value = self.get(key)
+        if value is None:
+            return default
+        self.changes[key] = None
+        return value
+
+    def keys(self):
+        changes = self.changes
+        for key in self.base.keys():
+            if changes.get(key, True) is not None:
+                yield key
+        for key, value in changes.items():
+            if value is not None and self.base.get(key) is None:
+                yield key
+
+    def __iter__(self):
+        return self.keys()
+
+    def items(self):
+        changes = self.changes
+        for key, value in self.base.items():
+            if key in changes:
+                value = changes[key]
+                if value is None:
+                    continue
+            yield key, value
+        for key, value in changes.items():
+            if value is not None and self.base.get(key) is None:
+                yield key, value
+
+    def values(self):
+        for key, value in self.items():
+            yield value
+
+    def changed_keys(self):
+        # Every key changed in this layer or the layers below it.
+        keys = set(self.changes)
+        if isinstance(self.base, Layer):
+            keys |= self.base.changed_keys()
+        return keys
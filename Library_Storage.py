@@ -0,0 +1,540 @@
+import os
+import pickle
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from Library_Members import MemberRegistry
+from Library_Metrics import timer
+from Library_Overdue import DueQueue
+from Library_Records import Book, Loan, copy_count
+from Library_Search import FuzzyIndex
+from Library_Snapshot import SnapshotError
+
+BOOK_FILE = "book_data.pkl"
+HISTORY_FILE = "history.pkl"
+DATABASE_FILE = "library.db"
+JOURNAL_MODE_ENV = "LIBRARY_JOURNAL_MODE"
+JOURNAL_MODES = ("WAL", "DELETE", "TRUNCATE", "PERSIST")
+NETWORK_FILESYSTEMS = {"nfs", "nfs4", "cifs", "smb3", "smbfs", "afs", "9p", "ceph", "glusterfs", "fuse.sshfs"}
+
+STORAGE_ERRORS = (OSError, EOFError, pickle.UnpicklingError, sqlite3.Error, SnapshotError)
+
+# Display key -> column name; the columns match the record slot names.
+BOOK_COLUMNS = Book.FIELDS
+HISTORY_COLUMNS = Loan.FIELDS
+
+
+def file_signature(*file_names):
+    signature = []
+    for file_name in file_names:
+        try:
+            stat = os.stat(file_name)
+            signature.append((stat.st_mtime_ns, stat.st_size))
+        except OSError:
+            signature.append(None)
+    return tuple(signature)
+
+
+def is_network_path(path):
+    # Best effort: UNC paths and remote drives on Windows, network filesystems in
+    # /proc/mounts on Linux. Anything that cannot be told apart counts as local.
+    path = os.path.abspath(path)
+    if os.name == "nt":
+        if path.startswith("\\\\"):
+            return True
+        import ctypes
+        drive = os.path.splitdrive(path)[0] + "\\"
+        return ctypes.windll.kernel32.GetDriveTypeW(drive) == 4  # DRIVE_REMOTE
+    try:
+        with open("/proc/mounts", encoding="utf-8") as file:
+            mounts = [line.split()[1:3] for line in file]
+    except OSError:
+        return False
+    mount_point, fs_type = "", ""
+    for point, kind in mounts:
+        point = point.replace("\\040", " ")
+        if (path == point or path.startswith(point.rstrip("/") + "/")) and len(point) > len(mount_point):
+            mount_point, fs_type = point, kind
+    return fs_type in NETWORK_FILESYSTEMS
+
+
+def normalize_book(book):
+    copies = max(0, int(book.get("Copies", 1)))
+    return {
+        "Book ID": book.get("Book ID", ""),
+        "Book Title": book.get("Book Title", ""),
+        "Author Name": book.get("Author Name", ""),
+        "Genre": book.get("Genre", ""),
+        "Available": copy_count(book.get("Available", True), copies),
+        "Copies": copies,
+    }
+
+
+def normalize_loan(loan):
+    return {
+        "Loan ID": loan.get("Loan ID"),
+        "Borrower Name": loan.get("Borrower Name", ""),
+        "Book ID": loan.get("Book ID", ""),
+        "Book Title": loan.get("Book Title", ""),
+        "Date Borrowed": loan.get("Date Borrowed", ""),
+        "Date Return": loan.get("Date Return", ""),
+        "Status": loan.get("Status", "Borrowed"),
+        "Fine": loan.get("Fine", 0),
+        "Member ID": loan.get("Member ID") or "",
+    }
+
+
+class StorageBackend:
+    tracks_changes = False
+
+    def load_books(self):
+        raise NotImplementedError
+
+    def load_history(self):
+        raise NotImplementedError
+
+    def book_ids(self):
+        return [book.get("Book ID", "") for book in self.load_books()]
+
+    def get_book(self, book_id):
+        return self.find_book("Book ID", book_id)
+
+    def find_book(self, field, value):
+        for book in self.load_books():
+            if book.get(field) == value:
+                return book
+        return None
+
+    def find_loan(self, field, value):
+        for loan in self.load_history():
+            if loan.get(field) == value:
+                return loan
+        return None
+
+    def open_loans(self):
+        return [loan for loan in self.load_history() if loan.get("Status", "Borrowed") != "Returned"]
+
+    def loan_watermark(self):
+        # (newest Loan ID, open loan count): what saved analytics are checked against.
+        last_loan_id = open_count = 0
+        for loan in self.load_history():
+            last_loan_id = max(last_loan_id, loan["Loan ID"])
+            open_count += loan.get("Status", "Borrowed") != "Returned"
+        return last_loan_id, open_count
+
+    def open_loan(self, book_id):
+        # The oldest open loan of the book when several copies are out.
+        for loan in self.load_history():
+            if loan.get("Book ID") == book_id and loan.get("Status", "Borrowed") != "Returned":
+                return loan
+        return None
+
+    def member(self, member_id):
+        return MemberRegistry(loan for loan in self.load_history() if loan.get("Member ID") == member_id).get(member_id)
+
+    def overdue_loans(self, as_of):
+        return DueQueue(self.open_loans()).overdue(as_of)
+
+    def next_due(self, count, as_of=None):
+        return DueQueue(self.open_loans()).next_due(count, as_of)
+
+    def search_titles(self, query, prefix=False):
+        query = query.casefold()
+        titles = [book.get("Book Title", "Unknown Title") for book in self.load_books()]
+        if prefix:
+            return [title for title in titles if title.casefold().startswith(query)]
+        return [title for title in titles if query in title.casefold()]
+
+    def search_ranked(self, query, limit=20):
+        books = {book.get("Book ID", ""): book for book in self.load_books()}
+        return [(score, books[book_id]) for score, book_id in FuzzyIndex(books.values()).search(query, limit)]
+
+    def add_book(self, book):
+        self.add_books([book])
+
+    def add_books(self, books):
+        raise NotImplementedError
+
+    def update_book(self, book):
+        raise NotImplementedError
+
+    def set_book_available(self, book_id, available):
+        book = self.get_book(book_id)
+        if book is not None:
+            book["Available"] = available
+            self.update_book(book)
+
+    def delete_book(self, book_id):
+        raise NotImplementedError
+
+    def add_loan(self, loan):
+        return self.add_loans([loan])[0]
+
+    def add_loans(self, loans):
+        raise NotImplementedError
+
+    def update_loan(self, loan):
+        raise NotImplementedError
+
+    def delete_loans(self, loan_ids):
+        raise NotImplementedError
+
+    def signature(self):
+        return None
+
+    def changes(self, since):
+        # Records changed since an earlier signature, or None when that is not known.
+        return None
+
+    @contextmanager
+    def batch(self):
+        yield
+
+    def close(self):
+        pass
+
+
+class PickleStorage(StorageBackend):
+    # One pickled list of records per file, rewritten on every change. Files from
+    # older versions hold dicts; they are converted on load and saved as records.
+    def __init__(self, book_file=BOOK_FILE, history_file=HISTORY_FILE):
+        self.book_file = book_file
+        self.history_file = history_file
+        self.lock = threading.RLock()
+        self.pending = None
+
+    @contextmanager
+    def batch(self):
+        # Inside the block writes only replace in-memory copies; each changed file
+        # is rewritten once at the end.
+        with self.lock:
+            if self.pending is not None:
+                # Nested in an outer batch, which writes everything at its end.
+                yield
+                return
+            self.pending = {}
+            try:
+                yield
+                pending, self.pending = self.pending, None
+                for file_name, data in pending.items():
+                    self._write(file_name, data)
+            finally:
+                self.pending = None
+
+    def _read(self, file_name):
+        with self.lock:
+            if self.pending is not None and file_name in self.pending:
+                return list(self.pending[file_name])
+            if os.path.exists(file_name):
+                with timer("storage.pickle_load"), open(file_name, "rb") as file:
+                    return pickle.load(file)
+            return []
+
+    def _write(self, file_name, data):
+        with self.lock:
+            if self.pending is not None:
+                self.pending[file_name] = data
+                return
+            with timer("storage.pickle_dump"), open(file_name, "wb") as file:
+                pickle.dump(data, file)
+
+    def signature(self):
+        return file_signature(self.book_file, self.history_file)
+
+    def load_books(self):
+        return [Book.from_mapping(book) for book in self._read(self.book_file)]
+
+    def load_history(self):
+        all_history = [Loan.from_mapping(loan) for loan in self._read(self.history_file)]
+        next_id = max((loan.get("Loan ID") or 0 for loan in all_history), default=0) + 1
+        for loan in all_history:
+            if loan.get("Loan ID") is None:
+                loan["Loan ID"] = next_id
+                next_id += 1
+        return all_history
+
+    def add_books(self, books):
+        all_books = self.load_books()
+        all_books.extend(Book.from_mapping(book) for book in books)
+        self._write(self.book_file, all_books)
+
+    def update_book(self, book):
+        all_books = self.load_books()
+        for i, item in enumerate(all_books):
+            if item.get("Book ID", "") == book.get("Book ID", ""):
+                all_books[i] = Book.from_mapping(book)
+                break
+        self._write(self.book_file, all_books)
+
+    def delete_book(self, book_id):
+        all_books = [book for book in self.load_books() if book.get("Book ID", "") != book_id]
+        self._write(self.book_file, all_books)
+
+    def add_loans(self, loans):
+        all_history = self.load_history()
+        next_id = max((loan["Loan ID"] for loan in all_history), default=0) + 1
+        for loan in loans:
+            if loan.get("Loan ID") is None:
+                loan["Loan ID"] = next_id
+                next_id += 1
+        all_history.extend(Loan.from_mapping(loan) for loan in loans)
+        self._write(self.history_file, all_history)
+        return loans
+
+    def update_loan(self, loan):
+        all_history = self.load_history()
+        for i, item in enumerate(all_history):
+            if item["Loan ID"] == loan["Loan ID"]:
+                all_history[i] = Loan.from_mapping(loan)
+                break
+        self._write(self.history_file, all_history)
+
+    def delete_loans(self, loan_ids):
+        loan_ids = set(loan_ids)
+        all_history = [loan for loan in self.load_history() if loan["Loan ID"] not in loan_ids]
+        self._write(self.history_file, all_history)
+
+
+class SQLiteStorage(StorageBackend):
+    # journal_mode (or LIBRARY_JOURNAL_MODE) picks SQLite's journal. By default
+    # WAL is used on local disks only: its shared-memory index does not work on
+    # network shares. When WAL does not take, rollback (DELETE) is used instead.
+    def __init__(self, db_file=DATABASE_FILE, journal_mode=None):
+        self.db_file = db_file
+        # Writes may come from the background I/O worker, so share one locked connection.
+        self.lock = threading.RLock()
+        self.conn = sqlite3.connect(db_file, check_same_thread=False)
+        self.batching = False
+        mode = (journal_mode or os.environ.get(JOURNAL_MODE_ENV) or "").upper()
+        if not mode:
+            mode = "DELETE" if is_network_path(db_file) else "WAL"
+        if mode not in JOURNAL_MODES:
+            self.conn.close()
+            raise ValueError(f"Unknown journal mode '{mode}'; use one of {', '.join(JOURNAL_MODES)}.")
+        self.journal_mode = self.conn.execute(f"PRAGMA journal_mode={mode}").fetchone()[0].upper()
+        if self.journal_mode != mode:
+            self.journal_mode = self.conn.execute("PRAGMA journal_mode=DELETE").fetchone()[0].upper()
+        # NORMAL is only crash-safe with WAL; rollback journals need FULL.
+        self.conn.execute("PRAGMA synchronous=NORMAL" if self.journal_mode == "WAL" else "PRAGMA synchronous=FULL")
+        with self.lock, self.conn:
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS books ("
+                "book_id TEXT PRIMARY KEY, title TEXT, author TEXT, genre TEXT, available INTEGER, copies INTEGER DEFAULT 1)"
+            )
+            self.conn.execute(
+                "CREATE TABLE IF NOT EXISTS history ("
+                "loan_id INTEGER PRIMARY KEY AUTOINCREMENT, borrower TEXT, book_id TEXT, title TEXT, "
+                "date_borrowed TEXT, date_return TEXT, status TEXT, fine INTEGER, member_id TEXT DEFAULT '')"
+            )
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(books)")]
+            if "copies" not in columns:
+                self.conn.execute("ALTER TABLE books ADD COLUMN copies INTEGER DEFAULT 1")
+            columns = [row[1] for row in self.conn.execute("PRAGMA table_info(history)")]
+            if "member_id" not in columns:
+                self.conn.execute("ALTER TABLE history ADD COLUMN member_id TEXT DEFAULT ''")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS books_title ON books (title)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS history_book_id ON history (book_id)")
+            self.conn.execute(
+                "CREATE INDEX IF NOT EXISTS history_open ON history (book_id, loan_id) WHERE status != 'Returned'"
+            )
+            self.conn.execute("CREATE INDEX IF NOT EXISTS history_member ON history (member_id, loan_id)")
+
+    @contextmanager
+    def _transaction(self):
+        with self.lock:
+            if self.batching:
+                yield
+                return
+            with timer("storage.sqlite_write"), self.conn:
+                yield
+
+    @contextmanager
+    def batch(self):
+        # One transaction, and one commit, for every write made inside the block.
+        # A nested batch joins the outer transaction.
+        with self.lock:
+            if self.batching:
+                yield
+                return
+            with timer("storage.sqlite_batch"), self.conn:
+                self.batching = True
+                try:
+                    yield
+                finally:
+                    self.batching = False
+
+    def _book_row(self, book):
+        book = normalize_book(book)
+        return (book["Book ID"], book["Book Title"], book["Author Name"], book["Genre"], book["Available"], book["Copies"])
+
+    def _book_record(self, row):
+        return Book(*row)
+
+    def _loan_record(self, row):
+        return Loan(*row)
+
+    def signature(self):
+        return file_signature(self.db_file, self.db_file + "-wal")
+
+    def _query(self, sql, params=()):
+        with self.lock, timer("storage.sqlite_query"):
+            return self.conn.execute(sql, params).fetchall()
+
+    def load_books(self):
+        rows = self._query("SELECT book_id, title, author, genre, available, copies FROM books ORDER BY rowid")
+        return [self._book_record(row) for row in rows]
+
+    def load_history(self):
+        columns = ", ".join(HISTORY_COLUMNS.values())
+        rows = self._query(f"SELECT {columns} FROM history ORDER BY loan_id")
+        return [self._loan_record(row) for row in rows]
+
+    def book_ids(self):
+        return [row[0] for row in self._query("SELECT book_id FROM books")]
+
+    def find_book(self, field, value):
+        column = BOOK_COLUMNS[field]
+        rows = self._query(
+            f"SELECT book_id, title, author, genre, available, copies FROM books WHERE {column} = ? ORDER BY rowid LIMIT 1",
+            (value,),
+        )
+        return self._book_record(rows[0]) if rows else None
+
+    def find_loan(self, field, value):
+        columns = ", ".join(HISTORY_COLUMNS.values())
+        rows = self._query(
+            f"SELECT {columns} FROM history WHERE {HISTORY_COLUMNS[field]} = ? ORDER BY loan_id LIMIT 1",
+            (value,),
+        )
+        return self._loan_record(rows[0]) if rows else None
+
+    def open_loans(self):
+        columns = ", ".join(HISTORY_COLUMNS.values())
+        rows = self._query(
+            f"SELECT {columns} FROM history WHERE status != 'Returned' ORDER BY loan_id"
+        )
+        return [self._loan_record(row) for row in rows]
+
+    def loan_watermark(self):
+        # Both answered from indexes: the rowid and the partial open-loan index.
+        last_loan_id = self._query("SELECT MAX(loan_id) FROM history")[0][0]
+        open_count = self._query("SELECT COUNT(*) FROM history WHERE status != 'Returned'")[0][0]
+        return last_loan_id or 0, open_count
+
+    def open_loan(self, book_id):
+        columns = ", ".join(HISTORY_COLUMNS.values())
+        rows = self._query(
+            f"SELECT {columns} FROM history WHERE book_id = ? AND status != 'Returned' ORDER BY loan_id LIMIT 1",
+            (book_id,),
+        )
+        return self._loan_record(rows[0]) if rows else None
+
+    def member(self, member_id):
+        columns = ", ".join(HISTORY_COLUMNS.values())
+        rows = self._query(f"SELECT {columns} FROM history WHERE member_id = ? ORDER BY loan_id", (member_id,))
+        return MemberRegistry(self._loan_record(row) for row in rows).get(member_id)
+
+    def search_titles(self, query, prefix=False):
+        pattern = query.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_") + "%"
+        if not prefix:
+            pattern = "%" + pattern
+        rows = self._query("SELECT title FROM books WHERE title LIKE ? ESCAPE '\\' ORDER BY rowid", (pattern,))
+        return [row[0] for row in rows]
+
+    def add_books(self, books):
+        with self._transaction():
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO books (book_id, title, author, genre, available, copies) VALUES (?, ?, ?, ?, ?, ?)",
+                [self._book_row(book) for book in books],
+            )
+
+    def update_book(self, book):
+        book_id, title, author, genre, available, copies = self._book_row(book)
+        with self._transaction():
+            self.conn.execute(
+                "UPDATE books SET title = ?, author = ?, genre = ?, available = ?, copies = ? WHERE book_id = ?",
+                (title, author, genre, available, copies, book_id),
+            )
+
+    def set_book_available(self, book_id, available):
+        with self._transaction():
+            self.conn.execute("UPDATE books SET available = ? WHERE book_id = ?", (int(available), book_id))
+
+    def delete_book(self, book_id):
+        with self._transaction():
+            self.conn.execute("DELETE FROM books WHERE book_id = ?", (book_id,))
+
+    def add_loans(self, loans):
+        loans = [normalize_loan(loan) for loan in loans]
+        columns = list(HISTORY_COLUMNS.values())
+        with self._transaction():
+            for loan in loans:
+                values = [loan[field] for field in HISTORY_COLUMNS]
+                if loan["Loan ID"] is None:
+                    cursor = self.conn.execute(
+                        f"INSERT INTO history ({', '.join(columns[1:])}) VALUES ({', '.join('?' * (len(columns) - 1))})",
+                        values[1:],
+                    )
+                    loan["Loan ID"] = cursor.lastrowid
+                else:
+                    self.conn.execute(
+                        f"INSERT INTO history ({', '.join(columns)}) VALUES ({', '.join('?' * len(columns))})",
+                        values,
+                    )
+        return loans
+
+    def update_loan(self, loan):
+        loan = normalize_loan(loan)
+        assignments = ", ".join(f"{column} = ?" for column in list(HISTORY_COLUMNS.values())[1:])
+        values = [loan[field] for field in HISTORY_COLUMNS]
+        with self._transaction():
+            self.conn.execute(f"UPDATE history SET {assignments} WHERE loan_id = ?", values[1:] + values[:1])
+
+    def delete_loans(self, loan_ids):
+        with self._transaction():
+            self.conn.executemany("DELETE FROM history WHERE loan_id = ?", [(loan_id,) for loan_id in loan_ids])
+
+    def close(self):
+        with self.lock:
+            self.conn.close()
+
+
+def migrate_pickle_to_sqlite(book_file=BOOK_FILE, history_file=HISTORY_FILE, db_file=DATABASE_FILE):
+    source = PickleStorage(book_file, history_file)
+    books = source.load_books()
+    history = source.load_history()
+
+    # Build the database next to the target and swap it in only once it is complete.
+    temp_file = db_file + ".tmp"
+    if os.path.exists(temp_file):
+        os.remove(temp_file)
+    target = SQLiteStorage(temp_file)
+    try:
+        target.add_books(books)
+        target.add_loans(history)
+        target.conn.execute("PRAGMA journal_mode=DELETE")
+    finally:
+        target.close()
+    os.replace(temp_file, db_file)
+    return len(books), len(history)
+
+
+def open_storage(kind=None):
+    kind = kind or os.environ.get("LIBRARY_STORAGE", "sqlite")
+    if kind == "pickle":
+        return PickleStorage()
+    if kind == "journal":
+        from Library_Journal import JOURNAL_FILE, SNAPSHOT_FILE, JournalStorage
+
+        fresh = not os.path.exists(SNAPSHOT_FILE) and not os.path.exists(JOURNAL_FILE)
+        storage = JournalStorage()
+        if fresh and (os.path.exists(BOOK_FILE) or os.path.exists(HISTORY_FILE)):
+            legacy = PickleStorage()
+            storage.add_books(legacy.load_books())
+            storage.add_loans(legacy.load_history())
+            storage.compact()
+        return storage
+    if not os.path.exists(DATABASE_FILE) and (os.path.exists(BOOK_FILE) or os.path.exists(HISTORY_FILE)):
+        migrate_pickle_to_sqlite()
+    return SQLiteStorage()
@@ -0,0 +1,84 @@
+import queue
+import threading
+
+from Library_Metrics import timer
+
+
+class IOWorker:
+    # Runs storage writes one at a time, in submission order, on a background
+    # thread. Completions are handed back to the Tk thread by polling with after().
+    # Jobs submitted with write=False (reads) are not counted as pending or failed saves.
+    def __init__(self, root, poll_interval=50):
+        self.root = root
+        self.poll_interval = poll_interval
+        self.pending = 0
+        self.failed = 0
+        self.last_error = None
+        self.listeners = []
+        self._jobs = queue.Queue()
+        self._results = queue.Queue()
+        self._thread = threading.Thread(target=self._run, name="library-io", daemon=True)
+        self._thread.start()
+        self._after_id = self.root.after(self.poll_interval, self.poll)
+
+    def submit(self, fn, *args, on_done=None, on_error=None, write=True):
+        if write:
+            self.pending += 1
+        self._jobs.put((fn, args, on_done, on_error, write))
+        if write:
+            self._notify()
+
+    def _run(self):
+        while True:
+            job = self._jobs.get()
+            if job is None:
+                break
+            fn, args, on_done, on_error, write = job
+            try:
+                with timer("io.write" if write else "io.read"):
+                    result = fn(*args)
+            except Exception as e:
+                self._results.put((on_error, e, False, write))
+            else:
+                self._results.put((on_done, result, True, write))
+
+    def poll(self):
+        self._after_id = None
+        self._drain()
+        self._after_id = self.root.after(self.poll_interval, self.poll)
+
+    def _drain(self):
+        changed = False
+        while True:
+            try:
+                callback, value, ok, write = self._results.get_nowait()
+            except queue.Empty:
+                break
+            if write:
+                changed = True
+                self.pending -= 1
+                if not ok:
+                    self.failed += 1
+                    self.last_error = value
+            if callback is not None:
+                callback(value)
+        if changed:
+            self._notify()
+
+    def _notify(self):
+        for listener in self.listeners:
+            listener(self)
+
+    def clear_failures(self):
+        self.failed = 0
+        self.last_error = None
+        self._notify()
+
+    def close(self):
+        # Let queued writes finish before the storage is closed.
+        self._jobs.put(None)
+        self._thread.join()
+        if self._after_id is not None:
+            self.root.after_cancel(self._after_id)
+            self._after_id = None
+        self._drain()
@@ -0,0 +1,165 @@
+import os
+import shutil
+
+import pytest
+
+from Library_Journal import JournalLocked, JournalStorage, encode_event
+
+
+def book(book_id, available=1):
+    return {"Book ID": book_id, "Book Title": f"Title {book_id}", "Available": available, "Copies": 1}
+
+
+@pytest.fixture
+def files(tmp_path):
+    return str(tmp_path / "library.snapshot"), str(tmp_path / "library.journal")
+
+
+def open_journal(files, **options):
+    return JournalStorage(*files, commit_delay=0, **options)
+
+
+def book_ids(storage):
+    return sorted(storage.book_ids())
+
+
+def fill(files):
+    storage = open_journal(files)
+    storage.add_books([book("B1"), book("B2")])
+    storage.set_book_available("B1", 0)
+    storage.add_loan({"Borrower Name": "Ann", "Book ID": "B1", "Date Borrowed": "2024-01-02"})
+    storage.close()
+
+
+def assert_filled(storage):
+    assert book_ids(storage) == ["B1", "B2"]
+    assert storage.get_book("B1")["Available"] == 0
+    assert [loan["Loan ID"] for loan in storage.load_history()] == [1]
+
+
+def test_reopen_replays_journal(files):
+    fill(files)
+    storage = open_journal(files)
+    try:
+        assert_filled(storage)
+    finally:
+        storage.close()
+
+
+@pytest.mark.parametrize("tail", [
+    # Torn write: the last line never got its newline.
+    encode_event(["add_books", [book("B3")]])[:-7],
+    # Damaged line: complete, but the checksum does not match.
+    encode_event(["add_books", [book("B3")]]).replace(b"B3", b"B4", 1),
+    b"garbage\n",
+])
+def test_bad_last_line_is_dropped(files, tail):
+    fill(files)
+    journal_file = files[1]
+    valid_size = os.path.getsize(journal_file)
+    with open(journal_file, "ab") as file:
+        file.write(tail)
+
+    storage = open_journal(files)
+    try:
+        assert_filled(storage)
+        assert os.path.getsize(journal_file) == valid_size
+        storage.add_books([book("B5")])
+    finally:
+        storage.close()
+
+    storage = open_journal(files)
+    try:
+        assert book_ids(storage) == ["B1", "B2", "B5"]
+    finally:
+        storage.close()
+
+
+def test_torn_batch_is_dropped_whole(files):
+    fill(files)
+    storage = open_journal(files)
+    with storage.batch():
+        storage.add_loan({"Borrower Name": "Bo", "Book ID": "B2"})
+        storage.set_book_available("B2", 0)
+    storage.close()
+    journal_file = files[1]
+    with open(journal_file, "r+b") as file:
+        file.truncate(os.path.getsize(journal_file) - 1)
+
+    storage = open_journal(files)
+    try:
+        assert storage.get_book("B2")["Available"] == 1
+        assert [loan["Loan ID"] for loan in storage.load_history()] == [1]
+    finally:
+        storage.close()
+
+
+def test_failed_batch_changes_nothing(files):
+    fill(files)
+    storage = open_journal(files)
+    try:
+        with pytest.raises(ValueError):
+            with storage.batch():
+                storage.set_book_available("B2", 0)
+                raise ValueError("write failed")
+        assert storage.get_book("B2")["Available"] == 1
+    finally:
+        storage.close()
+    storage = open_journal(files)
+    try:
+        assert storage.get_book("B2")["Available"] == 1
+    finally:
+        storage.close()
+
+
+def test_crash_after_rotation(files):
+    # Compaction moved the journal aside but died before the snapshot was in place.
+    fill(files)
+    snapshot_file, journal_file = files
+    os.replace(journal_file, journal_file + ".1")
+    with open(snapshot_file + ".tmp", "wb") as file:
+        file.write(b"half a snapshot")
+
+    storage = open_journal(files)
+    try:
+        assert_filled(storage)
+        storage.add_books([book("B3")])
+        storage.compact()
+        assert not os.path.exists(journal_file + ".1")
+    finally:
+        storage.close()
+
+    storage = open_journal(files)
+    try:
+        assert book_ids(storage) == ["B1", "B2", "B3"]
+    finally:
+        storage.close()
+
+
+def test_crash_before_rotated_journal_removed(files):
+    # The new snapshot is in place but the rotated journal is still there;
+    # replaying it over the snapshot must not change anything.
+    fill(files)
+    snapshot_file, journal_file = files
+    shutil.copy(journal_file, journal_file + ".keep")
+    storage = open_journal(files)
+    storage.compact()
+    storage.close()
+    assert os.path.exists(snapshot_file)
+    os.replace(journal_file + ".keep", journal_file + ".1")
+
+    storage = open_journal(files)
+    try:
+        assert_filled(storage)
+    finally:
+        storage.close()
+
+
+def test_second_open_is_refused(files):
+    storage = open_journal(files)
+    try:
+        with pytest.raises(JournalLocked):
+            open_journal(files)
+    finally:
+        storage.close()
+    open_journal(files).close()
@@ -0,0 +1,131 @@
+import pytest
+
+from Library_Records import Book, Loan, date_ordinal
+from Library_Snapshot import BookView, Layer, LoanView, Snapshot, SnapshotError, write_snapshot
+
+BOOKS = [
+    Book("B2", "Dune", "Frank Herbert", "Science Fiction", 1, 2),
+    Book("B1", "Ein Büchlein ☕", "", "", 0, 1),
+    Book("B3", "Dune", "Frank Herbert", "Science Fiction", 3, 3),
+]
+LOANS = [
+    Loan(7, "Ann Lee", "B1", "Ein Büchlein ☕", "2024-01-02", "2024-01-16", "Borrowed", 0, "M1"),
+    Loan(3, "Bo Chan", "B2", "Dune", "2023-12-01", "2023-12-20", "Returned", 25, "M2"),
+    # Dates that are not calendar dates are kept as written.
+    Loan(5, "Ann Lee", "B2", "Dune", "2024-02-30", "soon", "Borrowed", 0, "M1"),
+    Loan(9, "", "B3", "Dune", "", "", "Returned", 0, ""),
+]
+
+
+def write(path, books=BOOKS, loans=LOANS):
+    file_name = str(path / "library.snapshot")
+    with open(file_name, "wb") as file:
+        write_snapshot(file, books, loans)
+    return file_name
+
+
+@pytest.fixture
+def snapshot(tmp_path):
+    snapshot = Snapshot(write(tmp_path))
+    yield snapshot
+    snapshot.close()
+
+
+def test_round_trip(snapshot):
+    assert [dict(book) for book in snapshot.books()] == [dict(book) for book in BOOKS]
+    loans = sorted(LOANS, key=lambda loan: loan.loan_id)
+    assert [dict(loan) for loan in snapshot.loans()] == [dict(loan) for loan in loans]
+    assert snapshot.last_loan_id() == 9
+
+
+def test_dates_kept_as_written(snapshot):
+    loan = snapshot.get_loan(5)
+    assert loan["Date Borrowed"] == "2024-02-30"
+    assert loan["Date Return"] == "soon"
+    assert snapshot.get_loan(9)["Date Borrowed"] == ""
+    assert snapshot.get_loan(7).date_borrowed == date_ordinal("2024-01-02")
+
+
+def test_lookups(snapshot):
+    assert snapshot.get_book("B3") == BOOKS[2]
+    assert snapshot.get_book("B0") is None
+    assert snapshot.get_loan(3)["Fine"] == 25
+    assert snapshot.get_loan(4) is None
+    assert snapshot.open_loan_ids() == [5, 7]
+    assert snapshot.member_loan_ids("M1") == [5, 7]
+    assert snapshot.member_loan_ids("M9") == []
+
+
+def test_range_scans(snapshot):
+    assert [loan.loan_id for loan in snapshot.loans(4, 7)] == [5, 7]
+    assert [loan.loan_id for loan in snapshot.loans(first=6)] == [7, 9]
+    assert [loan.loan_id for loan in snapshot.loans(last=3)] == [3]
+    assert list(snapshot.loans(10)) == []
+    assert [book.book_id for book in snapshot.books_between("B1", "B2")] == ["B1", "B2"]
+    assert [book.book_id for book in snapshot.books_between(first="B2")] == ["B2", "B3"]
+
+
+def test_no_records(tmp_path):
+    snapshot = Snapshot(write(tmp_path, (), ()))
+    try:
+        assert list(snapshot.books()) == []
+        assert list(snapshot.loans()) == []
+        assert snapshot.get_book("B1") is None
+        assert snapshot.open_loan_ids() == []
+        assert snapshot.last_loan_id() == 0
+    finally:
+        snapshot.close()
+
+
+def test_empty_file(tmp_path):
+    file_name = tmp_path / "library.snapshot"
+    file_name.write_bytes(b"")
+    with pytest.raises(SnapshotError):
+        Snapshot(str(file_name))
+
+
+@pytest.mark.parametrize("damage", [
+    lambda data: data[:-1],
+    lambda data: data[:20],
+    lambda data: b"LIBSNAP1" + data[8:],
+    lambda data: b"not a snapshot at all" * 10,
+])
+def test_damaged_file(tmp_path, damage):
+    file_name = write(tmp_path)
+    with open(file_name, "rb") as file:
+        data = file.read()
+    with open(file_name, "wb") as file:
+        file.write(damage(data))
+    with pytest.raises(SnapshotError):
+        Snapshot(file_name)
+
+
+def test_layer_delete_and_re_add(snapshot):
+    books = Layer(BookView(snapshot))
+    assert books.pop("B2") == BOOKS[0]
+    assert "B2" not in books
+    assert list(books) == ["B1", "B3"]
+
+    readded = Book("B2", "Dune Messiah", "Frank Herbert", "Science Fiction", 1, 1)
+    books["B2"] = readded
+    assert books.get("B2") == readded
+    # A key the base still holds keeps its place.
+    assert list(books) == ["B2", "B1", "B3"]
+    assert dict(books.items())["B2"] == readded
+    assert books.changed_keys() == {"B2"}
+
+
+def test_layer_re_add_over_deleting_layer(snapshot):
+    loans = Layer(Layer(LoanView(snapshot)))
+    loans.base.pop(3)
+    assert 3 not in loans
+    assert list(loans.keys()) == [5, 7, 9]
+
+    loans[3] = Loan(3, "Bo Chan", "B2", "Dune", "2023-12-01", "2023-12-20", "Borrowed", 0, "M2")
+    assert loans.get(3)["Status"] == "Borrowed"
+    # Deleted below, so it comes back after the base's keys.
+    assert list(loans.keys()) == [5, 7, 9, 3]
+    assert [loan.loan_id for loan in loans.values()] == [5, 7, 9, 3]
+    assert loans.changed_keys() == {3}
+    loans.pop(3)
+    assert list(loans.keys()) == [5, 7, 9]